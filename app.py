@@ -1,8 +1,17 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_mail import Mail, Message
-from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
+import db_pool
+import password_hashing
+import db_storage
+import migrate
+from search_index import build_match_query, rank_expression
+from search_engine import ServiceIndex, SERVICE_INDEX_QUERIES
+from facets import FacetCounter
+from search_cache import SearchCache, normalize_query, service_changes_version
+from pagination import InvalidCursor, page_size, decode_cursor, keyset_condition, paginate
+from identity_cache import IdentityCache
+from page_cache import cached_page
 import pyotp
 import qrcode
 import io
@@ -11,10 +20,11 @@ from datetime import datetime, timedelta
 import secrets
 import os
 import json
+from functools import wraps
 
 # Import messaging system
-from messaging import socketio, init_messaging_db
-from messaging import (get_user_conversations, get_messages_for_conversation, 
+from messaging import socketio, init_messaging_db, message_ingest
+from messaging import (get_user_conversations, get_messages_for_conversation, get_messages_since,
                       user_has_access_to_conversation, get_existing_conversation, 
                       create_conversation, mark_messages_read)
 
@@ -38,29 +48,74 @@ login_manager.login_view = 'login'
 # Initialize SocketIO with your app
 socketio.init_app(app)
 
-# User class for Flask-Login
-class User(UserMixin):
-    def __init__(self, id, email, name, user_type='customer'):
+# Request-scoped pooled database connections
+db_pool.init_app(app)
+
+# Password hashing runs in worker processes, forked before any background thread starts
+password_hashing.start()
+
+# Service search backend: 'memory' (in-process index) or 'fts' (SQLite FTS5)
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'memory')
+service_index = ServiceIndex('myservicehub.db', SERVICE_INDEX_QUERIES['app'])
+search_cache = SearchCache(service_changes_version('myservicehub.db'))
+
+# User class for Flask-Login; slotted (UserMixin would add a __dict__) since one
+# is cached per active user
+class User:
+    __slots__ = ('id', 'email', 'name', 'user_type', 'is_verified')
+    COLUMNS = 'id, email, name, user_type, is_verified'
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, email, name, user_type='customer', is_verified=False):
         self.id = id
         self.email = email
         self.name = name
-        self.user_type = user_type
+        self.user_type = user_type or 'customer'
+        self.is_verified = bool(is_verified)
 
-@login_manager.user_loader
-def load_user(user_id):
-    conn = sqlite3.connect('myservicehub.db')
+    def get_id(self):
+        return str(self.id)
+
+def fetch_user(user_id):
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+    cursor.execute(f'SELECT {User.COLUMNS} FROM users WHERE id = ?', (user_id,))
     user_data = cursor.fetchone()
     conn.close()
-    
-    if user_data:
-        return User(user_data[0], user_data[1], user_data[2], user_data[6] if len(user_data) > 6 else 'customer')
-    return None
+    return User(*user_data) if user_data else None
+
+# Session -> user without a query per request; invalidate on any change to the columns above
+identity_cache = IdentityCache(fetch_user)
+
+@login_manager.user_loader
+def load_user(user_id):
+    return identity_cache.get(int(user_id))
+
+def session_user():
+    """The signed-in User (name, user_type, ...) from identity_cache; None without a valid session"""
+    return identity_cache.get(session['user_id']) if 'user_id' in session else None
+
+def require_user(user_type=None):
+    """Redirect to /login without a valid session user; to the other portal on a role mismatch"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            user = session_user()
+            if user is None:
+                session.clear()
+                return redirect('/login')
+            if user_type and user.user_type != user_type:
+                return redirect('/provider-portal' if user.user_type == 'provider' else '/customer-portal')
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
 
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     # Users table
@@ -144,38 +199,32 @@ def init_db():
     
     conn.commit()
     conn.close()
+    
+    # Apply versioned schema changes (indexes etc.)
+    migrate.run_migrations('myservicehub.db', 'app')
 
 # Routes
 @app.route('/')
+@cached_page
 def index():
     return render_template('index.html')
 
 @app.route('/customer-portal')
+@require_user('customer')
 def customer_portal():
-    if 'user_id' not in session:
-        return redirect('/login')
-    
-    if session.get('user_type') != 'customer':
-        return redirect('/provider-portal')
-    
     # Get customer's recent orders
-    orders = get_customer_orders(session['user_id'])
+    orders, next_cursor = get_customer_orders(session['user_id'])
     
-    return render_template('customer-portal.html', orders=orders)
+    return render_template('customer-portal.html', orders=orders, next_cursor=next_cursor)
 
 @app.route('/provider-portal')
+@require_user('provider')
 def provider_portal():
-    if 'user_id' not in session:
-        return redirect('/login')
-    
-    if session.get('user_type') != 'provider':
-        return redirect('/customer-portal')
-    
     # Get provider's orders and stats
-    orders = get_provider_orders(session['user_id'])
+    orders, next_cursor = get_provider_orders(session['user_id'])
     stats = get_provider_stats(session['user_id'])
     
-    return render_template('provider-portal.html', orders=orders, stats=stats)
+    return render_template('provider-portal.html', orders=orders, stats=stats, next_cursor=next_cursor)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -183,21 +232,28 @@ def login():
         email = request.form['email']
         password = request.form['password']
         
-        conn = sqlite3.connect('myservicehub.db')
+        conn = db_pool.connect('myservicehub.db')
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
+        cursor.execute(f'SELECT {User.COLUMNS}, password_hash FROM users WHERE email = ?', (email,))
         user_data = cursor.fetchone()
+        
+        matches, upgraded_hash = password_hashing.verify_password(user_data[-1], password) if user_data else (False, None)
+        if upgraded_hash:
+            # Stored hash used older parameters; replace it while we have the password
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (upgraded_hash, user_data[0]))
+            conn.commit()
+            identity_cache.invalidate(user_data[0])
         conn.close()
         
-        if user_data and check_password_hash(user_data[3], password):
-            session['user_id'] = user_data[0]
-            session['email'] = user_data[1]
-            session['name'] = user_data[2]
-            session['user_type'] = user_data[6] if len(user_data) > 6 else 'customer'
+        if matches:
+            user = User(*user_data[:-1])
+            login_user(user)
+            # Only the id: name, user_type etc. come from identity_cache on each request
+            session['user_id'] = user.id
             
             flash('Login successful!', 'success')
             
-            if session['user_type'] == 'provider':
+            if user.user_type == 'provider':
                 return redirect('/provider-portal')
             else:
                 return redirect('/customer-portal')
@@ -216,7 +272,7 @@ def register():
         user_type = request.form.get('user_type', 'customer')
         
         # Check if user already exists
-        conn = sqlite3.connect('myservicehub.db')
+        conn = db_pool.connect('myservicehub.db')
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
         
@@ -226,7 +282,7 @@ def register():
             return render_template('register.html')
         
         # Create new user
-        password_hash = generate_password_hash(password)
+        password_hash = password_hashing.hash_password(password)
         verification_token = secrets.token_urlsafe(32)
         
         cursor.execute('''
@@ -248,13 +304,14 @@ def register():
 
 @app.route('/logout')
 def logout():
+    logout_user()
     session.clear()
     flash('You have been logged out.', 'info')
     return redirect('/')
 
 @app.route('/verify/<token>')
 def verify_email(token):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     cursor.execute('SELECT id FROM users WHERE verification_token = ?', (token,))
     user = cursor.fetchone()
@@ -262,6 +319,7 @@ def verify_email(token):
     if user:
         cursor.execute('UPDATE users SET is_verified = TRUE, verification_token = NULL WHERE id = ?', (user[0],))
         conn.commit()
+        identity_cache.invalidate(user[0])
         flash('Email verified successfully! You can now login.', 'success')
     else:
         flash('Invalid verification token!', 'error')
@@ -272,11 +330,12 @@ def verify_email(token):
 # Messaging routes
 @app.route('/messages')
 def messages_page():
-    if 'user_id' not in session:
+    user = session_user()
+    if user is None:
         return redirect('/login')
     
-    user_id = session['user_id']
-    user_type = session.get('user_type', 'customer')
+    user_id = user.id
+    user_type = user.user_type
     
     conversations = get_user_conversations(user_id, user_type)
     
@@ -286,31 +345,46 @@ def messages_page():
 
 @app.route('/api/conversations')
 def api_conversations():
-    if 'user_id' not in session:
+    user = session_user()
+    if user is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    user_id = session['user_id']
-    user_type = session.get('user_type', 'customer')
+    user_id = user.id
+    user_type = user.user_type
     
     conversations = get_user_conversations(user_id, user_type)
     return jsonify({'conversations': conversations})
 
 @app.route('/api/messages/<int:conversation_id>')
 def api_messages(conversation_id):
-    if 'user_id' not in session:
+    if session_user() is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     if not user_has_access_to_conversation(session['user_id'], conversation_id):
         return jsonify({'error': 'Access denied'}), 403
     
-    messages = get_messages_for_conversation(conversation_id)
+    # ?since_id=N: only newer messages (incremental sync); otherwise the latest page
+    since_id = request.args.get('since_id')
+    try:
+        if since_id is not None:
+            messages, last_id, has_more = get_messages_since(conversation_id, since_id, request.args.get('limit'))
+        else:
+            messages, next_cursor = get_messages_for_conversation(
+                conversation_id, request.args.get('limit'), request.args.get('cursor'))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     mark_messages_read(conversation_id, session['user_id'])
     
-    return jsonify({'messages': messages})
+    if since_id is not None:
+        # has_more: call again with since_id=last_id
+        return jsonify({'messages': messages, 'last_id': last_id, 'has_more': has_more})
+    
+    # next_cursor pages further back in history
+    return jsonify({'messages': messages, 'next_cursor': next_cursor})
 
 @app.route('/api/start_conversation', methods=['POST'])
 def api_start_conversation():
-    if 'user_id' not in session:
+    if session_user() is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     data = request.get_json()
@@ -337,23 +411,58 @@ def enhanced_search():
         data = request.get_json()
         search_term = data.get('search_term', '')
         filters = data.get('filters', {})
+        limit = page_size(data.get('limit'))
+        cursor_token = data.get('cursor')
+        # Facets describe the whole result set, so only the first page computes them
+        with_facets = bool(data.get('facets')) and not cursor_token
+        
+        cache_key = normalize_query('api_search', {
+            'search_term': search_term, 'filters': filters, 'limit': limit,
+            'cursor': cursor_token, 'facets': with_facets
+        })
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+        
+        if app.config['SEARCH_BACKEND'] == 'memory':
+            service_list, next_cursor, facets = search_services_in_memory(
+                search_term, filters, limit, cursor_token, with_facets)
+            response = {
+                'success': True,
+                'results': service_list,
+                'total': len(service_list),
+                'next_cursor': next_cursor
+            }
+            if with_facets:
+                response['facets'] = facets
+            search_cache.put(cache_key, response)
+            return jsonify(response)
+        
+        # Search term filter (full-text index, see migrations/app/0002_services_fts.sql)
+        match_query = build_match_query(search_term)
+        
+        # Keyset order: best FTS rank first, else highest rating; newest breaks ties
+        if match_query:
+            sort_columns, descending = (rank_expression('s.rating'), '-s.id'), False
+        else:
+            sort_columns, descending = ('COALESCE(s.rating, 0)', 's.id'), True
         
         # Build search query
-        conn = sqlite3.connect('myservicehub.db')
+        conn = db_pool.connect('myservicehub.db')
         cursor = conn.cursor()
         
-        query = '''
-            SELECT s.*, u.name as provider_name
+        query = f'''
+            SELECT s.*, u.name as provider_name, {sort_columns[0]} AS sort_score
             FROM services s
             LEFT JOIN users u ON s.provider_id = u.id
-            WHERE 1=1
         '''
         params = []
         
-        # Search term filter
-        if search_term:
-            query += ' AND (s.title LIKE ? OR s.description LIKE ?)'
-            params.extend([f'%{search_term}%', f'%{search_term}%'])
+        if match_query:
+            query += ' JOIN services_fts ON services_fts.rowid = s.id WHERE services_fts MATCH ?'
+            params.append(match_query)
+        else:
+            query += ' WHERE 1=1'
         
         # Category filter
         if filters.get('category'):
@@ -376,12 +485,30 @@ def enhanced_search():
             query += ' AND s.rating >= ?'
             params.append(filters['rating'])
         
-        query += ' ORDER BY s.rating DESC, s.created_at DESC LIMIT 50'
+        order_by = ', '.join(f"{column} {'DESC' if descending else 'ASC'}" for column in sort_columns)
         
-        cursor.execute(query, params)
-        services = cursor.fetchall()
+        if with_facets:
+            # Single scan: keep the first page, count facets over every match
+            cursor.execute(f'{query} ORDER BY {order_by}', params)
+            facet_counter = FacetCounter(city_field='location')
+            services = []
+            for service in cursor:
+                facet_counter.add({'category': service[4], 'location': service[6],
+                                   'price': service[3], 'rating': service[7]})
+                if len(services) <= limit:
+                    services.append(service)
+        else:
+            condition, cursor_params = keyset_condition(
+                sort_columns, decode_cursor(cursor_token, 2), descending)
+            if condition:
+                query += f' AND {condition}'
+            cursor.execute(f'{query} ORDER BY {order_by} LIMIT ?', params + cursor_params + [limit + 1])
+            services = cursor.fetchall()
         conn.close()
         
+        services, next_cursor = paginate(
+            services, limit, lambda service: (service[10], -service[0] if match_query else service[0]))
+        
         # Convert to list of dictionaries
         service_list = []
         for service in services:
@@ -398,11 +525,16 @@ def enhanced_search():
             }
             service_list.append(service_dict)
         
-        return jsonify({
+        response = {
             'success': True,
             'results': service_list,
-            'total': len(service_list)
-        })
+            'total': len(service_list),
+            'next_cursor': next_cursor
+        }
+        if with_facets:
+            response['facets'] = facet_counter.result()
+        search_cache.put(cache_key, response)
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({
@@ -410,25 +542,65 @@ def enhanced_search():
             'error': str(e)
         }), 400
 
+@app.route('/api/search/stats')
+def search_stats():
+    stats = {'cache': search_cache.stats()}
+    if app.config['SEARCH_BACKEND'] == 'memory':
+        stats['index'] = service_index.stats()
+    return jsonify(stats)
+
+def search_services_in_memory(search_term, filters, limit, cursor_token=None, with_facets=False):
+    """Answer /api/search from the in-process index without touching SQLite"""
+    price_range = filters.get('priceRange', {})
+    rows, next_cursor, facets = service_index.search_page(
+        search_term,
+        limit=limit,
+        cursor=decode_cursor(cursor_token, 2),
+        with_facets=with_facets,
+        category=filters.get('category'),
+        city=filters.get('location'),
+        max_price=float(price_range['max']) if price_range.get('max') else None,
+        min_rating=float(filters['rating']) if filters.get('rating') else None
+    )
+    
+    return [{
+        'id': row['id'],
+        'title': row['title'],
+        'description': row['description'],
+        'price': row['price'],
+        'category': row['category'],
+        'provider_id': row['provider_id'],
+        'location': row['city'],
+        'rating': row['rating'],
+        'provider_name': row['business_name']
+    } for row in rows], next_cursor, facets
+
 # Order tracking routes
 @app.route('/orders')
 def orders_page():
-    if 'user_id' not in session:
+    user = session_user()
+    if user is None:
         return redirect('/login')
     
-    user_id = session['user_id']
-    user_type = session.get('user_type', 'customer')
+    user_id = user.id
+    user_type = user.user_type
     
-    if user_type == 'customer':
-        orders = get_customer_orders(user_id)
-    else:
-        orders = get_provider_orders(user_id)
+    limit = request.args.get('limit')
+    cursor_token = request.args.get('cursor')
+    
+    try:
+        if user_type == 'customer':
+            orders, next_cursor = get_customer_orders(user_id, limit, cursor_token)
+        else:
+            orders, next_cursor = get_provider_orders(user_id, limit, cursor_token)
+    except InvalidCursor:
+        return redirect('/orders')
     
-    return render_template('orders.html', orders=orders, user_type=user_type)
+    return render_template('orders.html', orders=orders, user_type=user_type, next_cursor=next_cursor)
 
 @app.route('/api/order/<int:order_id>/tracking')
 def api_order_tracking(order_id):
-    if 'user_id' not in session:
+    if session_user() is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     # Verify user has access to this order
@@ -440,7 +612,7 @@ def api_order_tracking(order_id):
 
 @app.route('/api/order/<int:order_id>/update_status', methods=['POST'])
 def api_update_order_status(order_id):
-    if 'user_id' not in session:
+    if session_user() is None:
         return jsonify({'error': 'Not authenticated'}), 401
     
     data = request.get_json()
@@ -485,44 +657,54 @@ def send_verification_email(email, name, token):
         print(f"Failed to send email: {e}")
         return False
 
-def get_customer_orders(customer_id):
-    conn = sqlite3.connect('myservicehub.db')
+def get_customer_orders(customer_id, limit=None, cursor_token=None):
+    """One page of orders, newest first; returns (orders, next_cursor)"""
+    limit = page_size(limit)
+    condition, cursor_params = keyset_condition(('o.created_at', 'o.id'), decode_cursor(cursor_token, 2))
+    
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT o.*, s.title as service_title, u.name as provider_name
         FROM orders o
         LEFT JOIN services s ON o.service_id = s.id
         LEFT JOIN users u ON o.provider_id = u.id
-        WHERE o.customer_id = ?
-        ORDER BY o.created_at DESC
-    ''', (customer_id,))
+        WHERE o.customer_id = ? {'AND ' + condition if condition else ''}
+        ORDER BY o.created_at DESC, o.id DESC
+        LIMIT ?
+    ''', [customer_id] + cursor_params + [limit + 1])
     
-    orders = cursor.fetchall()
+    orders = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
     conn.close()
     
-    return [dict(zip([column[0] for column in cursor.description], row)) for row in orders]
+    return paginate(orders, limit, lambda order: (order['created_at'], order['id']))
 
-def get_provider_orders(provider_id):
-    conn = sqlite3.connect('myservicehub.db')
+def get_provider_orders(provider_id, limit=None, cursor_token=None):
+    """One page of orders, newest first; returns (orders, next_cursor)"""
+    limit = page_size(limit)
+    condition, cursor_params = keyset_condition(('o.created_at', 'o.id'), decode_cursor(cursor_token, 2))
+    
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT o.*, s.title as service_title, u.name as customer_name
         FROM orders o
         LEFT JOIN services s ON o.service_id = s.id
         LEFT JOIN users u ON o.customer_id = u.id
-        WHERE o.provider_id = ?
-        ORDER BY o.created_at DESC
-    ''', (provider_id,))
+        WHERE o.provider_id = ? {'AND ' + condition if condition else ''}
+        ORDER BY o.created_at DESC, o.id DESC
+        LIMIT ?
+    ''', [provider_id] + cursor_params + [limit + 1])
     
-    orders = cursor.fetchall()
+    orders = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
     conn.close()
     
-    return [dict(zip([column[0] for column in cursor.description], row)) for row in orders]
+    return paginate(orders, limit, lambda order: (order['created_at'], order['id']))
 
 def get_provider_stats(provider_id):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     # Get basic stats
@@ -545,7 +727,7 @@ def get_provider_stats(provider_id):
     }
 
 def get_order_tracking(order_id):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -561,7 +743,7 @@ def get_order_tracking(order_id):
 
 def update_order_status(order_id, status, message, user_id):
     try:
-        conn = sqlite3.connect('myservicehub.db')
+        conn = db_pool.connect('myservicehub.db')
         cursor = conn.cursor()
         
         # Update order status
@@ -585,7 +767,7 @@ def update_order_status(order_id, status, message, user_id):
         return False
 
 def user_has_access_to_order(user_id, order_id):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -601,6 +783,10 @@ def user_has_access_to_order(user_id, order_id):
 # Initialize databases
 init_db()
 init_messaging_db()
+message_ingest.recover()
+db_storage.start_checkpoint_task('myservicehub.db')
+if app.config['SEARCH_BACKEND'] == 'memory':
+    service_index.load()
 
 # Error handlers
 @app.errorhandler(404)
@@ -611,6 +797,10 @@ def not_found(error):
 def internal_error(error):
     return render_template('500.html'), 500
 
+@app.errorhandler(password_hashing.HashingBusy)
+def hashing_busy(error):
+    return password_hashing.busy_response(error)
+
 # Run the application
 if __name__ == '__main__':
     # Create upload directory if it doesn't exist
@@ -1,15 +1,21 @@
-from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for
 import secrets
 import pyotp
 import qrcode
 from io import BytesIO
 import base64
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import smtplib
 from twilio.rest import Client
-import sqlite3
+import db_pool
+import password_hashing
+import rate_limit
+import db_storage
+import maintenance
+import migrate
+import outbox
+import otp_hmac
+import template_cache
+from page_cache import cached_page
+from session_store import SessionStore, ServerSessionInterface
 from datetime import datetime, timedelta
 import json
 import os
@@ -30,9 +36,36 @@ SMTP_PORT = 587
 EMAIL_ADDRESS = 'your_email@gmail.com'
 EMAIL_PASSWORD = 'your_app_password'
 
+# Wrong guesses allowed per OTP before it stops verifying
+MAX_OTP_ATTEMPTS = 5
+
+# Request-scoped pooled database connections
+db_pool.init_app(app)
+
+# Password hashing runs in worker processes, forked before any background thread starts
+password_hashing.start()
+
+# Sessions live in user_sessions; the cookie only carries a random token, so
+# logout and revocation take effect immediately
+session_store = SessionStore(DATABASE)
+app.session_interface = ServerSessionInterface(session_store)
+
+# Pages are compiled once (bytecode cached on disk); the ones without variables
+# are rendered once too
+template_cache.init_app(app, templates=['mfa/dashboard.html'],
+                        static_pages=['mfa/home.html', 'mfa/customer_portal.html', 'mfa/verify_mfa.html'])
+
+# Email/SMS are delivered by a background worker from the outbox table
+# (OUTBOX_TRANSPORT=live sends through SMTP/Twilio instead of the console)
+OUTBOX_TRANSPORTS = outbox.build_transports(
+    smtp_config={'server': SMTP_SERVER, 'port': SMTP_PORT,
+                 'username': EMAIL_ADDRESS, 'password': EMAIL_PASSWORD},
+    twilio_client=Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+    twilio_number=TWILIO_PHONE_NUMBER)
+
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     
     # Users table with MFA support
@@ -97,6 +130,9 @@ def init_db():
     
     conn.commit()
     conn.close()
+    
+    # Apply versioned schema changes (indexes etc.)
+    migrate.run_migrations(DATABASE, 'app_with_mfa')
 
 def require_auth(f):
     """Decorator to require authentication"""
@@ -108,565 +144,84 @@ def require_auth(f):
     return decorated_function
 
 def send_email_otp(email, otp_code):
-    """Send OTP via email (development mode - prints to console)"""
-    print(f"📧 EMAIL OTP for {email}: {otp_code}")
+    """Queue an OTP email for the outbox worker (printed to console in development)"""
+    outbox.start_worker(DATABASE, OUTBOX_TRANSPORTS)
+    outbox.enqueue(DATABASE, 'email', email,
+                   f"<p>Your MyServiceHub verification code is: <b>{otp_code}</b></p>",
+                   subject='MyServiceHub verification code',
+                   text=f"Your MyServiceHub verification code is: {otp_code}")
     return True
 
 def send_sms_otp(phone, otp_code):
-    """Send OTP via SMS (development mode - prints to console)"""
-    print(f"📱 SMS OTP for {phone}: {otp_code}")
+    """Queue an OTP SMS for the outbox worker (printed to console in development)"""
+    outbox.start_worker(DATABASE, OUTBOX_TRANSPORTS)
+    outbox.enqueue(DATABASE, 'sms', phone, f"Your MyServiceHub verification code is: {otp_code}")
     return True
 
 def generate_otp():
     """Generate a 6-digit OTP"""
     return str(secrets.randbelow(900000) + 100000)
 
+@db_storage.retry_on_busy
 def store_otp(user_id, otp_code, otp_type):
-    """Store OTP in database"""
-    conn = sqlite3.connect(DATABASE)
+    """Store OTP in database (as a keyed HMAC digest, never the code itself)"""
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     expires_at = datetime.now() + timedelta(minutes=10)
     
     cursor.execute('''
         INSERT INTO otp_codes (user_id, otp_code, otp_type, expires_at)
         VALUES (?, ?, ?, ?)
-    ''', (user_id, otp_code, otp_type, expires_at))
+    ''', (user_id, otp_hmac.digest(user_id, otp_type, otp_code), otp_type, expires_at))
     
     conn.commit()
     conn.close()
 
+@db_storage.retry_on_busy
 def verify_otp(user_id, otp_code, otp_type):
     """Verify OTP code"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     
+    # Every live code for this purpose (a resend does not revoke the earlier one)
     cursor.execute('''
-        SELECT id FROM otp_codes 
-        WHERE user_id = ? AND otp_code = ? AND otp_type = ? 
-        AND used = 0 AND expires_at > ?
-        ORDER BY created_at DESC LIMIT 1
-    ''', (user_id, otp_code, otp_type, datetime.now()))
+        SELECT id, otp_code FROM otp_codes 
+        WHERE user_id = ? AND otp_type = ? 
+        AND used = 0 AND expires_at > ? AND attempts < ?
+        ORDER BY created_at DESC
+    ''', (user_id, otp_type, datetime.now(), MAX_OTP_ATTEMPTS))
     
-    result = cursor.fetchone()
+    candidates = cursor.fetchall()
+    for otp_id, stored in candidates:
+        if otp_hmac.matches(stored, user_id, otp_type, otp_code):
+            # Mark OTP as used
+            cursor.execute('UPDATE otp_codes SET used = 1 WHERE id = ?', (otp_id,))
+            conn.commit()
+            conn.close()
+            return True
     
-    if result:
-        # Mark OTP as used
-        cursor.execute('UPDATE otp_codes SET used = 1 WHERE id = ?', (result[0],))
+    if candidates:
+        # Wrong guesses burn attempts so a 6-digit code cannot be brute forced
+        cursor.executemany('UPDATE otp_codes SET attempts = attempts + 1 WHERE id = ?',
+                           [(otp_id,) for otp_id, _ in candidates])
         conn.commit()
-        conn.close()
-        return True
-    
     conn.close()
     return False
 
 @app.route('/')
+@cached_page
 def home():
     """Homepage with navigation to customer portal"""
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>MyServiceHub - Secure Customer Portal</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
-        
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 2rem;
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            text-align: center;
-            backdrop-filter: blur(10px);
-        }
-        
-        .logo {
-            font-size: 3rem;
-            font-weight: bold;
-            color: #667eea;
-            margin-bottom: 1rem;
-        }
-        
-        h1 {
-            color: #333;
-            margin-bottom: 1rem;
-            font-size: 2.5rem;
-        }
-        
-        .subtitle {
-            color: #666;
-            margin-bottom: 2rem;
-            font-size: 1.2rem;
-        }
-        
-        .features {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 2rem;
-            margin: 3rem 0;
-        }
-        
-        .feature {
-            padding: 2rem;
-            background: white;
-            border-radius: 15px;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.1);
-            transition: transform 0.3s ease;
-        }
-        
-        .feature:hover {
-            transform: translateY(-5px);
-        }
-        
-        .feature-icon {
-            font-size: 3rem;
-            margin-bottom: 1rem;
-        }
-        
-        .feature h3 {
-            color: #333;
-            margin-bottom: 1rem;
-        }
-        
-        .cta-button {
-            display: inline-block;
-            padding: 1.2rem 3rem;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            text-decoration: none;
-            border-radius: 50px;
-            font-size: 1.2rem;
-            font-weight: bold;
-            transition: all 0.3s ease;
-            box-shadow: 0 10px 30px rgba(102, 126, 234, 0.3);
-            margin-top: 2rem;
-        }
-        
-        .cta-button:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 15px 40px rgba(102, 126, 234, 0.4);
-        }
-        
-        .stats {
-            display: flex;
-            justify-content: space-around;
-            margin-top: 3rem;
-            padding-top: 2rem;
-            border-top: 1px solid #eee;
-        }
-        
-        .stat {
-            text-align: center;
-        }
-        
-        .stat-number {
-            font-size: 2.5rem;
-            font-weight: bold;
-            color: #667eea;
-        }
-        
-        .stat-label {
-            color: #666;
-            font-size: 0.9rem;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="logo">🔐</div>
-        <h1>MyServiceHub</h1>
-        <p class="subtitle">Secure Multi-Factor Authentication Customer Portal</p>
-        
-        <div class="features">
-            <div class="feature">
-                <div class="feature-icon">🛡️</div>
-                <h3>Multi-Factor Security</h3>
-                <p>Advanced MFA with SMS, Email, and TOTP authentication for maximum security.</p>
-            </div>
-            
-            <div class="feature">
-                <div class="feature-icon">📱</div>
-                <h3>Mobile Optimized</h3>
-                <p>Fully responsive design that works seamlessly across all devices.</p>
-            </div>
-            
-            <div class="feature">
-                <div class="feature-icon">⚡</div>
-                <h3>Fast & Reliable</h3>
-                <p>Lightning-fast authentication with enterprise-grade reliability.</p>
-            </div>
-        </div>
-        
-        <a href="/customer-portal" class="cta-button">
-            🚀 Access Customer Portal
-        </a>
-        
-        <div class="stats">
-            <div class="stat">
-                <div class="stat-number">99.9%</div>
-                <div class="stat-label">Uptime</div>
-            </div>
-            <div class="stat">
-                <div class="stat-number">256-bit</div>
-                <div class="stat-label">Encryption</div>
-            </div>
-            <div class="stat">
-                <div class="stat-number">24/7</div>
-                <div class="stat-label">Support</div>
-            </div>
-        </div>
-    </div>
-</body>
-</html>
-    ''')
+    return template_cache.static_page('mfa/home.html')
 
 @app.route('/customer-portal')
+@cached_page
 def customer_portal():
     """Customer portal landing page"""
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
     
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Customer Portal - Login</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            padding: 20px;
-        }
-        
-        .auth-container {
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            backdrop-filter: blur(10px);
-            overflow: hidden;
-            max-width: 400px;
-            width: 100%;
-        }
-        
-        .auth-header {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 2rem;
-            text-align: center;
-        }
-        
-        .auth-header h2 {
-            margin-bottom: 0.5rem;
-        }
-        
-        .auth-body {
-            padding: 2rem;
-        }
-        
-        .auth-tabs {
-            display: flex;
-            margin-bottom: 2rem;
-            background: #f8f9fa;
-            border-radius: 10px;
-            overflow: hidden;
-        }
-        
-        .auth-tab {
-            flex: 1;
-            padding: 1rem;
-            text-align: center;
-            background: transparent;
-            border: none;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
-        
-        .auth-tab.active {
-            background: #667eea;
-            color: white;
-        }
-        
-        .auth-form {
-            display: none;
-        }
-        
-        .auth-form.active {
-            display: block;
-        }
-        
-        .form-group {
-            margin-bottom: 1.5rem;
-        }
-        
-        .form-group label {
-            display: block;
-            margin-bottom: 0.5rem;
-            color: #333;
-            font-weight: 500;
-        }
-        
-        .form-group input {
-            width: 100%;
-            padding: 1rem;
-            border: 2px solid #e9ecef;
-            border-radius: 10px;
-            font-size: 1rem;
-            transition: border-color 0.3s ease;
-        }
-        
-        .form-group input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-        
-        .btn {
-            width: 100%;
-            padding: 1rem 2rem;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            border-radius: 10px;
-            font-size: 1.1rem;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 10px 20px rgba(102, 126, 234, 0.3);
-        }
-        
-        .alert {
-            padding: 1rem;
-            border-radius: 10px;
-            margin-bottom: 1rem;
-            display: none;
-        }
-        
-        .alert.success {
-            background: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        
-        .alert.error {
-            background: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        
-        .back-link {
-            text-align: center;
-            margin-top: 2rem;
-        }
-        
-        .back-link a {
-            color: #667eea;
-            text-decoration: none;
-        }
-        
-        .back-link a:hover {
-            text-decoration: underline;
-        }
-    </style>
-</head>
-<body>
-    <div class="auth-container">
-        <div class="auth-header">
-            <h2>🔐 Customer Portal</h2>
-            <p>Secure Multi-Factor Authentication</p>
-        </div>
-        
-        <div class="auth-body">
-            <div class="auth-tabs">
-                <button class="auth-tab active" onclick="showForm('login')">Login</button>
-                <button class="auth-tab" onclick="showForm('register')">Register</button>
-            </div>
-            
-            <div id="alert" class="alert"></div>
-            
-            <!-- Login Form -->
-            <form id="login-form" class="auth-form active" onsubmit="handleLogin(event)">
-                <div class="form-group">
-                    <label for="login-username">Username</label>
-                    <input type="text" id="login-username" name="username" required>
-                </div>
-                <div class="form-group">
-                    <label for="login-password">Password</label>
-                    <input type="password" id="login-password" name="password" required>
-                </div>
-                <button type="submit" class="btn">🔓 Login</button>
-            </form>
-            
-            <!-- Register Form -->
-            <form id="register-form" class="auth-form" onsubmit="handleRegister(event)">
-                <div class="form-group">
-                    <label for="register-username">Username</label>
-                    <input type="text" id="register-username" name="username" required>
-                </div>
-                <div class="form-group">
-                    <label for="register-email">Email</label>
-                    <input type="email" id="register-email" name="email" required>
-                </div>
-                <div class="form-group">
-                    <label for="register-phone">Phone Number</label>
-                    <input type="tel" id="register-phone" name="phone" placeholder="+1234567890" required>
-                </div>
-                <div class="form-group">
-                    <label for="register-password">Password</label>
-                    <input type="password" id="register-password" name="password" required>
-                </div>
-                <div class="form-group">
-                    <label for="register-confirm">Confirm Password</label>
-                    <input type="password" id="register-confirm" name="confirm_password" required>
-                </div>
-                <button type="submit" class="btn">📝 Register</button>
-            </form>
-            
-            <div class="back-link">
-                <a href="/">← Back to Home</a>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        function showForm(formType) {
-            // Update tabs
-            document.querySelectorAll('.auth-tab').forEach(tab => {
-                tab.classList.remove('active');
-            });
-            document.querySelector(`[onclick="showForm('${formType}')"]`).classList.add('active');
-            
-            // Update forms
-            document.querySelectorAll('.auth-form').forEach(form => {
-                form.classList.remove('active');
-            });
-            document.getElementById(`${formType}-form`).classList.add('active');
-            
-            // Clear alerts
-            hideAlert();
-        }
-        
-        function showAlert(message, type) {
-            const alert = document.getElementById('alert');
-            alert.textContent = message;
-            alert.className = `alert ${type}`;
-            alert.style.display = 'block';
-        }
-        
-        function hideAlert() {
-            document.getElementById('alert').style.display = 'none';
-        }
-        
-        async function handleLogin(event) {
-            event.preventDefault();
-            
-            const formData = new FormData(event.target);
-            const data = {
-                username: formData.get('username'),
-                password: formData.get('password')
-            };
-            
-            try {
-                const response = await fetch('/api/login', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(data)
-                });
-                
-                const result = await response.json();
-                
-                if (result.success) {
-                    if (result.requires_mfa) {
-                        window.location.href = '/verify-mfa';
-                    } else {
-                        window.location.href = '/dashboard';
-                    }
-                } else {
-                    showAlert(result.message, 'error');
-                }
-            } catch (error) {
-                showAlert('An error occurred. Please try again.', 'error');
-            }
-        }
-        
-        async function handleRegister(event) {
-            event.preventDefault();
-            
-            const formData = new FormData(event.target);
-            const data = {
-                username: formData.get('username'),
-                email: formData.get('email'),
-                phone: formData.get('phone'),
-                password: formData.get('password'),
-                confirm_password: formData.get('confirm_password')
-            };
-            
-            if (data.password !== data.confirm_password) {
-                showAlert('Passwords do not match.', 'error');
-                return;
-            }
-            
-            try {
-                const response = await fetch('/api/register', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(data)
-                });
-                
-                const result = await response.json();
-                
-                if (result.success) {
-                    showAlert(result.message, 'success');
-                    setTimeout(() => {
-                        showForm('login');
-                    }, 2000);
-                } else {
-                    showAlert(result.message, 'error');
-                }
-            } catch (error) {
-                showAlert('An error occurred. Please try again.', 'error');
-            }
-        }
-    </script>
-</body>
-</html>
-    ''')
+    return template_cache.static_page('mfa/customer_portal.html')
 
 @app.route('/api/register', methods=['POST'])
 def api_register():
@@ -685,7 +240,7 @@ def api_register():
         if len(password) < 8:
             return jsonify({'success': False, 'message': 'Password must be at least 8 characters long.'})
         
-        conn = sqlite3.connect(DATABASE)
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Check if user already exists
@@ -695,7 +250,7 @@ def api_register():
             return jsonify({'success': False, 'message': 'Username or email already exists.'})
         
         # Create user
-        password_hash = generate_password_hash(password)
+        password_hash = password_hashing.hash_password(password)
         totp_secret = pyotp.random_base32()
         
         cursor.execute('''
@@ -723,10 +278,13 @@ def api_register():
             'message': 'Registration successful! Verification codes sent to your email and phone.'
         })
         
+    except password_hashing.HashingBusy as e:
+        return password_hashing.busy_response(e)
     except Exception as e:
         return jsonify({'success': False, 'message': 'Registration failed. Please try again.'})
 
 @app.route('/api/login', methods=['POST'])
+@rate_limit.limit(('login_ip', rate_limit.client_ip), ('login_account', rate_limit.json_field('username')))
 def api_login():
     """Handle user login"""
     try:
@@ -737,7 +295,7 @@ def api_login():
         if not username or not password:
             return jsonify({'success': False, 'message': 'Username and password are required.'})
         
-        conn = sqlite3.connect(DATABASE)
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -759,7 +317,8 @@ def api_login():
             return jsonify({'success': False, 'message': 'Account is temporarily locked. Try again later.'})
         
         # Verify password
-        if not check_password_hash(password_hash, password):
+        matches, upgraded_hash = password_hashing.verify_password(password_hash, password)
+        if not matches:
             # Increment failed attempts
             failed_attempts += 1
             lock_time = None
@@ -777,14 +336,16 @@ def api_login():
         
         # Reset failed attempts on successful login
         cursor.execute('''
-            UPDATE users SET failed_attempts = 0, locked_until = NULL, last_login = ?
+            UPDATE users SET failed_attempts = 0, locked_until = NULL, last_login = ?,
+                             password_hash = COALESCE(?, password_hash)
             WHERE id = ?
-        ''', (datetime.now(), user_id))
+        ''', (datetime.now(), upgraded_hash, user_id))
         
         conn.commit()
         conn.close()
         
-        # Set session
+        # Set session (fresh token, so one planted before login is useless)
+        session.regenerate()
         session['user_id'] = user_id
         session['username'] = db_username
         session['pending_mfa'] = True
@@ -805,6 +366,8 @@ def api_login():
             'message': 'Login successful. Please verify your identity with the codes sent to your email and phone.'
         })
         
+    except password_hashing.HashingBusy as e:
+        return password_hashing.busy_response(e)
     except Exception as e:
         return jsonify({'success': False, 'message': 'Login failed. Please try again.'})
 
@@ -814,301 +377,10 @@ def verify_mfa():
     if 'user_id' not in session or not session.get('pending_mfa'):
         return redirect(url_for('customer_portal'))
     
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Multi-Factor Authentication</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            padding: 20px;
-        }
-        
-        .mfa-container {
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            backdrop-filter: blur(10px);
-            overflow: hidden;
-            max-width: 500px;
-            width: 100%;
-        }
-        
-        .mfa-header {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 2rem;
-            text-align: center;
-        }
-        
-        .mfa-header h2 {
-            margin-bottom: 0.5rem;
-        }
-        
-        .mfa-body {
-            padding: 2rem;
-        }
-        
-        .verification-step {
-            background: white;
-            border: 2px solid #e9ecef;
-            border-radius: 15px;
-            padding: 2rem;
-            margin-bottom: 1.5rem;
-            transition: all 0.3s ease;
-        }
-        
-        .verification-step.completed {
-            border-color: #28a745;
-            background: #f8fff9;
-        }
-        
-        .step-header {
-            display: flex;
-            align-items: center;
-            margin-bottom: 1rem;
-        }
-        
-        .step-icon {
-            font-size: 2rem;
-            margin-right: 1rem;
-        }
-        
-        .step-title {
-            font-size: 1.2rem;
-            font-weight: bold;
-        }
-        
-        .form-group {
-            margin-bottom: 1.5rem;
-        }
-        
-        .form-group label {
-            display: block;
-            margin-bottom: 0.5rem;
-            color: #333;
-            font-weight: 500;
-        }
-        
-        .form-group input {
-            width: 100%;
-            padding: 1rem;
-            border: 2px solid #e9ecef;
-            border-radius: 10px;
-            font-size: 1.2rem;
-            text-align: center;
-            letter-spacing: 0.5rem;
-            transition: border-color 0.3s ease;
-        }
-        
-        .form-group input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-        
-        .btn {
-            width: 100%;
-            padding: 1rem 2rem;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            border-radius: 10px;
-            font-size: 1.1rem;
-            font-weight: bold;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            margin-top: 1rem;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 10px 20px rgba(102, 126, 234, 0.3);
-        }
-        
-        .btn:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-            transform: none;
-        }
-        
-        .alert {
-            padding: 1rem;
-            border-radius: 10px;
-            margin-bottom: 1rem;
-            display: none;
-        }
-        
-        .alert.success {
-            background: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        
-        .alert.error {
-            background: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        
-        .progress-bar {
-            background: #e9ecef;
-            border-radius: 10px;
-            height: 8px;
-            margin-bottom: 2rem;
-            overflow: hidden;
-        }
-        
-        .progress-fill {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            height: 100%;
-            width: 0%;
-            transition: width 0.3s ease;
-        }
-    </style>
-</head>
-<body>
-    <div class="mfa-container">
-        <div class="mfa-header">
-            <h2>🔐 Multi-Factor Authentication</h2>
-            <p>Please verify your identity</p>
-        </div>
-        
-        <div class="mfa-body">
-            <div class="progress-bar">
-                <div class="progress-fill" id="progress-fill"></div>
-            </div>
-            
-            <div id="alert" class="alert"></div>
-            
-            <form id="mfa-form" onsubmit="handleMFAVerification(event)">
-                <div class="verification-step" id="email-step">
-                    <div class="step-header">
-                        <div class="step-icon">📧</div>
-                        <div>
-                            <div class="step-title">Email Verification</div>
-                            <div>Enter the 6-digit code sent to your email</div>
-                        </div>
-                    </div>
-                    <div class="form-group">
-                        <input type="text" id="email-otp" name="email_otp" placeholder="000000" maxlength="6" required>
-                    </div>
-                </div>
-                
-                <div class="verification-step" id="sms-step">
-                    <div class="step-header">
-                        <div class="step-icon">📱</div>
-                        <div>
-                            <div class="step-title">SMS Verification</div>
-                            <div>Enter the 6-digit code sent to your phone</div>
-                        </div>
-                    </div>
-                    <div class="form-group">
-                        <input type="text" id="sms-otp" name="sms_otp" placeholder="000000" maxlength="6" required>
-                    </div>
-                </div>
-                
-                <button type="submit" class="btn" id="verify-btn">✅ Verify Identity</button>
-            </form>
-        </div>
-    </div>
-
-    <script>
-        let completedSteps = 0;
-        
-        function showAlert(message, type) {
-            const alert = document.getElementById('alert');
-            alert.textContent = message;
-            alert.className = `alert ${type}`;
-            alert.style.display = 'block';
-        }
-        
-        function hideAlert() {
-            document.getElementById('alert').style.display = 'none';
-        }
-        
-        function updateProgress() {
-            const progressFill = document.getElementById('progress-fill');
-            const progress = (completedSteps / 2) * 100;
-            progressFill.style.width = progress + '%';
-        }
-        
-        // Auto-format OTP inputs
-        document.querySelectorAll('input[type="text"]').forEach(input => {
-            input.addEventListener('input', function(e) {
-                this.value = this.value.replace(/[^0-9]/g, '');
-                if (this.value.length === 6) {
-                    // Auto-focus next field or submit
-                    const nextInput = this.closest('.verification-step').nextElementSibling?.querySelector('input');
-                    if (nextInput) {
-                        nextInput.focus();
-                    }
-                }
-            });
-        });
-        
-        async function handleMFAVerification(event) {
-            event.preventDefault();
-            
-            const formData = new FormData(event.target);
-            const data = {
-                email_otp: formData.get('email_otp'),
-                sms_otp: formData.get('sms_otp')
-            };
-            
-            const verifyBtn = document.getElementById('verify-btn');
-            verifyBtn.disabled = true;
-            verifyBtn.textContent = '🔄 Verifying...';
-            
-            try {
-                const response = await fetch('/api/verify-mfa', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(data)
-                });
-                
-                const result = await response.json();
-                
-                if (result.success) {
-                    showAlert('✅ Verification successful! Redirecting to dashboard...', 'success');
-                    setTimeout(() => {
-                        window.location.href = '/dashboard';
-                    }, 2000);
-                } else {
-                    showAlert('❌ ' + result.message, 'error');
-                    verifyBtn.disabled = false;
-                    verifyBtn.textContent = '✅ Verify Identity';
-                }
-            } catch (error) {
-                showAlert('❌ An error occurred. Please try again.', 'error');
-                verifyBtn.disabled = false;
-                verifyBtn.textContent = '✅ Verify Identity';
-            }
-        }
-        
-        // Initialize progress
-        updateProgress();
-    </script>
-</body>
-</html>
-    ''')
+    return template_cache.static_page('mfa/verify_mfa.html')
 
 @app.route('/api/verify-mfa', methods=['POST'])
+@rate_limit.limit(('verify_ip', rate_limit.client_ip), ('verify_user', rate_limit.session_value('user_id')))
 def api_verify_mfa():
     """Handle MFA verification"""
     if 'user_id' not in session or not session.get('pending_mfa'):
@@ -1152,250 +424,39 @@ def dashboard():
     username = session.get('username', 'User')
     
     # Get user stats
-    conn = sqlite3.connect(DATABASE)
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     
     cursor.execute('SELECT COUNT(*) FROM users')
     total_users = cursor.fetchone()[0]
     
-    cursor.execute('SELECT COUNT(*) FROM login_attempts WHERE success = 1')
-    successful_logins = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM otp_codes WHERE used = 1')
-    otp_verifications = cursor.fetchone()[0]
+    # Running totals kept by maintenance.py; raw rows are purged after a while
+    _, successful_logins = maintenance.login_totals(conn)
+    otp_verifications = maintenance.otp_verifications(conn)
     
     conn.close()
     
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Dashboard - MyServiceHub</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: #f8f9fa;
-            color: #333;
-        }
-        
-        .navbar {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 1rem 2rem;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-        }
-        
-        .navbar-brand {
-            font-size: 1.5rem;
-            font-weight: bold;
-        }
-        
-        .navbar-user {
-            display: flex;
-            align-items: center;
-            gap: 1rem;
-        }
-        
-        .btn-logout {
-            background: rgba(255, 255, 255, 0.2);
-            color: white;
-            border: 1px solid rgba(255, 255, 255, 0.3);
-            padding: 0.5rem 1rem;
-            border-radius: 5px;
-            text-decoration: none;
-            transition: all 0.3s ease;
-        }
-        
-        .btn-logout:hover {
-            background: rgba(255, 255, 255, 0.3);
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 2rem;
-        }
-        
-        .welcome-card {
-            background: white;
-            border-radius: 15px;
-            padding: 2rem;
-            margin-bottom: 2rem;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-            text-align: center;
-        }
-        
-        .welcome-card h1 {
-            color: #667eea;
-            margin-bottom: 1rem;
-        }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 2rem;
-            margin-bottom: 2rem;
-        }
-        
-        .stat-card {
-            background: white;
-            border-radius: 15px;
-            padding: 2rem;
-            text-align: center;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-            transition: transform 0.3s ease;
-        }
-        
-        .stat-card:hover {
-            transform: translateY(-5px);
-        }
-        
-        .stat-icon {
-            font-size: 3rem;
-            margin-bottom: 1rem;
-        }
-        
-        .stat-number {
-            font-size: 2.5rem;
-            font-weight: bold;
-            color: #667eea;
-            margin-bottom: 0.5rem;
-        }
-        
-        .stat-label {
-            color: #666;
-            font-size: 1rem;
-        }
-        
-        .features-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: 2rem;
-        }
-        
-        .feature-card {
-            background: white;
-            border-radius: 15px;
-            padding: 2rem;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-        }
-        
-        .feature-card h3 {
-            color: #667eea;
-            margin-bottom: 1rem;
-            display: flex;
-            align-items: center;
-            gap: 0.5rem;
-        }
-        
-        .feature-list {
-            list-style: none;
-            padding: 0;
-        }
-        
-        .feature-list li {
-            padding: 0.5rem 0;
-            display: flex;
-            align-items: center;
-            gap: 0.5rem;
-        }
-        
-        .feature-list li:before {
-            content: "✅";
-        }
-        
-        .security-status {
-            background: linear-gradient(135deg, #28a745 0%, #20c997 100%);
-            color: white;
-            border-radius: 15px;
-            padding: 2rem;
-            text-align: center;
-            margin-bottom: 2rem;
-        }
-        
-        .security-status h2 {
-            margin-bottom: 1rem;
-        }
-    </style>
-</head>
-<body>
-    <nav class="navbar">
-        <div class="navbar-brand">🔐 MyServiceHub</div>
-        <div class="navbar-user">
-            <span>Welcome, {{ username }}!</span>
-            <a href="/logout" class="btn-logout">Logout</a>
-        </div>
-    </nav>
-    
-    <div class="container">
-        <div class="welcome-card">
-            <h1>🎉 Welcome to Your Secure Dashboard!</h1>
-            <p>You have successfully authenticated with Multi-Factor Authentication. Your account is fully secured.</p>
-        </div>
-        
-        <div class="security-status">
-            <h2>🛡️ Account Security Status</h2>
-            <p><strong>FULLY SECURED</strong> - Multi-Factor Authentication Active</p>
-        </div>
-        
-        <div class="stats-grid">
-            <div class="stat-card">
-                <div class="stat-icon">👥</div>
-                <div class="stat-number">{{ total_users }}</div>
-                <div class="stat-label">Total Users</div>
-            </div>
-            
-            <div class="stat-card">
-                <div class="stat-icon">🔓</div>
-                <div class="stat-number">{{ successful_logins }}</div>
-                <div class="stat-label">Successful Logins</div>
-            </div>
-            
-            <div class="stat-card">
-                <div class="stat-icon">📱</div>
-                <div class="stat-number">{{ otp_verifications }}</div>
-                <div class="stat-label">OTP Verifications</div>
-            </div>
-        </div>
-        
-        <div class="features-grid">
-            <div class="feature-card">
-                <h3>🔐 Security Features</h3>
-                <ul class="feature-list">
-                    <li>Multi-Factor Authentication</li>
-                    <li>SMS & Email OTP Verification</li>
-                    <li>TOTP Support</li>
-                    <li>Account Lockout Protection</li>
-                    <li>Session Management</li>
-                </ul>
-            </div>
-            
-            <div class="feature-card">
-                <h3>📊 Account Features</h3>
-                <ul class="feature-list">
-                    <li>Secure Dashboard Access</li>
-                    <li>Real-time Security Status</li>
-                    <li>Login History Tracking</li>
-                    <li>Failed Attempt Monitoring</li>
-                    <li>Session Activity Logs</li>
-                </ul>
-            </div>
-        </div>
-    </div>
-</body>
-</html>
-    ''', username=username, total_users=total_users, successful_logins=successful_logins, otp_verifications=otp_verifications)
+    return render_template('mfa/dashboard.html', username=username, total_users=total_users, successful_logins=successful_logins, otp_verifications=otp_verifications)
+
+@app.route('/api/sessions')
+@require_auth
+def list_sessions():
+    """Active sessions (devices) of the current user"""
+    return jsonify({'success': True, 'sessions': session_store.list_user(session['user_id'])})
+
+@app.route('/api/sessions/<int:session_id>/revoke', methods=['POST'])
+@require_auth
+def revoke_session(session_id):
+    """Sign one device out"""
+    revoked = session_store.revoke(session['user_id'], session_id=session_id, keep_token=session.token)
+    return jsonify({'success': bool(revoked)})
+
+@app.route('/api/sessions/revoke-others', methods=['POST'])
+@require_auth
+def revoke_other_sessions():
+    """Sign out every device except this one"""
+    revoked = session_store.revoke(session['user_id'], keep_token=session.token)
+    return jsonify({'success': True, 'revoked': revoked})
 
 @app.route('/logout')
 def logout():
@@ -1412,4 +473,8 @@ if __name__ == '__main__':
     print("📧 OTP Codes will be printed to console for testing")
     
     init_db()
+    db_storage.start_checkpoint_task(DATABASE)
+    maintenance.start_task(DATABASE, maintenance.jobs(account_column='username',
+                                                      token_purge=maintenance.purge_otp_codes))
+    outbox.start_worker(DATABASE, OUTBOX_TRANSPORTS)
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,20 +1,30 @@
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, request, jsonify, send_from_directory, send_file, session
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 import json
 import os
 from datetime import datetime, timedelta
 import uuid
 import secrets
-import sqlite3
-import smtplib
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
+import io
+import db_pool
+import password_hashing
+import rate_limit
+import db_storage
+import audit_log
+import maintenance
+import migrate
+import geo
+import outbox
+import otp_hmac
+import qr_render
+import page_cache
+from static_assets import AssetPipeline
+from search_index import build_match_query, rank_expression
+from facets import FacetCounter
+from search_cache import SearchCache, normalize_query, service_changes_version
+from pagination import InvalidCursor, page_size, decode_cursor, keyset_condition, paginate
 import re
 import pyotp
-import qrcode
-import io
-import base64
 import random
 import string
 
@@ -23,6 +33,7 @@ app.secret_key = secrets.token_hex(32)
 CORS(app, supports_credentials=True)
 
 # Configuration
+DATABASE = 'data/myservicehub.db'
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -56,6 +67,28 @@ os.makedirs('data', exist_ok=True)
 os.makedirs('uploads', exist_ok=True)
 os.makedirs('static', exist_ok=True)
 
+# Request-scoped pooled database connections
+db_pool.init_app(app)
+
+# Password hashing runs in worker processes, forked before any background thread starts
+password_hashing.start()
+
+# TOTP enrollment QR codes are rendered in their own worker processes (same reason)
+qr_render.start()
+
+# Static files are fingerprinted and precompressed once at startup
+assets = AssetPipeline()
+assets.build()
+
+# Search result cache, dropped whenever service_changes moves
+search_cache = SearchCache(service_changes_version(DATABASE))
+
+# Login attempts are written behind the request in batches
+login_audit = audit_log.AuditLog('login_attempts', audit_log.sqlite_writer(
+    DATABASE, 'login_attempts', ('email', 'ip_address', 'success', 'user_agent', 'mfa_step', 'attempt_time')))
+# At import, like message_ingest.recover() in app.py, so WSGI workers replay the last shutdown's spill too
+login_audit.recover()
+
 # Initialize Twilio client (optional - for production SMS)
 try:
     from twilio.rest import Client
@@ -64,9 +97,16 @@ except:
     twilio_client = None
     print("Warning: Twilio not configured - using simulated SMS")
 
+# Email/SMS leave the request path through the outbox (OUTBOX_TRANSPORT=live to really send)
+OUTBOX_TRANSPORTS = outbox.build_transports(
+    smtp_config={'server': EMAIL_CONFIG['SMTP_SERVER'], 'port': EMAIL_CONFIG['SMTP_PORT'],
+                 'username': EMAIL_CONFIG['EMAIL'], 'password': EMAIL_CONFIG['PASSWORD']},
+    twilio_client=twilio_client,
+    twilio_number=TWILIO_CONFIG['PHONE_NUMBER'])
+
 # Enhanced Database initialization with MFA tables
 def init_db():
-    conn = sqlite3.connect('data/myservicehub.db')
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     
     # Users table with MFA fields
@@ -229,6 +269,9 @@ def init_db():
     
     conn.commit()
     conn.close()
+    
+    # Apply versioned schema changes (indexes etc.)
+    migrate.run_migrations(DATABASE, 'app_with_mfa_backup')
 
 # Utility functions
 def allowed_file(filename):
@@ -238,6 +281,10 @@ def generate_otp(length=6):
     """Generate numeric OTP"""
     return ''.join(random.choices(string.digits, k=length))
 
+def totp_provisioning_uri(email, secret):
+    """otpauth:// URI an authenticator app enrolls from (the QR code payload)"""
+    return pyotp.TOTP(secret).provisioning_uri(name=email, issuer_name="MyServiceHub")
+
 def generate_backup_codes(count=10):
     """Generate backup codes for account recovery"""
     codes = []
@@ -247,40 +294,14 @@ def generate_backup_codes(count=10):
     return codes
 
 def send_sms_otp(phone, otp):
-    """Send OTP via SMS using Twilio"""
-    try:
-        if not twilio_client:
-            # Simulated SMS for testing
-            print(f"📱 SMS OTP sent to {phone}: {otp}")
-            return True
-            
-        message = twilio_client.messages.create(
-            body=f"Your MyServiceHub verification code is: {otp}. Valid for 5 minutes.",
-            from_=TWILIO_CONFIG['PHONE_NUMBER'],
-            to=phone
-        )
-        print(f"📱 SMS sent to {phone}: {otp}")
-        return True
-    except Exception as e:
-        print(f"SMS Error: {e}")
-        # Fallback to console for testing
-        print(f"📱 SMS OTP (simulated) to {phone}: {otp}")
-        return True
+    """Queue an OTP SMS; the outbox worker sends it (Twilio in live mode)"""
+    outbox.start_worker(DATABASE, OUTBOX_TRANSPORTS)
+    outbox.enqueue(DATABASE, 'sms', phone,
+                   f"Your MyServiceHub verification code is: {otp}. Valid for 5 minutes.")
+    return True
 
-def send_email_otp(email, otp, purpose="login"):
-    """Send OTP via Email"""
-    try:
-        # For testing - print to console
-        print(f"📧 EMAIL OTP sent to {email}: {otp} (Purpose: {purpose})")
-        
-        # Uncomment below for actual email sending in production
-        """
-        msg = MimeMultipart()
-        msg['From'] = EMAIL_CONFIG['EMAIL']
-        msg['To'] = email
-        msg['Subject'] = f"MyServiceHub - Verification Code for {purpose.title()}"
-        
-        body = f'''
+def render_otp_email(otp, purpose):
+    return f'''
         <html>
         <body>
             <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; background-color: #f8f9fa; border-radius: 10px;">
@@ -309,28 +330,19 @@ def send_email_otp(email, otp, purpose="login"):
             </div>
         </body>
         </html>
-        '''
-        
-        msg.attach(MimeText(body, 'html'))
-        
-        server = smtplib.SMTP(EMAIL_CONFIG['SMTP_SERVER'], EMAIL_CONFIG['SMTP_PORT'])
-        server.starttls()
-        server.login(EMAIL_CONFIG['EMAIL'], EMAIL_CONFIG['PASSWORD'])
-        text = msg.as_string()
-        server.sendmail(EMAIL_CONFIG['EMAIL'], email, text)
-        server.quit()
-        """
-        
-        return True
-        
-    except Exception as e:
-        print(f"Email Error: {e}")
-        # Fallback to console for testing
-        print(f"📧 EMAIL OTP (simulated) to {email}: {otp}")
-        return True
+    '''
+
+def send_email_otp(email, otp, purpose="login"):
+    """Queue an OTP email; the outbox worker sends it over pooled SMTP in live mode"""
+    outbox.start_worker(DATABASE, OUTBOX_TRANSPORTS)
+    outbox.enqueue(DATABASE, 'email', email, render_otp_email(otp, purpose),
+                   subject=f"MyServiceHub - Verification Code for {purpose.title()}",
+                   text=f"Your verification code for {purpose} is: {otp}")
+    return True
 
+@db_storage.retry_on_busy
 def create_notification(user_id, title, message, type='info'):
-    conn = sqlite3.connect('data/myservicehub.db')
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO notifications (user_id, title, message, type)
@@ -339,13 +351,14 @@ def create_notification(user_id, title, message, type='info'):
     conn.commit()
     conn.close()
 
+@db_storage.retry_on_busy
 def create_mfa_token(user_id, token_type, token_value):
     """Create and store MFA token in database"""
-    conn = sqlite3.connect('data/myservicehub.db')
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     
-    # Hash the token for security
-    token_hash = generate_password_hash(token_value)
+    # Keyed HMAC: as safe as PBKDF2 for a short-lived code, at a fraction of the CPU
+    token_hash = otp_hmac.digest(user_id, token_type, token_value)
     expires_at = datetime.now() + timedelta(minutes=MFA_CONFIG['OTP_VALIDITY_MINUTES'])
     
     # Clean old tokens for this user and type
@@ -357,8 +370,8 @@ def create_mfa_token(user_id, token_type, token_value):
     # Insert new token
     cursor.execute('''
         INSERT INTO mfa_tokens (user_id, token_type, token_value, token_hash, expires_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, token_type, token_value, token_hash, expires_at))
+        VALUES (?, ?, '', ?, ?)
+    ''', (user_id, token_type, token_hash, expires_at))
     
     token_id = cursor.lastrowid
     conn.commit()
@@ -366,9 +379,10 @@ def create_mfa_token(user_id, token_type, token_value):
     
     return token_id
 
+@db_storage.retry_on_busy
 def verify_mfa_token(user_id, token_type, token_value):
     """Verify MFA token"""
-    conn = sqlite3.connect('data/myservicehub.db')
+    conn = db_pool.connect(DATABASE)
     cursor = conn.cursor()
     
     # Get valid token
@@ -393,7 +407,7 @@ def verify_mfa_token(user_id, token_type, token_value):
         return False, "Maximum attempts exceeded"
     
     # Verify token
-    if check_password_hash(token_hash, token_value):
+    if otp_hmac.matches(token_hash, user_id, token_type, token_value):
         # Mark token as used
         cursor.execute('''
             UPDATE mfa_tokens SET is_used = TRUE WHERE id = ?
@@ -411,17 +425,16 @@ def verify_mfa_token(user_id, token_type, token_value):
         return False, "Invalid token"
 
 def log_login_attempt(email, ip_address, success, user_agent="", mfa_step=""):
-    """Log login attempts for security monitoring"""
-    conn = sqlite3.connect('data/myservicehub.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO login_attempts (email, ip_address, success, user_agent, mfa_step)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (email, ip_address, success, user_agent, mfa_step))
-    
-    conn.commit()
+    """Log login attempts for security monitoring (queued; flushed by login_audit)"""
+    login_audit.log(email=email, ip_address=ip_address, success=success, user_agent=user_agent,
+                    mfa_step=mfa_step, attempt_time=audit_log.utc_timestamp())
+
+def get_user_location(user_id):
+    """Saved (latitude, longitude) of a user, (None, None) when not set"""
+    conn = db_pool.connect(DATABASE)
+    row = conn.execute('SELECT latitude, longitude FROM users WHERE id = ?', (user_id,)).fetchone()
     conn.close()
+    return tuple(row) if row else (None, None)
 
 # Enhanced Authentication Routes with MFA
 
@@ -445,7 +458,13 @@ def register():
         if not re.match(phone_pattern, data['phone'].replace(' ', '').replace('-', '')):
             return jsonify({'success': False, 'error': 'Invalid phone number format'}), 400
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        # Optional coordinates for radius search
+        try:
+            location = geo.parse_point(data.get('latitude'), data.get('longitude')) or (None, None)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid location coordinates'}), 400
+        
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Check if user exists
@@ -456,16 +475,18 @@ def register():
             return jsonify({'success': False, 'error': 'User already exists'}), 409
         
         # Create user
-        password_hash = generate_password_hash(data['password'])
+        password_hash = password_hashing.hash_password(data['password'])
         verification_token = secrets.token_urlsafe(32)
         
         cursor.execute('''
             INSERT INTO users (username, email, password_hash, full_name, phone, 
-                             address, city, pincode, role, verification_token, mfa_enabled)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                             address, city, pincode, role, verification_token, mfa_enabled,
+                             latitude, longitude)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (data['username'], data['email'], password_hash, data['full_name'], 
               data['phone'], data.get('address', ''), data.get('city', ''), 
-              data.get('pincode', ''), data.get('role', 'customer'), verification_token, True))
+              data.get('pincode', ''), data.get('role', 'customer'), verification_token, True,
+              location[0], location[1]))
         
         user_id = cursor.lastrowid
         conn.commit()
@@ -491,10 +512,13 @@ def register():
             'requires_verification': True
         })
         
+    except password_hashing.HashingBusy as e:
+        return password_hashing.busy_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/verify-registration', methods=['POST'])
+@rate_limit.limit(('verify_ip', rate_limit.client_ip), ('verify_user', rate_limit.session_value('temp_user_id')))
 def verify_registration():
     try:
         data = request.get_json()
@@ -520,7 +544,7 @@ def verify_registration():
             return jsonify({'success': False, 'error': f'SMS OTP: {sms_msg}'}), 400
         
         # Both OTPs verified, activate user
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -559,6 +583,7 @@ def verify_registration():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/resend-verification-otp', methods=['POST'])
+@rate_limit.limit(('resend_ip', rate_limit.client_ip), ('resend_user', rate_limit.session_value('temp_user_id')))
 def resend_verification_otp():
     try:
         data = request.get_json()
@@ -570,7 +595,7 @@ def resend_verification_otp():
         user_id = session['temp_user_id']
         
         # Get user details
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         cursor.execute('SELECT email, phone FROM users WHERE id = ?', (user_id,))
         user_data = cursor.fetchone()
@@ -600,6 +625,7 @@ def resend_verification_otp():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/login', methods=['POST'])
+@rate_limit.limit(('login_ip', rate_limit.client_ip), ('login_account', rate_limit.json_field('email')))
 def login():
     try:
         data = request.get_json()
@@ -610,7 +636,7 @@ def login():
         ip_address = request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
         user_agent = request.headers.get('User-Agent', '')
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -621,11 +647,17 @@ def login():
         
         user = cursor.fetchone()
         
-        if not user or not check_password_hash(user[3], data['password']):
+        matches, upgraded_hash = password_hashing.verify_password(user[3], data['password']) if user else (False, None)
+        if not matches:
             log_login_attempt(data['email'], ip_address, False, user_agent, 'password')
             conn.close()
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
         
+        if upgraded_hash:
+            # Stored hash used older parameters; replace it while we have the password
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (upgraded_hash, user[0]))
+            conn.commit()
+        
         if not user[6]:  # is_verified
             conn.close()
             return jsonify({'success': False, 'error': 'Please verify your account first'}), 401
@@ -683,10 +715,13 @@ def login():
                 }
             })
         
+    except password_hashing.HashingBusy as e:
+        return password_hashing.busy_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/verify-login-mfa', methods=['POST'])
+@rate_limit.limit(('verify_ip', rate_limit.client_ip), ('verify_user', rate_limit.session_value('temp_login_user_id')))
 def verify_login_mfa():
     try:
         data = request.get_json()
@@ -702,7 +737,7 @@ def verify_login_mfa():
         ip_address = request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
         user_agent = request.headers.get('User-Agent', '')
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -785,6 +820,7 @@ def verify_login_mfa():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/resend-login-otp', methods=['POST'])
+@rate_limit.limit(('resend_ip', rate_limit.client_ip), ('resend_user', rate_limit.session_value('temp_login_user_id')))
 def resend_login_otp():
     try:
         data = request.get_json()
@@ -796,7 +832,7 @@ def resend_login_otp():
         user_id = session['temp_login_user_id']
         
         # Get user details
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         cursor.execute('SELECT email, phone FROM users WHERE id = ?', (user_id,))
         user_data = cursor.fetchone()
@@ -834,7 +870,7 @@ def setup_mfa():
         data = request.get_json()
         mfa_type = data.get('type')  # 'enable', 'disable', 'generate_totp'
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         cursor.execute('SELECT email, mfa_enabled, mfa_secret FROM users WHERE id = ?', 
@@ -850,36 +886,23 @@ def setup_mfa():
         if mfa_type == 'generate_totp':
             # Generate new TOTP secret
             secret = pyotp.random_base32()
-            totp = pyotp.TOTP(secret)
-            
-            # Generate QR code
-            provisioning_uri = totp.provisioning_uri(
-                name=email,
-                issuer_name="MyServiceHub"
-            )
-            
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(provisioning_uri)
-            qr.make(fit=True)
-            
-            qr_img = qr.make_image(fill_color="black", back_color="white")
+            if mfa_secret:
+                qr_render.forget(totp_provisioning_uri(email, mfa_secret))
             
-            # Convert QR code to base64
-            buffer = io.BytesIO()
-            qr_img.save(buffer, format='PNG')
-            qr_code_data = base64.b64encode(buffer.getvalue()).decode()
+            # Render the QR code in the background; the client fetches it from qr_code_url
+            qr_render.prefetch(totp_provisioning_uri(email, secret))
             
             # Store secret temporarily (not enabled until verified)
             cursor.execute('''
-                UPDATE users SET mfa_secret = ? WHERE id = ?
-            ''', (secret, session['user_id']))
+                UPDATE users SET mfa_secret = ?, mfa_secret_issued_at = ? WHERE id = ?
+            ''', (secret, datetime.now(), session['user_id']))
             conn.commit()
             conn.close()
             
             return jsonify({
                 'success': True,
                 'secret': secret,
-                'qr_code': f"data:image/png;base64,{qr_code_data}",
+                'qr_code_url': f"/api/mfa/qr.{qr_render.QR_CONFIG['DEFAULT_FORMAT']}",
                 'manual_entry_key': secret
             })
         
@@ -906,10 +929,12 @@ def setup_mfa():
             
             # Enable MFA
             cursor.execute('''
-                UPDATE users SET mfa_enabled = TRUE, backup_codes = ? WHERE id = ?
+                UPDATE users SET mfa_enabled = TRUE, backup_codes = ?, mfa_secret_issued_at = NULL
+                WHERE id = ?
             ''', (backup_codes_json, session['user_id']))
             conn.commit()
             conn.close()
+            qr_render.forget(totp_provisioning_uri(email, mfa_secret))
             
             return jsonify({
                 'success': True,
@@ -925,7 +950,7 @@ def setup_mfa():
             if password:
                 cursor.execute('SELECT password_hash FROM users WHERE id = ?', (session['user_id'],))
                 password_hash = cursor.fetchone()[0]
-                if not check_password_hash(password_hash, password):
+                if not password_hashing.verify_password(password_hash, password)[0]:
                     conn.close()
                     return jsonify({'success': False, 'error': 'Invalid password'}), 400
             elif totp_code and mfa_secret:
@@ -939,11 +964,14 @@ def setup_mfa():
             
             # Disable MFA
             cursor.execute('''
-                UPDATE users SET mfa_enabled = FALSE, mfa_secret = NULL, backup_codes = NULL 
+                UPDATE users SET mfa_enabled = FALSE, mfa_secret = NULL, backup_codes = NULL,
+                                 mfa_secret_issued_at = NULL
                 WHERE id = ?
             ''', (session['user_id'],))
             conn.commit()
             conn.close()
+            if mfa_secret:
+                qr_render.forget(totp_provisioning_uri(email, mfa_secret))
             
             return jsonify({
                 'success': True,
@@ -954,6 +982,42 @@ def setup_mfa():
             conn.close()
             return jsonify({'success': False, 'error': 'Invalid MFA operation'}), 400
         
+    except password_hashing.HashingBusy as e:
+        return password_hashing.busy_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/mfa/qr.<fmt>')
+def mfa_qr_code(fmt):
+    """QR image for the TOTP secret issued by setup-mfa generate_totp, until enrollment is confirmed
+
+    It encodes the permanent second factor, so it is 404 once the secret is confirmed
+    or older than the enrollment window (qr_render CACHE_TTL_SECONDS)."""
+    try:
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'error': 'Please login first'}), 401
+        if fmt not in qr_render.MIMETYPES:
+            return jsonify({'success': False, 'error': 'Unsupported image format'}), 404
+        
+        conn = db_pool.connect(DATABASE)
+        cursor = conn.cursor()
+        enrollment_start = datetime.now() - timedelta(seconds=qr_render.QR_CONFIG['CACHE_TTL_SECONDS'])
+        cursor.execute('''
+            SELECT email, mfa_secret FROM users
+            WHERE id = ? AND mfa_secret IS NOT NULL AND mfa_secret_issued_at > ?
+        ''', (session['user_id'], enrollment_start))
+        user_data = cursor.fetchone()
+        conn.close()
+        
+        if not user_data:
+            return jsonify({'success': False, 'error': 'No TOTP enrollment in progress'}), 404
+        
+        image, mimetype = qr_render.get(totp_provisioning_uri(user_data[0], user_data[1]), fmt)
+        response = send_file(io.BytesIO(image), mimetype=mimetype)
+        # Encodes the TOTP secret: never let a shared cache keep it
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+        
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -971,7 +1035,14 @@ def provider_registration():
         if not all(field in data for field in required_fields):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        # Service area centre defaults to the user's saved location
+        try:
+            location = (geo.parse_point(data.get('latitude'), data.get('longitude'))
+                        or get_user_location(session['user_id']))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid location coordinates'}), 400
+        
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Check if user is already a provider
@@ -984,14 +1055,15 @@ def provider_registration():
         cursor.execute('''
             INSERT INTO service_providers (user_id, business_name, business_type, 
                                          description, services, experience, service_radius,
-                                         plan_type, plan_price)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                         plan_type, plan_price, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (session['user_id'], data['business_name'], data['business_type'],
               data.get('description', ''), json.dumps(data['services']),
               data.get('experience', 0), data.get('service_radius', 10),
-              data['plan_type'], data.get('plan_price', 0)))
+              data['plan_type'], data.get('plan_price', 0), location[0], location[1]))
         
         provider_id = cursor.lastrowid
+        geo.sync_provider_coverage(conn, provider_id)
         
         # Update user role
         cursor.execute('UPDATE users SET role = ? WHERE id = ?', ('provider', session['user_id']))
@@ -1014,10 +1086,86 @@ def provider_registration():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Service routes
+@app.route('/api/user/location', methods=['PUT'])
+def update_user_location():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'error': 'Please login first'}), 401
+        
+        data = request.get_json()
+        try:
+            location = geo.parse_point(data.get('latitude'), data.get('longitude'))
+        except ValueError:
+            location = None
+        if location is None:
+            return jsonify({'success': False, 'error': 'Valid latitude and longitude are required'}), 400
+        
+        conn = db_pool.connect(DATABASE)
+        conn.execute('UPDATE users SET latitude = ?, longitude = ? WHERE id = ?',
+                     (location[0], location[1], session['user_id']))
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': 'Location updated'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/provider/location', methods=['PUT'])
+def update_provider_location():
+    try:
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'error': 'Please login first'}), 401
+        
+        data = request.get_json()
+        try:
+            location = geo.parse_point(data.get('latitude'), data.get('longitude'))
+        except ValueError:
+            location = None
+        if location is None:
+            return jsonify({'success': False, 'error': 'Valid latitude and longitude are required'}), 400
+        
+        conn = db_pool.connect(DATABASE)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id, service_radius FROM service_providers WHERE user_id = ?', (session['user_id'],))
+        provider = cursor.fetchone()
+        if not provider:
+            conn.close()
+            return jsonify({'success': False, 'error': 'Not registered as provider'}), 404
+        
+        cursor.execute('''
+            UPDATE service_providers SET latitude = ?, longitude = ?, service_radius = ?
+            WHERE id = ?
+        ''', (location[0], location[1], data.get('service_radius', provider[1]), provider[0]))
+        geo.sync_provider_coverage(conn, provider[0])
+        
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': 'Service area updated'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/services', methods=['GET'])
 def get_services():
     try:
-        conn = sqlite3.connect('data/myservicehub.db')
+        args = request.args.to_dict()
+        if args.get('near') == 'me' and 'user_id' in session and not args.get('lat'):
+            # Search around the customer's saved location
+            args['lat'], args['lng'] = get_user_location(session['user_id'])
+        try:
+            area = geo.search_area(args)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid location parameters'}), 400
+        
+        cache_key = normalize_query('api_services', args)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+        
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Get query parameters
@@ -1027,17 +1175,36 @@ def get_services():
         min_price = request.args.get('min_price', type=float)
         max_price = request.args.get('max_price', type=float)
         min_rating = request.args.get('min_rating', type=float)
+        limit = page_size(request.args.get('limit'))
+        cursor_token = request.args.get('cursor')
+        # Facets describe the whole result set, so only the first page computes them
+        with_facets = request.args.get('facets') == 'true' and not cursor_token
+        
+        # Full-text search (see migrations/app_with_mfa_backup/0002_services_fts.sql)
+        match_query = build_match_query(search)
+        
+        # Keyset order: best FTS rank first, else highest rating; newest breaks ties
+        if match_query:
+            sort_columns, descending = (rank_expression('sp.rating'), '-s.id'), False
+        else:
+            sort_columns, descending = ('COALESCE(sp.rating, 0)', 's.id'), True
         
         # Build query
-        query = '''
-            SELECT s.*, sp.business_name, sp.rating, sp.total_reviews, u.city
+        query = f'''
+            SELECT s.*, sp.business_name, sp.rating, sp.total_reviews, u.city,
+                   {sort_columns[0]} AS sort_score
             FROM services s
             JOIN service_providers sp ON s.provider_id = sp.id
             JOIN users u ON sp.user_id = u.id
-            WHERE sp.status = 'active'
         '''
         params = []
         
+        if match_query:
+            query += " JOIN services_fts ON services_fts.rowid = s.id WHERE sp.status = 'active' AND services_fts MATCH ?"
+            params.append(match_query)
+        else:
+            query += " WHERE sp.status = 'active'"
+        
         if category:
             query += ' AND s.category = ?'
             params.append(category)
@@ -1046,11 +1213,6 @@ def get_services():
             query += ' AND u.city = ?'
             params.append(city)
         
-        if search:
-            query += ' AND (s.title LIKE ? OR s.description LIKE ? OR sp.business_name LIKE ?)'
-            search_term = f'%{search}%'
-            params.extend([search_term, search_term, search_term])
-        
         if min_price:
             query += ' AND s.price >= ?'
             params.append(min_price)
@@ -1063,12 +1225,59 @@ def get_services():
             query += ' AND sp.rating >= ?'
             params.append(min_rating)
         
-        query += ' ORDER BY sp.rating DESC, s.created_at DESC'
-        
-        cursor.execute(query, params)
-        services = cursor.fetchall()
+        # Radius search: only providers whose service_radius reaches the point.
+        # nearest=N is applied after the filters above, so it is never cut short
+        # by closer providers that do not match them
+        distances = {}
+        nearest = None
+        if area:
+            lat, lng, radius_km, nearest = area
+            distances = {provider_id: distance for distance, provider_id in
+                         geo.providers_covering(conn, lat, lng, radius_km)}
+            query += ' AND sp.id IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(list(distances)))
+        
+        order_by = ', '.join(f"{column} {'DESC' if descending else 'ASC'}" for column in sort_columns)
+        
+        if nearest:
+            # Nearest-N mode: every match, closest provider first (rank/rating within one provider),
+            # restricted to the N closest matching providers; a single page, no cursor
+            cursor.execute(f'{query} ORDER BY {order_by}', params)
+            by_distance = lambda provider_id: (distances[provider_id], provider_id)
+            matches = sorted(cursor.fetchall(), key=lambda service: by_distance(service[1]))
+            closest = set(sorted({service[1] for service in matches}, key=by_distance)[:nearest])
+            matches = [service for service in matches if service[1] in closest]
+            if with_facets:
+                facet_counter = FacetCounter()
+                for service in matches:
+                    facet_counter.add({'category': service[4], 'city': service[12],
+                                       'price': service[5], 'rating': service[10]})
+            services = matches[:limit]
+        elif with_facets:
+            # Single scan: keep the first page, count facets over every match
+            cursor.execute(f'{query} ORDER BY {order_by}', params)
+            facet_counter = FacetCounter()
+            services = []
+            for service in cursor:
+                facet_counter.add({'category': service[4], 'city': service[12],
+                                   'price': service[5], 'rating': service[10]})
+                if len(services) <= limit:
+                    services.append(service)
+        else:
+            condition, cursor_params = keyset_condition(
+                sort_columns, decode_cursor(cursor_token, 2), descending)
+            if condition:
+                query += f' AND {condition}'
+            cursor.execute(f'{query} ORDER BY {order_by} LIMIT ?', params + cursor_params + [limit + 1])
+            services = cursor.fetchall()
         conn.close()
         
+        if nearest:
+            next_cursor = None
+        else:
+            services, next_cursor = paginate(
+                services, limit, lambda service: (service[13], -service[0] if match_query else service[0]))
+        
         # Format results
         service_list = []
         for service in services:
@@ -1086,9 +1295,18 @@ def get_services():
                 'total_reviews': service[11],
                 'city': service[12]
             })
+            if area:
+                service_list[-1]['distance_km'] = distances.get(service[1])
         
-        return jsonify({'success': True, 'services': service_list})
+        response = {'success': True, 'services': service_list, 'next_cursor': next_cursor}
+        if with_facets:
+            response['facets'] = facet_counter.result()
         
+        search_cache.put(cache_key, response)
+        return jsonify(response)
+        
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1106,7 +1324,7 @@ def book_service():
         if not all(field in data for field in required_fields):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Get service details
@@ -1159,7 +1377,7 @@ def add_review():
         if not (1 <= data['rating'] <= 5):
             return jsonify({'success': False, 'error': 'Rating must be between 1 and 5'}), 400
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Add review
@@ -1184,6 +1402,9 @@ def add_review():
         conn.commit()
         conn.close()
         
+        # Provider rating changed; ranked search results are stale
+        search_cache.bump()
+        
         return jsonify({'success': True, 'message': 'Review added successfully!'})
         
     except Exception as e:
@@ -1201,7 +1422,7 @@ def process_payment():
         # Simulate payment processing
         transaction_id = f"TXN{datetime.now().strftime('%Y%m%d%H%M%S')}{secrets.token_hex(3).upper()}"
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         # Create payment record
@@ -1239,18 +1460,24 @@ def get_notifications():
         if 'user_id' not in session:
             return jsonify({'success': False, 'error': 'Please login first'}), 401
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        limit = page_size(request.args.get('limit'))
+        condition, cursor_params = keyset_condition(
+            ('created_at', 'id'), decode_cursor(request.args.get('cursor'), 2))
+        
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT id, title, message, type, is_read, created_at
-            FROM notifications WHERE user_id = ?
-            ORDER BY created_at DESC LIMIT 50
-        ''', (session['user_id'],))
+            FROM notifications WHERE user_id = ? {'AND ' + condition if condition else ''}
+            ORDER BY created_at DESC, id DESC LIMIT ?
+        ''', [session['user_id']] + cursor_params + [limit + 1])
         
         notifications = cursor.fetchall()
         conn.close()
         
+        notifications, next_cursor = paginate(notifications, limit, lambda notif: (notif[5], notif[0]))
+        
         notification_list = []
         for notif in notifications:
             notification_list.append({
@@ -1262,8 +1489,10 @@ def get_notifications():
                 'created_at': notif[5]
             })
         
-        return jsonify({'success': True, 'notifications': notification_list})
+        return jsonify({'success': True, 'notifications': notification_list, 'next_cursor': next_cursor})
         
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1274,7 +1503,7 @@ def get_dashboard(user_type):
         if 'user_id' not in session:
             return jsonify({'success': False, 'error': 'Please login first'}), 401
         
-        conn = sqlite3.connect('data/myservicehub.db')
+        conn = db_pool.connect(DATABASE)
         cursor = conn.cursor()
         
         if user_type == 'customer':
@@ -1344,17 +1573,25 @@ def logout():
 
 # Customer Portal Route
 @app.route('/customer-portal')
+@page_cache.cached_page
 def customer_portal():
     return send_from_directory('.', 'customer_portal_mfa.html')
 
-# Static file serving
+# Static file serving (cached whole for visitors without a session)
 @app.route('/')
+@page_cache.cached_page
 def index():
     return send_from_directory('.', 'customer_portal_mfa.html')
 
+# Fingerprinted URLs never change content: cached by browsers for a year
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    return assets.serve_fingerprinted(filename)
+
+# Allow-listed static types only (never Python sources, databases or config)
 @app.route('/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('.', filename)
+    return assets.serve(filename)
 
 @app.route('/api/health')
 def health_check():
@@ -1362,12 +1599,18 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'version': '2.0.0-MFA',
-        'mfa_enabled': MFA_CONFIG
+        'mfa_enabled': MFA_CONFIG,
+        'search_cache': search_cache.stats(),
+        'login_audit': login_audit.stats(),
+        'page_cache': page_cache.stats()
     })
 
 # Initialize database and run app
 if __name__ == '__main__':
     init_db()
+    db_storage.start_checkpoint_task(DATABASE)
+    maintenance.start_task(DATABASE, maintenance.jobs(token_purge=maintenance.purge_mfa_tokens))
+    outbox.start_worker(DATABASE, OUTBOX_TRANSPORTS)
     print("🔐 Starting MyServiceHub Customer Portal with Multi-Factor Authentication...")
     print("📊 Server: http://localhost:5000")
     print("🛡️ Customer Portal: http://localhost:5000/customer-portal")
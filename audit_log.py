@@ -0,0 +1,158 @@
+# audit_log.py - Write-behind audit events: ring buffer, batched inserts, spill file on shutdown
+import atexit
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+import db_pool
+import db_storage
+
+# Audit Log Configuration
+AUDIT_CONFIG = {
+    'CAPACITY': 20000,                  # Ring buffer size; oldest events are dropped past this
+    'BATCH_SIZE': 500,                  # Flush as soon as this many events are waiting
+    'FLUSH_INTERVAL_SECONDS': 1.0,      # ...or at least this often
+    'SPILL_DIR': 'data'                 # <name>.spill.jsonl holds events that missed the database
+}
+
+def utc_timestamp():
+    """Event time in the format CURRENT_TIMESTAMP would have written"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+def sqlite_writer(database, table, columns):
+    """Writer inserting event dicts into table with one executemany per batch"""
+    placeholders = ', '.join('?' for _ in columns)
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    @db_storage.retry_on_busy
+    def write(events):
+        conn = db_pool.connect(database)
+        try:
+            conn.executemany(statement, [tuple(event.get(column) for column in columns) for event in events])
+            conn.commit()
+        finally:
+            conn.close()
+    return write
+
+class AuditLog:
+    """Collects events in memory and hands them to writer(events) in batches"""
+
+    def __init__(self, name, writer, capacity=None):
+        self.name = name
+        self.writer = writer
+        self.spill_path = os.path.join(AUDIT_CONFIG['SPILL_DIR'], f'{name}.spill.jsonl')
+        self._buffer = deque(maxlen=capacity or AUDIT_CONFIG['CAPACITY'])
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0,
+                          'errors': 0, 'spilled': 0, 'recovered': 0}
+
+    def log(self, **event):
+        """Queue one event; never touches the database on the caller's thread"""
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._counters['dropped'] += 1
+            self._buffer.append(event)
+            self._counters['enqueued'] += 1
+            full = len(self._buffer) >= AUDIT_CONFIG['BATCH_SIZE']
+        if self._thread is None:
+            self.start()
+        if full:
+            self._wake.set()
+
+    def _take(self):
+        with self._lock:
+            batch = [self._buffer.popleft() for _ in range(min(len(self._buffer), AUDIT_CONFIG['BATCH_SIZE']))]
+        return batch
+
+    def _requeue(self, batch):
+        with self._lock:
+            room = self._buffer.maxlen - len(self._buffer)
+            # Keep the newest events when the buffer cannot take the whole batch back
+            self._counters['dropped'] += max(0, len(batch) - room)
+            self._buffer.extendleft(reversed(batch[-room:] if room else []))
+
+    def flush(self):
+        """Write everything buffered; returns False when the writer failed (events kept)"""
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return True
+                try:
+                    self.writer(batch)
+                except Exception as e:
+                    self._counters['errors'] += 1
+                    print(f"Audit log {self.name} flush failed: {e}")
+                    self._requeue(batch)
+                    return False
+                self._counters['written'] += len(batch)
+                self._counters['batches'] += 1
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(AUDIT_CONFIG['FLUSH_INTERVAL_SECONDS'])
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name=f'audit-{self.name}', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def recover(self):
+        """Replay events spilled by a previous shutdown; call once at startup"""
+        if not os.path.exists(self.spill_path):
+            return 0
+        recovering = self.spill_path + '.recovering'
+        try:
+            os.replace(self.spill_path, recovering)
+        except FileNotFoundError:
+            return 0                    # Another worker took it
+        with open(recovering, encoding='utf-8') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        with self._lock:
+            self._buffer.extendleft(reversed(events))
+            self._counters['recovered'] += len(events)
+        if self.flush():
+            os.remove(recovering)
+        else:
+            # Still undeliverable: keep them for the next start
+            self._spill_pending(recovering)
+        return len(events)
+
+    def _spill_pending(self, replace_path=None):
+        with self._lock:
+            events = list(self._buffer)
+            self._buffer.clear()
+        os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if replace_path:
+            os.remove(replace_path)
+        self._counters['spilled'] += len(events)
+
+    def close(self):
+        """Stop the flusher; whatever cannot be written now goes to the spill file"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if not self.flush():
+            self._spill_pending()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, buffered=len(self._buffer))
@@ -0,0 +1,237 @@
+# db_pool.py - Shared SQLite connection pool for the MyServiceHub apps
+import sqlite3
+import threading
+import time
+
+from flask import g, has_app_context, current_app
+
+import db_storage
+
+try:
+    from greenlet import getcurrent as _current_greenlet
+except ImportError:
+    _current_greenlet = None
+
+# Pool Configuration
+POOL_CONFIG = {
+    'MAX_SIZE': 10,                # Maximum open connections per database file
+    'ACQUIRE_TIMEOUT': 5.0,        # Seconds to wait for a free connection
+    'HEALTH_CHECK_INTERVAL': 30    # Re-validate idle connections older than this (seconds)
+}
+
+def _owner_key():
+    """Identify the current thread or greenlet that holds a lease"""
+    if _current_greenlet is not None:
+        return id(_current_greenlet())
+    return threading.get_ident()
+
+class PooledConnection:
+    """Proxy around a pooled sqlite3 connection; close() returns it to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._closed = False
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool.release(self._conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self.close()
+        return False
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections reused per thread/greenlet"""
+
+    def __init__(self, database, max_size=None, acquire_timeout=None,
+                 health_check_interval=None, on_connect=None):
+        self.database = database
+        self.max_size = max_size or POOL_CONFIG['MAX_SIZE']
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else POOL_CONFIG['ACQUIRE_TIMEOUT']
+        self.health_check_interval = health_check_interval if health_check_interval is not None else POOL_CONFIG['HEALTH_CHECK_INTERVAL']
+        self.on_connect = on_connect
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle = []      # [(conn, released_at)]
+        self._leases = {}    # owner key -> [conn, depth]
+        self._stats = {'created': 0, 'reused': 0, 'discarded': 0, 'timeouts': 0}
+
+    def _create(self):
+        conn = sqlite3.connect(self.database,
+                               timeout=db_storage.STORAGE_CONFIG['BUSY_TIMEOUT_MS'] / 1000,
+                               check_same_thread=False)
+        if self.on_connect:
+            self.on_connect(conn)
+        self._stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, released_at):
+        """Run a cheap probe on connections that have been idle for a while"""
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """Lease a connection; nested calls from the same owner share it"""
+        key = _owner_key()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease:
+                lease[1] += 1
+                self._stats['reused'] += 1
+                return lease[0]
+
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self._stats['timeouts'] += 1
+            raise sqlite3.OperationalError(f'connection pool exhausted for {self.database}')
+
+        conn = None
+        try:
+            while conn is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    conn = self._create()
+                elif self._is_healthy(*idle):
+                    conn = idle[0]
+                    self._stats['reused'] += 1
+                else:
+                    self._discard(idle[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._leases[key] = [conn, 1]
+        return conn
+
+    def release(self, conn, force=False):
+        """Drop one lease level; the outermost release returns the connection to the pool"""
+        key = _owner_key()
+        with self._lock:
+            lease = self._leases.get(key)
+            if not lease or lease[0] is not conn:
+                lease = None
+                for owner, candidate in self._leases.items():
+                    if candidate[0] is conn:
+                        key, lease = owner, candidate
+                        break
+            if not lease:
+                return
+            lease[1] = 0 if force else lease[1] - 1
+            if lease[1] > 0:
+                return
+            del self._leases[key]
+
+        try:
+            # Never hand uncommitted work to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        except sqlite3.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def owner_in_transaction(self):
+        """True when the connection held by the caller has uncommitted work"""
+        with self._lock:
+            lease = self._leases.get(_owner_key())
+        return bool(lease and lease[0].in_transaction)
+
+    def rollback_owner(self):
+        """Roll back the open transaction on the connection held by the caller"""
+        with self._lock:
+            lease = self._leases.get(_owner_key())
+        if lease and lease[0].in_transaction:
+            lease[0].rollback()
+
+    def _discard(self, conn):
+        self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def connect(self):
+        """Return a proxied connection that behaves like sqlite3.connect()"""
+        return PooledConnection(self, self.acquire())
+
+    def close_all(self):
+        """Close idle connections (used on shutdown and in tests)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle), leased=len(self._leases),
+                        max_size=self.max_size)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(database):
+    """Return the process-wide pool for a database file"""
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                pool = _pools[database] = ConnectionPool(
+                    database, on_connect=db_storage.configure_connection)
+    return pool
+
+def in_transaction():
+    """True when the caller holds a connection with uncommitted work in any pool"""
+    return any(pool.owner_in_transaction() for pool in list(_pools.values()))
+
+def rollback_current():
+    """Roll back the caller's open transactions in every pool"""
+    for pool in list(_pools.values()):
+        pool.rollback_owner()
+
+def get_db(database):
+    """Request-scoped connection bound to flask.g, released on app context teardown"""
+    connections = g.setdefault('_db_pool_connections', {})
+    if database not in connections:
+        connections[database] = get_pool(database).acquire()
+    return connections[database]
+
+def connect(database):
+    """Drop-in replacement for sqlite3.connect() backed by the shared pool"""
+    pool = get_pool(database)
+    if has_app_context() and 'db_pool' in current_app.extensions:
+        # Pin the connection for the whole request so helpers share it
+        get_db(database)
+    return pool.connect()
+
+def _release_request_connections(exception=None):
+    connections = g.pop('_db_pool_connections', {})
+    for database, conn in connections.items():
+        # Also reclaims leases leaked by helpers that raised before close()
+        get_pool(database).release(conn, force=True)
+
+def init_app(app):
+    """Register request-scoped connection handling on a Flask app"""
+    app.extensions['db_pool'] = True
+    app.teardown_appcontext(_release_request_connections)
@@ -0,0 +1,102 @@
+# db_storage.py - SQLite storage configuration (WAL, PRAGMAs, busy handling, checkpoints)
+import sqlite3
+import threading
+import time
+import random
+from functools import wraps
+
+import db_pool
+
+# Storage Configuration
+STORAGE_CONFIG = {
+    'JOURNAL_MODE': 'WAL',              # Readers no longer block on chat writers
+    'SYNCHRONOUS': 'NORMAL',            # Safe with WAL; fsync only at checkpoints
+    'BUSY_TIMEOUT_MS': 5000,            # SQLite-level wait before raising SQLITE_BUSY
+    'CACHE_SIZE_KIB': 16384,            # Page cache per connection (negative PRAGMA value = KiB)
+    'MMAP_SIZE': 128 * 1024 * 1024,     # Memory-mapped I/O window in bytes
+    'TEMP_STORE': 'MEMORY',             # Sorts and temp indexes stay off disk
+    'BUSY_RETRIES': 5,                  # Application-level retries after SQLITE_BUSY
+    'BUSY_BACKOFF_SECONDS': 0.05,       # Base delay, doubled per retry with jitter
+    'CHECKPOINT_INTERVAL_SECONDS': 60,  # Background WAL checkpoint cadence
+    'CHECKPOINT_TRUNCATE_PAGES': 10000  # Truncate the WAL once it grows past this many pages
+}
+
+_journal_configured = set()
+_journal_lock = threading.Lock()
+
+def configure_connection(conn):
+    """Apply per-connection PRAGMAs; journal mode is set once per database file"""
+    database = conn.execute('PRAGMA database_list').fetchone()[2]
+    if database and database not in _journal_configured:
+        with _journal_lock:
+            if database not in _journal_configured:
+                conn.execute(f"PRAGMA journal_mode = {STORAGE_CONFIG['JOURNAL_MODE']}")
+                _journal_configured.add(database)
+
+    conn.execute(f"PRAGMA synchronous = {STORAGE_CONFIG['SYNCHRONOUS']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(STORAGE_CONFIG['BUSY_TIMEOUT_MS'])}")
+    conn.execute(f"PRAGMA cache_size = -{int(STORAGE_CONFIG['CACHE_SIZE_KIB'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(STORAGE_CONFIG['MMAP_SIZE'])}")
+    conn.execute(f"PRAGMA temp_store = {STORAGE_CONFIG['TEMP_STORE']}")
+
+def is_busy_error(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED surfaced as OperationalError"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def retry_on_busy(func):
+    """Retry a write helper with exponential backoff when the database is busy
+
+    Only when the caller had no uncommitted work on entry: the rollback before a
+    retry would also discard it (e.g. earlier writes on a request-pinned connection)."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = 0 if db_pool.in_transaction() else STORAGE_CONFIG['BUSY_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if attempt == retries or not is_busy_error(e):
+                    raise
+                # Drop the half-applied transaction (opened by func) before trying again
+                db_pool.rollback_current()
+                delay = STORAGE_CONFIG['BUSY_BACKOFF_SECONDS'] * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+    return wrapper
+
+def checkpoint(database, mode='PASSIVE'):
+    """Run a WAL checkpoint; returns (busy, wal_pages, checkpointed_pages)"""
+    conn = sqlite3.connect(database, timeout=STORAGE_CONFIG['BUSY_TIMEOUT_MS'] / 1000)
+    try:
+        return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+    finally:
+        conn.close()
+
+_checkpoint_threads = {}
+
+def _checkpoint_loop(database, stop_event):
+    while not stop_event.wait(STORAGE_CONFIG['CHECKPOINT_INTERVAL_SECONDS']):
+        try:
+            busy, wal_pages, _ = checkpoint(database)
+            if not busy and wal_pages > STORAGE_CONFIG['CHECKPOINT_TRUNCATE_PAGES']:
+                checkpoint(database, 'TRUNCATE')
+        except sqlite3.Error as e:
+            print(f"WAL checkpoint error for {database}: {e}")
+
+def start_checkpoint_task(database):
+    """Start the periodic checkpoint thread for a database (idempotent)"""
+    if database in _checkpoint_threads:
+        return _checkpoint_threads[database][1]
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_checkpoint_loop, args=(database, stop_event),
+                              name=f'wal-checkpoint-{database}', daemon=True)
+    _checkpoint_threads[database] = (thread, stop_event)
+    thread.start()
+    return stop_event
+
+def stop_checkpoint_tasks():
+    for thread, stop_event in _checkpoint_threads.values():
+        stop_event.set()
+    _checkpoint_threads.clear()
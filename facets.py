@@ -0,0 +1,72 @@
+# facets.py - Facet histograms (category, city, price, rating) for search results
+import bisect
+
+# Facet Configuration
+FACET_CONFIG = {
+    'MAX_VALUES': 20,       # Highest-count values returned per facet
+    'PRICE_BUCKETS': (0, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+    'RATING_BUCKETS': (0, 1, 2, 3, 4, 5)
+}
+
+FACET_NAMES = ('category', 'city', 'price', 'rating')
+
+def bucket_index(bounds, value):
+    """Bucket of a numeric value, or None when it has no value"""
+    if value is None:
+        return None
+    return max(bisect.bisect_right(bounds, float(value)) - 1, 0)
+
+def bucket_label(bounds, index):
+    if index + 1 < len(bounds):
+        return f'{bounds[index]}-{bounds[index + 1]}'
+    return f'{bounds[index]}+'
+
+def format_facets(counts):
+    """Turn {facet: {value: count}} into capped, count-ordered lists"""
+    limit = FACET_CONFIG['MAX_VALUES']
+    result = {}
+    for name in FACET_NAMES:
+        values = counts.get(name, {})
+        if name in ('price', 'rating'):
+            bounds = FACET_CONFIG['PRICE_BUCKETS'] if name == 'price' else FACET_CONFIG['RATING_BUCKETS']
+            # Numeric buckets keep their natural order and are never capped
+            ordered = sorted(values.items())
+            result[name] = [{'value': bucket_label(bounds, index), 'count': count}
+                            for index, count in ordered if count]
+        else:
+            # Values with no matches (the in-memory index reports every known one) never count
+            ordered = sorted(((value, count) for value, count in values.items() if count),
+                             key=lambda item: (-item[1], item[0]))
+            result[name] = [{'value': value, 'count': count} for value, count in ordered[:limit]]
+            result[name + '_truncated'] = len(ordered) > limit
+    return result
+
+class FacetCounter:
+    """Accumulates facet counts while a result set is scanned once"""
+
+    def __init__(self, category_field='category', city_field='city',
+                 price_field='price', rating_field='rating'):
+        self.fields = (category_field, city_field, price_field, rating_field)
+        self.counts = {name: {} for name in FACET_NAMES}
+
+    def _bump(self, name, value):
+        bucket = self.counts[name]
+        bucket[value] = bucket.get(value, 0) + 1
+
+    def add(self, row):
+        """Count one result row (dict or object with the configured fields)"""
+        get = row.get if isinstance(row, dict) else lambda field: getattr(row, field, None)
+        category_field, city_field, price_field, rating_field = self.fields
+
+        if get(category_field):
+            self._bump('category', get(category_field))
+        if get(city_field):
+            self._bump('city', get(city_field))
+        price = bucket_index(FACET_CONFIG['PRICE_BUCKETS'], get(price_field))
+        if price is not None:
+            self._bump('price', price)
+        rating = bucket_index(FACET_CONFIG['RATING_BUCKETS'], get(rating_field) or 0)
+        self._bump('rating', rating)
+
+    def result(self):
+        return format_facets(self.counts)
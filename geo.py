@@ -0,0 +1,100 @@
+# geo.py - Provider coverage areas in an SQLite R-tree for radius search
+import math
+
+# Geo Configuration
+GEO_CONFIG = {
+    'EARTH_RADIUS_KM': 6371.0,
+    'KM_PER_DEGREE_LAT': 111.32,
+    'DEFAULT_SERVICE_RADIUS_KM': 10,
+    'MAX_SEARCH_RADIUS_KM': 500,
+    'MAX_NEAREST': 100
+}
+
+# Providers whose coverage box contains the point; named parameters work with
+# both sqlite3 and SQLAlchemy text()
+COVERAGE_QUERY = '''
+    SELECT sp.id, sp.latitude, sp.longitude, sp.service_radius
+    FROM provider_coverage pc
+    JOIN service_providers sp ON sp.id = pc.id
+    WHERE pc.min_lat <= :lat AND pc.max_lat >= :lat
+      AND pc.min_lng <= :lng AND pc.max_lng >= :lng
+'''
+
+def parse_point(latitude, longitude):
+    """(lat, lng) as floats, None when either is missing; ValueError when out of range"""
+    if latitude in (None, '') or longitude in (None, ''):
+        return None
+    lat, lng = float(latitude), float(longitude)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Coordinates out of range')
+    return lat, lng
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * GEO_CONFIG['EARTH_RADIUS_KM'] * math.asin(min(1.0, math.sqrt(a)))
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing a circle; full longitude range near the poles"""
+    lat_span = radius_km / GEO_CONFIG['KM_PER_DEGREE_LAT']
+    min_lat, max_lat = max(lat - lat_span, -90.0), min(lat + lat_span, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat < 1e-6:
+        return min_lat, max_lat, -180.0, 180.0
+    lng_span = radius_km / (GEO_CONFIG['KM_PER_DEGREE_LAT'] * cos_lat)
+    if lng_span >= 180 or lng - lng_span < -180 or lng + lng_span > 180:
+        # Circles crossing the antimeridian are rare enough to index as a full band
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lng - lng_span, lng + lng_span
+
+def service_radius_km(value):
+    return float(value) if value not in (None, '') else GEO_CONFIG['DEFAULT_SERVICE_RADIUS_KM']
+
+def sync_provider_coverage(conn, provider_id):
+    """Refresh one provider's R-tree entry after its location or service_radius changed
+
+    Runs inside the caller's transaction."""
+    row = conn.execute('SELECT latitude, longitude, service_radius FROM service_providers WHERE id = ?',
+                       (provider_id,)).fetchone()
+    conn.execute('DELETE FROM provider_coverage WHERE id = ?', (provider_id,))
+    if row is None or row[0] is None or row[1] is None:
+        return
+    min_lat, max_lat, min_lng, max_lng = bounding_box(row[0], row[1], service_radius_km(row[2]))
+    conn.execute('''
+        INSERT INTO provider_coverage (id, min_lat, max_lat, min_lng, max_lng)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (provider_id, min_lat, max_lat, min_lng, max_lng))
+
+def rank_covering(rows, lat, lng, radius_km=None, limit=None):
+    """[(distance_km, provider_id)] nearest first for candidate rows from COVERAGE_QUERY
+
+    The R-tree box is a superset of the circle, so each provider's own radius is
+    checked exactly here; radius_km additionally caps the customer's travel distance."""
+    ranked = []
+    for provider_id, provider_lat, provider_lng, provider_radius in rows:
+        distance = haversine_km(lat, lng, provider_lat, provider_lng)
+        if distance > service_radius_km(provider_radius):
+            continue
+        if radius_km is not None and distance > radius_km:
+            continue
+        ranked.append((round(distance, 3), provider_id))
+    ranked.sort()
+    return ranked[:limit] if limit else ranked
+
+def providers_covering(conn, lat, lng, radius_km=None, limit=None):
+    """Providers whose service area includes (lat, lng), nearest first"""
+    rows = conn.execute(COVERAGE_QUERY, {'lat': lat, 'lng': lng}).fetchall()
+    return rank_covering(rows, lat, lng, radius_km, limit)
+
+def search_area(args):
+    """Parse lat/lng/radius_km/nearest request params; None when no point was given"""
+    point = parse_point(args.get('lat'), args.get('lng'))
+    if point is None:
+        return None
+    radius_km = args.get('radius_km')
+    radius_km = min(float(radius_km), GEO_CONFIG['MAX_SEARCH_RADIUS_KM']) if radius_km not in (None, '') else None
+    nearest = args.get('nearest')
+    nearest = max(1, min(int(nearest), GEO_CONFIG['MAX_NEAREST'])) if nearest not in (None, '') else None
+    return point[0], point[1], radius_km, nearest
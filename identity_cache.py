@@ -0,0 +1,62 @@
+# identity_cache.py - LRU + TTL cache of the user identity behind a session
+import threading
+import time
+from collections import OrderedDict
+
+# Identity Cache Configuration
+IDENTITY_CONFIG = {
+    'MAX_ENTRIES': 10000,
+    # Other worker processes only see an invalidation once their entry expires
+    'TTL_SECONDS': 60
+}
+
+class IdentityCache:
+    """user_id -> identity object produced by loader(user_id); misses are not cached"""
+
+    def __init__(self, loader, max_entries=None, ttl_seconds=None):
+        self.loader = loader
+        self.max_entries = max_entries or IDENTITY_CONFIG['MAX_ENTRIES']
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else IDENTITY_CONFIG['TTL_SECONDS']
+        self._entries = OrderedDict()     # user_id -> (expires_at, identity)
+        self._generation = 0              # Bumped by invalidate(); guards loads in flight
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+
+        identity = self.loader(user_id)
+        if identity is None:
+            return None
+        with self._lock:
+            # An invalidate() while we were loading means identity may already be stale
+            if self._generation == generation:
+                self._entries[user_id] = (now + self.ttl_seconds, identity)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, user_id):
+        """Call after changing anything the loader reads (profile, password, role)"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self._hits, 'misses': self._misses}
@@ -0,0 +1,203 @@
+# local_broker.py - Minimal Redis-protocol pub/sub broker for development and tests (no persistence)
+import os
+import socketserver
+import threading
+
+# Broker Configuration
+BROKER_CONFIG = {
+    'HOST': os.environ.get('LOCAL_BROKER_HOST', '127.0.0.1'),
+    'PORT': int(os.environ.get('LOCAL_BROKER_PORT', 6390))
+}
+
+class ProtocolError(Exception):
+    pass
+
+def encode(value, kind=b'*'):
+    """RESP encoding of a reply; kind b'>' (push) / b'%' (map, pairs list) are RESP3 aggregates"""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    count = len(value) // 2 if kind == b'%' else len(value)
+    return kind + b'%d\r\n' % count + b''.join(encode(item) for item in value)
+
+def read_command(stream):
+    """One command as a list of bytes arguments, or None at end of stream"""
+    line = stream.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.split()         # Inline command (redis-cli / telnet)
+    arguments = []
+    for _ in range(int(line[1:])):
+        header = stream.readline()
+        if not header.startswith(b'$'):
+            raise ProtocolError('expected bulk string')
+        size = int(header[1:])
+        data = stream.read(size + 2)
+        if len(data) != size + 2:
+            return None
+        arguments.append(data[:-2])
+    return arguments
+
+class Connection(socketserver.StreamRequestHandler):
+    """One client; publishers write to subscribers' sockets under their send lock"""
+
+    def setup(self):
+        super().setup()
+        self.send_lock = threading.Lock()
+        self.channels = set()
+        self.protocol = 2               # HELLO 3 switches pub/sub traffic to RESP3 push frames
+
+    @property
+    def push(self):
+        return b'>' if self.protocol == 3 else b'*'
+
+    def send(self, data):
+        with self.send_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                try:
+                    command = read_command(self.rfile)
+                except (ProtocolError, ValueError) as e:
+                    self.send(b'-ERR Protocol error: %s\r\n' % str(e).encode())
+                    return
+                if command is None:
+                    return
+                if not command:
+                    continue
+                name = command[0].upper()
+                if name == b'QUIT':
+                    self.send(b'+OK\r\n')
+                    return
+                self.send(broker.execute(self, name, command[1:]))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker.unsubscribe(self, list(self.channels))
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class LocalBroker:
+    """HELLO, PING, PUBLISH, SUBSCRIBE and UNSUBSCRIBE: what socket_bus needs from a Redis server"""
+
+    def __init__(self, host=None, port=None):
+        self.host = host or BROKER_CONFIG['HOST']
+        self.port = BROKER_CONFIG['PORT'] if port is None else port
+        self._subscribers = {}          # channel -> set of Connection
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'redis://{self.host}:{self.port}/0'
+
+    def execute(self, connection, name, args):
+        if name == b'HELLO':
+            return self.hello(connection, args)
+        if name == b'PING':
+            if connection.channels and connection.protocol == 2:
+                return encode([b'pong', args[0] if args else b''])
+            return encode(args[0]) if args else b'+PONG\r\n'
+        if name == b'ECHO' and len(args) == 1:
+            return encode(args[0])
+        if name == b'PUBLISH' and len(args) == 2:
+            return encode(self.publish(args[0], args[1]))
+        if name == b'SUBSCRIBE' and args:
+            return self.subscribe(connection, args)
+        if name == b'UNSUBSCRIBE':
+            return self.unsubscribe(connection, args or list(connection.channels))
+        if name in (b'CLIENT', b'SELECT'):
+            return b'+OK\r\n'
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def hello(self, connection, args):
+        try:
+            protocol = int(args[0]) if args else connection.protocol
+        except ValueError:
+            return b'-ERR Protocol version is not an integer or out of range\r\n'
+        if protocol not in (2, 3):
+            return b'-NOPROTO unsupported protocol version\r\n'
+        connection.protocol = protocol
+        fields = [b'server', b'local_broker', b'version', b'7.0.0', b'proto', protocol,
+                  b'id', id(connection) & 0xffffffff, b'mode', b'standalone', b'role', b'master', b'modules', []]
+        return encode(fields, b'%' if protocol == 3 else b'*')
+
+    def publish(self, channel, data):
+        """Deliver data to every subscriber of channel; returns the receiver count"""
+        with self._lock:
+            receivers = list(self._subscribers.get(channel, ()))
+        messages = {}                   # Encoded once per protocol
+        delivered = 0
+        for connection in receivers:
+            push = connection.push
+            if push not in messages:
+                messages[push] = encode([b'message', channel, data], push)
+            try:
+                connection.send(messages[push])
+                delivered += 1
+            except (ConnectionError, OSError):
+                self.unsubscribe(connection, list(connection.channels))
+        return delivered
+
+    def subscribe(self, connection, channels):
+        replies = []
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(connection)
+                connection.channels.add(channel)
+                replies.append(encode([b'subscribe', channel, len(connection.channels)], connection.push))
+        return b''.join(replies)
+
+    def unsubscribe(self, connection, channels):
+        replies = []
+        with self._lock:
+            for channel in channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(connection)
+                    if not subscribers:
+                        del self._subscribers[channel]
+                connection.channels.discard(channel)
+                replies.append(encode([b'unsubscribe', channel, len(connection.channels)], connection.push))
+        if not channels:
+            replies.append(encode([b'unsubscribe', None, 0], connection.push))
+        return b''.join(replies)
+
+    def start(self):
+        """Serve from a background thread (tests); port 0 picks a free port"""
+        self._server = Server((self.host, self.port), Connection)
+        self._server.broker = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='local-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def serve_forever(self):
+        self.start()
+        print(f"Local broker listening on {self.url}")
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            self.close()
+
+if __name__ == '__main__':
+    LocalBroker().serve_forever()
@@ -0,0 +1,217 @@
+# maintenance.py - Retention for login attempts and one-time codes, hourly login rollups
+import threading
+from datetime import datetime, timedelta
+
+import db_pool
+import db_storage
+
+# Maintenance Configuration
+MAINTENANCE_CONFIG = {
+    'INTERVAL_SECONDS': 3600,
+    'RAW_LOGIN_ATTEMPT_DAYS': 7,        # Raw rows kept for forensics; older ones live on as rollups
+    'ROLLUP_RETENTION_DAYS': 365,
+    'EXPIRED_TOKEN_GRACE_HOURS': 24,    # Expired OTPs / MFA tokens are deleted after this
+    'DELETE_BATCH_ROWS': 5000           # Short write transactions so logins never wait long
+}
+
+# Failed logins for :account since :since (UTC). Rolled-up hours plus raw rows the last
+# rollup has not reached; named parameters work with sqlite3 and SQLAlchemy text()
+RECENT_FAILURES_QUERY = '''
+    SELECT COALESCE(SUM(failures), 0), MAX(seen) FROM (
+        SELECT attempts - successes AS failures, hour AS seen
+        FROM login_attempt_rollups
+        WHERE account = :account AND hour >= :since_hour AND attempts > successes
+        UNION ALL
+        SELECT 1, attempt_time
+        FROM {table}
+        WHERE id > COALESCE((SELECT value FROM maintenance_state WHERE key = :rolled_key), 0)
+          AND {account_column} = :account AND NOT success AND attempt_time >= :since
+    )
+'''
+
+def _utc(dt):
+    """Same text format as CURRENT_TIMESTAMP / audit_log.utc_timestamp()"""
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+def _state(conn, key):
+    row = conn.execute('SELECT value FROM maintenance_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else 0
+
+def _add_state(conn, key, delta):
+    conn.execute('''
+        INSERT INTO maintenance_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+    ''', (key, delta))
+
+def _set_state(conn, key, value):
+    conn.execute('''
+        INSERT INTO maintenance_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (key, value))
+
+def recent_failures_params(account, hours=24, table='login_attempts'):
+    since = datetime.utcnow() - timedelta(hours=hours)
+    return {'account': account, 'since': _utc(since), 'since_hour': since.strftime('%Y-%m-%d %H:00:00'),
+            'rolled_key': f'{table}.rolled_id'}
+
+@db_storage.retry_on_busy
+def rollup_login_attempts(conn, table='login_attempts', account_column='email'):
+    """Fold rows added since the last run into hourly per-account/IP rollups
+
+    Tracks an id watermark rather than a time, so rows written late (audit
+    batches, replayed spill files) still land in their hour."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rolled = _state(conn, f'{table}.rolled_id')
+        last = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+        if last <= rolled:
+            conn.rollback()
+            return 0
+        attempts, successes = conn.execute(f'''
+            SELECT COUNT(*), COALESCE(SUM(CASE WHEN success THEN 1 ELSE 0 END), 0)
+            FROM {table} WHERE id > ? AND id <= ?
+        ''', (rolled, last)).fetchone()
+        conn.execute(f'''
+            INSERT INTO login_attempt_rollups (hour, account, ip_address, attempts, successes)
+            SELECT strftime('%Y-%m-%d %H:00:00', attempt_time), COALESCE({account_column}, ''),
+                   COALESCE(ip_address, ''), COUNT(*), SUM(CASE WHEN success THEN 1 ELSE 0 END)
+            FROM {table} WHERE id > ? AND id <= ?
+            GROUP BY 1, 2, 3
+            ON CONFLICT(hour, account, ip_address) DO UPDATE SET
+                attempts = attempts + excluded.attempts, successes = successes + excluded.successes
+        ''', (rolled, last))
+        _add_state(conn, f'{table}.attempts', attempts)
+        _add_state(conn, f'{table}.successes', successes)
+        _set_state(conn, f'{table}.rolled_id', last)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return attempts
+
+def login_totals(conn, table='login_attempts'):
+    """(attempts, successes) ever recorded, without counting the raw table"""
+    rolled = _state(conn, f'{table}.rolled_id')
+    tail_attempts, tail_successes = conn.execute(f'''
+        SELECT COUNT(*), COALESCE(SUM(CASE WHEN success THEN 1 ELSE 0 END), 0)
+        FROM {table} WHERE id > ?
+    ''', (rolled,)).fetchone()
+    return (_state(conn, f'{table}.attempts') + tail_attempts,
+            _state(conn, f'{table}.successes') + tail_successes)
+
+@db_storage.retry_on_busy
+def _delete_batch(conn, table, where, params, key):
+    cursor = conn.execute(f'''
+        DELETE FROM {table} WHERE ({key}) IN (
+            SELECT {key} FROM {table} WHERE {where} ORDER BY {key} LIMIT ?
+        )
+    ''', params + (MAINTENANCE_CONFIG['DELETE_BATCH_ROWS'],))
+    conn.commit()
+    return cursor.rowcount
+
+def _delete_in_batches(conn, table, where, params, key='rowid'):
+    deleted = 0
+    while True:
+        count = _delete_batch(conn, table, where, params, key)
+        deleted += count
+        if count < MAINTENANCE_CONFIG['DELETE_BATCH_ROWS']:
+            return deleted
+
+def purge_login_attempts(conn, table='login_attempts'):
+    """Drop raw attempts past the retention window that are already rolled up"""
+    cutoff = _utc(datetime.utcnow() - timedelta(days=MAINTENANCE_CONFIG['RAW_LOGIN_ATTEMPT_DAYS']))
+    return _delete_in_batches(conn, table, 'id <= ? AND attempt_time < ?',
+                              (_state(conn, f'{table}.rolled_id'), cutoff))
+
+def purge_rollups(conn):
+    cutoff = _utc(datetime.utcnow() - timedelta(days=MAINTENANCE_CONFIG['ROLLUP_RETENTION_DAYS']))
+    return _delete_in_batches(conn, 'login_attempt_rollups', 'hour < ?', (cutoff,),
+                              key='hour, account, ip_address')
+
+def _token_cutoff():
+    # expires_at is written from datetime.now() (local time)
+    return datetime.now() - timedelta(hours=MAINTENANCE_CONFIG['EXPIRED_TOKEN_GRACE_HOURS'])
+
+@db_storage.retry_on_busy
+def _purge_otp_batch(conn, cutoff):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('SELECT id, used FROM otp_codes WHERE expires_at < ? LIMIT ?',
+                            (cutoff, MAINTENANCE_CONFIG['DELETE_BATCH_ROWS'])).fetchall()
+        conn.executemany('DELETE FROM otp_codes WHERE id = ?', [(row[0],) for row in rows])
+        # The dashboard's verification count outlives the rows
+        _add_state(conn, 'otp_codes.used_purged', sum(1 for row in rows if row[1]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+def purge_otp_codes(conn):
+    """Delete expired OTP codes (app_with_mfa.py)"""
+    cutoff, deleted = _token_cutoff(), 0
+    while True:
+        count = _purge_otp_batch(conn, cutoff)
+        deleted += count
+        if count < MAINTENANCE_CONFIG['DELETE_BATCH_ROWS']:
+            return deleted
+
+def otp_verifications(conn):
+    live = conn.execute('SELECT COUNT(*) FROM otp_codes WHERE used = 1').fetchone()[0]
+    return _state(conn, 'otp_codes.used_purged') + live
+
+def purge_mfa_tokens(conn):
+    """Delete expired MFA tokens (app_with_mfa_backup.py)"""
+    return _delete_in_batches(conn, 'mfa_tokens', 'expires_at < ?', (_token_cutoff(),))
+
+def jobs(login_table='login_attempts', account_column='email', token_purge=None):
+    """[(name, func(conn))] for a database; rollup runs before the raw purge that depends on it"""
+    scheduled = [
+        ('rollup_login_attempts', lambda conn: rollup_login_attempts(conn, login_table, account_column)),
+        ('purge_login_attempts', lambda conn: purge_login_attempts(conn, login_table)),
+        ('purge_rollups', purge_rollups)
+    ]
+    if token_purge is not None:
+        scheduled.append((token_purge.__name__, token_purge))
+    return scheduled
+
+def run(database, scheduled):
+    """Run each job once; returns {name: rows affected} (a failing job does not stop the rest)"""
+    results = {}
+    conn = db_pool.connect(database)
+    try:
+        for name, func in scheduled:
+            try:
+                results[name] = func(conn)
+            except Exception as e:
+                print(f"Maintenance job {name} failed for {database}: {e}")
+                results[name] = None
+    finally:
+        conn.close()
+    return results
+
+_maintenance_threads = {}
+
+def _maintenance_loop(database, scheduled, stop_event):
+    while True:
+        results = run(database, scheduled)
+        if any(results.values()):
+            print(f"Maintenance for {database}: {results}")
+        if stop_event.wait(MAINTENANCE_CONFIG['INTERVAL_SECONDS']):
+            return
+
+def start_task(database, scheduled):
+    """Start the periodic maintenance thread for a database (idempotent)"""
+    if database in _maintenance_threads:
+        return _maintenance_threads[database][1]
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_maintenance_loop, args=(database, scheduled, stop_event),
+                              name=f'maintenance-{database}', daemon=True)
+    _maintenance_threads[database] = (thread, stop_event)
+    thread.start()
+    return stop_event
+
+def stop_tasks():
+    for thread, stop_event in _maintenance_threads.values():
+        stop_event.set()
+    _maintenance_threads.clear()
@@ -0,0 +1,260 @@
+# message_ingest.py - Durable append log in front of group-committed database writes
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+# Ingest Configuration
+INGEST_CONFIG = {
+    'LOG_DIR': 'data',                  # <name>.<pid>.log per process; leftovers are replayed by recover()
+    'LOG_FSYNC': True,                  # Acknowledge only once the record is on disk (fsyncs are shared)
+    'LOG_ROTATE_BYTES': 1024 * 1024,    # Truncate the log once fully committed and at least this big
+    'BATCH_SIZE': 200,                  # Records per database transaction
+    'COMMIT_DELAY_SECONDS': 0.005,      # Wait this long after a wake-up so concurrent sends share a commit
+    'FLUSH_INTERVAL_SECONDS': 1.0,
+    # A record that fails on its own while records after it commit goes to
+    # <name>.rejected after this many tries; this many failing in a row means
+    # the database is down and flush() backs off instead
+    'MAX_RECORD_ATTEMPTS': 3
+}
+
+def _read_log(path):
+    """Records of a log file; a torn last line (crash mid-write) is ignored"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+class MessageIngest:
+    """submit() appends to the log and returns; writer(records) commits batches in the background
+
+    writer must be idempotent on record['ingest_id'] (records are replayed after a
+    crash) and return one result per record. on_commit(records, results) runs
+    after each committed batch, e.g. to notify clients. A failing batch is split
+    until the failing record is found, so one bad record cannot hold up the
+    rest; after MAX_RECORD_ATTEMPTS it is set aside in <name>.rejected."""
+
+    def __init__(self, name, writer, on_commit=None):
+        self.name = name
+        self.writer = writer
+        self.on_commit = on_commit
+        self.rejected_path = os.path.join(INGEST_CONFIG['LOG_DIR'], f'{name}.rejected')
+        self._reset()
+        # A forked worker must not share the parent's log, lock or committer thread
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """Per-process state; the log is opened by start() in the process that submits"""
+        self.log_path = None
+        self._log = None
+        self._queue = deque()
+        self._appended = 0
+        self._synced = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._failures = {}               # ingest_id -> failed attempts on its own
+        self._counters = {'submitted': 0, 'committed': 0, 'batches': 0, 'fsyncs': 0,
+                          'errors': 0, 'recovered': 0, 'rejected': 0}
+
+    def _open_log(self):
+        os.makedirs(INGEST_CONFIG['LOG_DIR'], exist_ok=True)
+        self.log_path = os.path.join(INGEST_CONFIG['LOG_DIR'], f'{self.name}.{os.getpid()}.log')
+        log = open(self.log_path, 'a', encoding='utf-8')
+        # Held for the life of the process: recover() skips logs whose owner is alive
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return log
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            with self._lock:
+                if self._log is None:
+                    self._log = self._open_log()
+            self._thread = threading.Thread(target=self._loop, name=f'ingest-{self.name}', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, **record):
+        """Durably queue one record; returns its ingest_id once it is safe to acknowledge"""
+        if self._thread is None:
+            self.start()
+        record['ingest_id'] = uuid.uuid4().hex
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._log.write(line)
+            self._appended += 1
+            seq = self._appended
+            self._queue.append(record)
+            self._counters['submitted'] += 1
+        self._sync(seq)
+        self._wake.set()
+        return record['ingest_id']
+
+    def _sync(self, seq):
+        """Group fsync: whoever gets the lock syncs everything appended so far"""
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                target = self._appended
+                self._log.flush()
+            if INGEST_CONFIG['LOG_FSYNC']:
+                os.fsync(self._log.fileno())
+                self._counters['fsyncs'] += 1
+            self._synced = target
+
+    def _take(self, limit):
+        with self._lock:
+            return [self._queue.popleft() for _ in range(min(len(self._queue), limit))]
+
+    def _requeue(self, records):
+        with self._lock:
+            self._queue.extendleft(reversed(records))
+
+    def _set_aside(self, record):
+        self._failures.pop(record['ingest_id'], None)
+        self._counters['rejected'] += 1
+        print(f"Message ingest {self.name} set aside record {record['ingest_id']} in {self.rejected_path}")
+        with open(self.rejected_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def flush(self):
+        """Commit everything queued; returns False when the writer failed (records stay queued)"""
+        with self._flush_lock:
+            limit = INGEST_CONFIG['BATCH_SIZE']
+            suspects = []                 # Failed on their own; judged once a later record commits
+            while True:
+                batch = self._take(limit)
+                if not batch:
+                    break
+                try:
+                    results = self.writer(batch)
+                except Exception as e:
+                    self._counters['errors'] += 1
+                    print(f"Message ingest {self.name} commit failed: {e}")
+                    if len(batch) > 1:
+                        # Bisect toward the failing record, front half first
+                        self._requeue(batch)
+                        limit = len(batch) // 2
+                        continue
+                    suspects.append(batch[0])
+                    if len(suspects) < INGEST_CONFIG['MAX_RECORD_ATTEMPTS']:
+                        continue
+                    # Several in a row: the database, not the data; retry later
+                    self._requeue(suspects)
+                    return False
+                if self._failures:
+                    for record in batch:
+                        self._failures.pop(record['ingest_id'], None)
+                limit = INGEST_CONFIG['BATCH_SIZE']
+                if suspects:
+                    # The database works, so these records are at fault
+                    retry = []
+                    for record in suspects:
+                        attempts = self._failures[record['ingest_id']] = self._failures.get(record['ingest_id'], 0) + 1
+                        if attempts >= INGEST_CONFIG['MAX_RECORD_ATTEMPTS']:
+                            self._set_aside(record)
+                        else:
+                            retry.append(record)
+                    self._requeue(retry)
+                    suspects = []
+                    limit = 1
+                self._counters['committed'] += len(batch)
+                self._counters['batches'] += 1
+                if self.on_commit is not None:
+                    try:
+                        self.on_commit(batch, results)
+                    except Exception as e:
+                        print(f"Message ingest {self.name} on_commit failed: {e}")
+            if suspects:
+                # Nothing after them to tell bad records from a failing database
+                self._requeue(suspects)
+                return False
+            self._rotate()
+            return True
+
+    def _rotate(self, force=False):
+        """Truncate the log when every record in it is committed (caller holds _flush_lock)"""
+        with self._sync_lock, self._lock:
+            if self._log is None or self._queue:
+                return
+            self._log.flush()
+            if force or self._log.tell() >= INGEST_CONFIG['LOG_ROTATE_BYTES']:
+                self._log.truncate(0)
+                self._log.seek(0)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if self._wake.wait(INGEST_CONFIG['FLUSH_INTERVAL_SECONDS']):
+                time.sleep(INGEST_CONFIG['COMMIT_DELAY_SECONDS'])
+            self._wake.clear()
+            self.flush()
+
+    def _rejected_ids(self):
+        try:
+            return {record.get('ingest_id') for record in _read_log(self.rejected_path)}
+        except FileNotFoundError:
+            return set()
+
+    def recover(self):
+        """Replay logs left by processes that died before committing; call once at startup"""
+        recovered = 0
+        rejected = self._rejected_ids()
+        for path in glob.glob(os.path.join(INGEST_CONFIG['LOG_DIR'], f'{self.name}.*.log')):
+            if path == self.log_path and self._log is not None:
+                continue
+            try:
+                log = open(path, 'r+', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                log.close()             # Owner still running
+                continue
+            try:
+                records = [record for record in _read_log(path) if record.get('ingest_id') not in rejected]
+                for start in range(0, len(records), INGEST_CONFIG['BATCH_SIZE']):
+                    self.writer(records[start:start + INGEST_CONFIG['BATCH_SIZE']])
+                os.remove(path)
+            except Exception as e:
+                print(f"Message ingest {self.name} could not recover {path}: {e}")
+                continue
+            finally:
+                log.close()
+            recovered += len(records)
+        self._counters['recovered'] += recovered
+        return recovered
+
+    def close(self):
+        """Stop the committer; a log that still holds uncommitted records stays for recover()"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self._lock:
+            log, self._log = self._log, None
+        if log is None:
+            return
+        if self.flush():
+            os.remove(self.log_path)
+        log.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, queued=len(self._queue))
@@ -1,15 +1,31 @@
 from flask import request, session, render_template, jsonify, redirect
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
+from flask_login import current_user
 from functools import wraps
-import sqlite3
-from datetime import datetime
+import threading
+from collections import OrderedDict
+import db_pool
+import db_storage
+import migrate
+import socket_bus
+from audit_log import utc_timestamp
+from message_ingest import MessageIngest
+from pagination import InvalidCursor, page_size, decode_cursor, keyset_condition, paginate
 
-# Initialize SocketIO (this will be added to your main app)
-socketio = SocketIO(cors_allowed_origins="*")
+# Initialize SocketIO (this will be added to your main app). With SOCKETIO_BUS_URLS set,
+# rooms span every worker through the message bus (socket_bus.py)
+socketio = SocketIO(cors_allowed_origins="*", client_manager=socket_bus.client_manager())
+
+# Messaging Configuration
+MESSAGING_CONFIG = {
+    'PREVIEW_CHARS': 200,               # conversation_summary.last_message length (inbox preview)
+    'SYNC_MAX_CONVERSATIONS': 50,       # Conversations caught up per 'sync' event
+    'PARTICIPANT_CACHE_ENTRIES': 10000  # conversation_id -> (customer_id, provider_id)
+}
 
 def init_messaging_db():
     """Initialize messaging database tables"""
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -40,12 +56,16 @@ def init_messaging_db():
     
     conn.commit()
     conn.close()
+    
+    # Apply versioned schema changes (indexes etc.)
+    migrate.run_migrations('myservicehub.db', 'messaging')
 
 # Authentication decorator for SocketIO
 def authenticated_only(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
-        if 'user_id' not in session:
+        # current_user comes from the app's user_loader (identity cache), not session copies
+        if 'user_id' not in session or not current_user.is_authenticated:
             disconnect()
         else:
             return f(*args, **kwargs)
@@ -56,13 +76,13 @@ def authenticated_only(f):
 @authenticated_only
 def on_connect():
     user_id = session['user_id']
-    user_type = session.get('user_type', 'customer')
+    user_type = current_user.user_type
     
     # Join user to their personal room
     join_room(f"user_{user_id}")
     
     print(f"User {user_id} ({user_type}) connected to messaging")
-    emit('status', {'msg': f'{session.get("name", "User")} connected'})
+    emit('status', {'msg': f'{current_user.name} connected'})
 
 @socketio.on('disconnect')
 @authenticated_only
@@ -91,7 +111,7 @@ def handle_send_message(data):
     conversation_id = data['conversation_id']
     message = data['message'].strip()
     sender_id = session['user_id']
-    sender_type = session.get('user_type', 'customer')
+    sender_type = current_user.user_type
     
     if not message:
         return
@@ -101,38 +121,57 @@ def handle_send_message(data):
         emit('error', {'message': 'Access denied'})
         return
     
-    # Save message to database
-    message_id = save_message(conversation_id, sender_id, sender_type, message)
+    # Durably queued; stored with the next group commit and broadcast by
+    # emit_committed_messages. The ack carries the id the broadcast will echo.
+    ingest_id = message_ingest.submit(
+        conversation_id=conversation_id,
+        sender_id=sender_id,
+        sender_type=sender_type,
+        sender_name=current_user.name,
+        message=message,
+        created_at=utc_timestamp()
+    )
+    return {'status': 'queued', 'ingest_id': ingest_id}
+
+@socketio.on('sync')
+@authenticated_only
+def handle_sync(data):
+    """Catch up after a reconnect: {'conversations': {conversation_id: last seen message id}}
+
+    Replies with one 'sync' event per conversation; when has_more is set the
+    client sends 'sync' again from last_id."""
+    user_id = session['user_id']
+    last_seen = (data or {}).get('conversations') or {}
+    if not isinstance(last_seen, dict) or len(last_seen) > MESSAGING_CONFIG['SYNC_MAX_CONVERSATIONS']:
+        emit('error', {'message': 'Invalid sync request'})
+        return
     
-    # Prepare message data
-    message_data = {
-        'id': message_id,
-        'conversation_id': conversation_id,
-        'sender_id': sender_id,
-        'sender_type': sender_type,
-        'sender_name': session.get('name', 'Unknown'),
-        'message': message,
-        'timestamp': datetime.now().isoformat(),
-        'is_read': False
-    }
-    
-    # Emit to conversation room
-    emit('new_message', message_data, room=f"conversation_{conversation_id}")
-    
-    # Send notification to other party
-    other_user_id = get_other_user_in_conversation(conversation_id, sender_id)
-    if other_user_id:
-        emit('message_notification', {
+    for conversation_id, since_id in last_seen.items():
+        try:
+            conversation_id = int(conversation_id)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'Invalid sync request'})
+            return
+        if not user_has_access_to_conversation(user_id, conversation_id):
+            emit('error', {'message': 'Access denied', 'conversation_id': conversation_id})
+            continue
+        try:
+            messages, last_id, has_more = get_messages_since(conversation_id, since_id, data.get('limit'))
+        except InvalidCursor as e:
+            emit('error', {'message': str(e), 'conversation_id': conversation_id})
+            continue
+        emit('sync', {
             'conversation_id': conversation_id,
-            'sender_name': session.get('name', 'Someone'),
-            'message_preview': message[:50] + '...' if len(message) > 50 else message
-        }, room=f"user_{other_user_id}")
+            'messages': messages,
+            'last_id': last_id,
+            'has_more': has_more
+        })
 
 @socketio.on('typing')
 @authenticated_only
 def handle_typing(data):
     conversation_id = data['conversation_id']
-    sender_name = session.get('name', 'Someone')
+    sender_name = current_user.name
     
     # Broadcast typing indicator to conversation room (except sender)
     emit('user_typing', {
@@ -150,30 +189,115 @@ def handle_stop_typing(data):
     }, room=f"conversation_{conversation_id}", include_self=False)
 
 # Database helper functions
-def save_message(conversation_id, sender_id, sender_type, message):
-    conn = sqlite3.connect('myservicehub.db')
-    cursor = conn.cursor()
-    
+def _store_message(cursor, conversation_id, sender_id, sender_type, message, created_at=None, ingest_id=None):
+    """Insert one message and update its conversation rows (caller commits); None for a replayed ingest_id"""
+    created_at = created_at or utc_timestamp()
     cursor.execute('''
-        INSERT INTO messages (conversation_id, sender_id, sender_type, message)
-        VALUES (?, ?, ?, ?)
-    ''', (conversation_id, sender_id, sender_type, message))
+        INSERT OR IGNORE INTO messages (conversation_id, sender_id, sender_type, message, created_at, ingest_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (conversation_id, sender_id, sender_type, message, created_at, ingest_id))
+    if not cursor.rowcount:
+        return None
     
     message_id = cursor.lastrowid
     
     # Update conversation last_message_at
     cursor.execute('''
-        UPDATE conversations SET last_message_at = CURRENT_TIMESTAMP
+        UPDATE conversations SET last_message_at = ?
         WHERE id = ?
-    ''', (conversation_id,))
+    ''', (created_at, conversation_id))
+    
+    # Inbox summary in the same transaction: new last message, one more unread for the recipient
+    cursor.execute('''
+        INSERT INTO conversation_summary
+            (conversation_id, last_message_id, last_sender_id, last_message, customer_unread, provider_unread)
+        SELECT c.id, ?, ?, ?, c.customer_id != ?, c.provider_id != ?
+        FROM conversations c WHERE c.id = ?
+        ON CONFLICT(conversation_id) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_sender_id = excluded.last_sender_id,
+            last_message = excluded.last_message,
+            customer_unread = customer_unread + excluded.customer_unread,
+            provider_unread = provider_unread + excluded.provider_unread
+    ''', (message_id, sender_id, message[:MESSAGING_CONFIG['PREVIEW_CHARS']], sender_id, sender_id,
+          conversation_id))
+    
+    return message_id
+
+@db_storage.retry_on_busy
+def save_message(conversation_id, sender_id, sender_type, message):
+    conn = db_pool.connect('myservicehub.db')
+    cursor = conn.cursor()
+    
+    message_id = _store_message(cursor, conversation_id, sender_id, sender_type, message)
     
     conn.commit()
     conn.close()
     
     return message_id
 
-def get_other_user_in_conversation(conversation_id, current_user_id):
-    conn = sqlite3.connect('myservicehub.db')
+@db_storage.retry_on_busy
+def save_messages(records):
+    """Group commit for message_ingest: one transaction (one fsync) per batch; returns message ids"""
+    conn = db_pool.connect('myservicehub.db')
+    try:
+        cursor = conn.cursor()
+        message_ids = [_store_message(cursor, record['conversation_id'], record['sender_id'],
+                                      record['sender_type'], record['message'],
+                                      record.get('created_at'), record.get('ingest_id'))
+                       for record in records]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return message_ids
+
+def emit_committed_messages(records, message_ids):
+    """Broadcast messages once they are stored, so every id a client sees can be synced from"""
+    for record, message_id in zip(records, message_ids):
+        if message_id is None:
+            continue
+        conversation_id = record['conversation_id']
+        message = record['message']
+        socketio.emit('new_message', {
+            'id': message_id,
+            'ingest_id': record['ingest_id'],
+            'conversation_id': conversation_id,
+            'sender_id': record['sender_id'],
+            'sender_type': record['sender_type'],
+            'sender_name': record['sender_name'],
+            'message': message,
+            'timestamp': record['created_at'],
+            'is_read': False
+        }, room=f"conversation_{conversation_id}")
+        
+        # Send notification to other party
+        other_user_id = get_other_user_in_conversation(conversation_id, record['sender_id'])
+        if other_user_id:
+            socketio.emit('message_notification', {
+                'conversation_id': conversation_id,
+                'sender_name': record['sender_name'],
+                'message_preview': message[:50] + '...' if len(message) > 50 else message
+            }, room=f"user_{other_user_id}")
+
+# Send path: acknowledged after the append log fsync, stored in group commits
+message_ingest = MessageIngest('messages', save_messages, on_commit=emit_committed_messages)
+
+# Participants never change once a conversation exists
+_participants = OrderedDict()
+_participants_lock = threading.Lock()
+
+def get_participants(conversation_id):
+    """(customer_id, provider_id) of a conversation, or None when it does not exist"""
+    with _participants_lock:
+        participants = _participants.get(conversation_id)
+        if participants is not None:
+            _participants.move_to_end(conversation_id)
+            return participants
+    
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -183,14 +307,27 @@ def get_other_user_in_conversation(conversation_id, current_user_id):
     result = cursor.fetchone()
     conn.close()
     
-    if result:
-        customer_id, provider_id = result
+    if result is None:
+        return None
+    participants = tuple(result)
+    with _participants_lock:
+        _participants[conversation_id] = participants
+        while len(_participants) > MESSAGING_CONFIG['PARTICIPANT_CACHE_ENTRIES']:
+            _participants.popitem(last=False)
+    return participants
+
+def get_other_user_in_conversation(conversation_id, current_user_id):
+    participants = get_participants(conversation_id)
+    
+    if participants:
+        customer_id, provider_id = participants
         return provider_id if current_user_id == customer_id else customer_id
     
     return None
 
+@db_storage.retry_on_busy
 def mark_messages_read(conversation_id, user_id):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -198,11 +335,27 @@ def mark_messages_read(conversation_id, user_id):
         WHERE conversation_id = ? AND sender_id != ? AND is_read = FALSE
     ''', (conversation_id, user_id))
     
+    # Recount from the unread index rather than zeroing, so the summary cannot drift
+    if cursor.rowcount:
+        cursor.execute('''
+            UPDATE conversation_summary SET
+                customer_unread = (SELECT COUNT(*) FROM messages m, conversations c
+                                   WHERE c.id = conversation_summary.conversation_id
+                                   AND m.conversation_id = c.id AND m.is_read = FALSE
+                                   AND m.sender_id != c.customer_id),
+                provider_unread = (SELECT COUNT(*) FROM messages m, conversations c
+                                   WHERE c.id = conversation_summary.conversation_id
+                                   AND m.conversation_id = c.id AND m.is_read = FALSE
+                                   AND m.sender_id != c.provider_id)
+            WHERE conversation_id = ?
+        ''', (conversation_id,))
+    
     conn.commit()
     conn.close()
 
 def get_user_conversations(user_id, user_type):
-    conn = sqlite3.connect('myservicehub.db')
+    """Inbox from conversation_summary: one indexed row per conversation, no per-row message scans"""
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     if user_type == 'customer':
@@ -211,75 +364,96 @@ def get_user_conversations(user_id, user_type):
                    COALESCE(u.name, 'Provider') as other_name,
                    COALESCE(s.title, 'Service Inquiry') as service_title, 
                    c.last_message_at,
-                   (SELECT COUNT(*) FROM messages m 
-                    WHERE m.conversation_id = c.id AND m.sender_id != ? AND m.is_read = FALSE) as unread_count,
-                   (SELECT m.message FROM messages m 
-                    WHERE m.conversation_id = c.id 
-                    ORDER BY m.created_at DESC LIMIT 1) as last_message
+                   COALESCE(cs.customer_unread, 0) as unread_count,
+                   cs.last_message
             FROM conversations c
+            LEFT JOIN conversation_summary cs ON cs.conversation_id = c.id
             LEFT JOIN users u ON c.provider_id = u.id
             LEFT JOIN services s ON c.service_id = s.id
             WHERE c.customer_id = ?
             ORDER BY c.last_message_at DESC
         '''
-        cursor.execute(query, (user_id, user_id))
+        cursor.execute(query, (user_id,))
     else:
         query = '''
             SELECT c.id, c.customer_id as other_user_id,
                    COALESCE(u.name, 'Customer') as other_name,
                    COALESCE(s.title, 'Service Inquiry') as service_title,
                    c.last_message_at,
-                   (SELECT COUNT(*) FROM messages m 
-                    WHERE m.conversation_id = c.id AND m.sender_id != ? AND m.is_read = FALSE) as unread_count,
-                   (SELECT m.message FROM messages m 
-                    WHERE m.conversation_id = c.id 
-                    ORDER BY m.created_at DESC LIMIT 1) as last_message
+                   COALESCE(cs.provider_unread, 0) as unread_count,
+                   cs.last_message
             FROM conversations c
+            LEFT JOIN conversation_summary cs ON cs.conversation_id = c.id
             LEFT JOIN users u ON c.customer_id = u.id
             LEFT JOIN services s ON c.service_id = s.id
             WHERE c.provider_id = ?
             ORDER BY c.last_message_at DESC
         '''
-        cursor.execute(query, (user_id, user_id))
+        cursor.execute(query, (user_id,))
     
     conversations = cursor.fetchall()
     conn.close()
     
     return [dict(zip([column[0] for column in cursor.description], row)) for row in conversations]
 
-def get_messages_for_conversation(conversation_id):
-    conn = sqlite3.connect('myservicehub.db')
+def get_messages_for_conversation(conversation_id, limit=None, cursor_token=None):
+    """Latest page of messages (oldest first); returns (messages, cursor for the page before)"""
+    limit = page_size(limit)
+    condition, cursor_params = keyset_condition(('m.created_at', 'm.id'), decode_cursor(cursor_token, 2))
+    
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT m.*, COALESCE(u.name, 'Unknown') as sender_name
         FROM messages m
         LEFT JOIN users u ON m.sender_id = u.id
-        WHERE m.conversation_id = ?
-        ORDER BY m.created_at ASC
-    ''', (conversation_id,))
+        WHERE m.conversation_id = ? {'AND ' + condition if condition else ''}
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT ?
+    ''', [conversation_id] + cursor_params + [limit + 1])
     
-    messages = cursor.fetchall()
+    messages = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
     conn.close()
     
-    return [dict(zip([column[0] for column in cursor.description], row)) for row in messages]
+    messages, next_cursor = paginate(messages, limit, lambda message: (message['created_at'], message['id']))
+    messages.reverse()
+    return messages, next_cursor
 
-def user_has_access_to_conversation(user_id, conversation_id):
-    conn = sqlite3.connect('myservicehub.db')
+def get_messages_since(conversation_id, since_id, limit=None):
+    """Messages after since_id (oldest first); returns (messages, last id seen, has_more)"""
+    try:
+        since_id = int(since_id or 0)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Malformed since_id')
+    limit = page_size(limit)
+    
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
+    # idx_messages_conversation_id: a range scan from since_id, whatever the thread length
     cursor.execute('''
-        SELECT 1 FROM conversations 
-        WHERE id = ? AND (customer_id = ? OR provider_id = ?)
-    ''', (conversation_id, user_id, user_id))
+        SELECT m.*, COALESCE(u.name, 'Unknown') as sender_name
+        FROM messages m
+        LEFT JOIN users u ON m.sender_id = u.id
+        WHERE m.conversation_id = ? AND m.id > ?
+        ORDER BY m.id
+        LIMIT ?
+    ''', (conversation_id, since_id, limit + 1))
     
-    result = cursor.fetchone()
+    messages = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
     conn.close()
     
-    return result is not None
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    return messages, messages[-1]['id'] if messages else since_id, has_more
+
+def user_has_access_to_conversation(user_id, conversation_id):
+    participants = get_participants(conversation_id)
+    return participants is not None and user_id in participants
 
 def get_existing_conversation(customer_id, provider_id, service_id=None):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     if service_id:
@@ -299,8 +473,9 @@ def get_existing_conversation(customer_id, provider_id, service_id=None):
     
     return result[0] if result else None
 
+@db_storage.retry_on_busy
 def create_conversation(customer_id, provider_id, service_id=None):
-    conn = sqlite3.connect('myservicehub.db')
+    conn = db_pool.connect('myservicehub.db')
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -309,6 +484,7 @@ def create_conversation(customer_id, provider_id, service_id=None):
     ''', (customer_id, provider_id, service_id))
     
     conversation_id = cursor.lastrowid
+    cursor.execute('INSERT INTO conversation_summary (conversation_id) VALUES (?)', (conversation_id,))
     conn.commit()
     conn.close()
     
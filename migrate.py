@@ -0,0 +1,102 @@
+# migrate.py - Forward-only schema migrations for the MyServiceHub databases
+import importlib.util
+import os
+import re
+import sqlite3
+
+import db_pool
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE_PATTERN = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+def list_migrations(component):
+    """Return [(version, name, path)] for a component, ordered by version"""
+    directory = os.path.join(MIGRATIONS_DIR, component)
+    if not os.path.isdir(directory):
+        return []
+
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE_PATTERN.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), filename, os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f'Duplicate migration version in {directory}')
+    return migrations
+
+def split_statements(script):
+    """Split a SQL script into complete statements (trigger bodies stay intact)"""
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    remainder = [line for line in buffer.splitlines() if line.strip() and not line.strip().startswith('--')]
+    if remainder:
+        raise RuntimeError('Incomplete SQL statement at end of migration')
+    return statements
+
+def _apply(conn, path):
+    if path.endswith('.sql'):
+        with open(path, encoding='utf-8') as f:
+            for statement in split_statements(f.read()):
+                conn.execute(statement)
+    else:
+        spec = importlib.util.spec_from_file_location(f'migration_{os.path.basename(path)[:-3]}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(conn)
+
+def ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            component TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (component, version)
+        )
+    ''')
+    conn.commit()
+
+def current_version(conn, component):
+    row = conn.execute('SELECT MAX(version) FROM schema_version WHERE component = ?',
+                       (component,)).fetchone()
+    return row[0] or 0
+
+def run_migrations(database, component):
+    """Apply pending migrations for a component; each runs in its own transaction"""
+    conn = db_pool.connect(database)
+    applied = []
+    try:
+        ensure_version_table(conn)
+        for version, name, path in list_migrations(component):
+            if version <= current_version(conn, component):
+                continue
+
+            # IMMEDIATE takes the write lock up front so concurrent workers serialize here
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version <= current_version(conn, component):
+                    conn.rollback()
+                    continue
+                _apply(conn, path)
+                conn.execute('INSERT INTO schema_version (component, version, name) VALUES (?, ?, ?)',
+                             (component, version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(name)
+            print(f"Applied migration {component}/{name}")
+
+        if applied:
+            conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+    return applied
@@ -0,0 +1,18 @@
+-- Indexes for the customer/provider portals and order tracking (app.py)
+
+-- get_customer_orders / get_provider_orders: filter by party, newest first
+CREATE INDEX IF NOT EXISTS idx_orders_customer_created ON orders (customer_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_provider_created ON orders (provider_id, created_at);
+
+-- get_provider_stats: completed count and earnings without touching the table
+CREATE INDEX IF NOT EXISTS idx_orders_provider_status ON orders (provider_id, status);
+CREATE INDEX IF NOT EXISTS idx_orders_provider_payment ON orders (provider_id, payment_status, total_amount);
+
+-- get_order_tracking
+CREATE INDEX IF NOT EXISTS idx_order_tracking_order_created ON order_tracking (order_id, created_at);
+
+-- /api/search category filter ordered by rating
+CREATE INDEX IF NOT EXISTS idx_services_category_rating ON services (category, rating);
+
+-- /verify/<token>
+CREATE INDEX IF NOT EXISTS idx_users_verification_token ON users (verification_token);
@@ -0,0 +1,39 @@
+-- Full-text index over services for /api/search (app.py)
+-- rowid mirrors services.id; business_name is the provider's users.name
+
+CREATE VIRTUAL TABLE IF NOT EXISTS services_fts USING fts5(
+    title, description, category, tags, business_name,
+    tokenize = 'porter unicode61'
+);
+
+INSERT INTO services_fts (rowid, title, description, category, tags, business_name)
+SELECT s.id, s.title, s.description, s.category, '', u.name
+FROM services s
+LEFT JOIN users u ON s.provider_id = u.id;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_after_insert AFTER INSERT ON services
+BEGIN
+    INSERT INTO services_fts (rowid, title, description, category, tags, business_name)
+    VALUES (new.id, new.title, new.description, new.category, '',
+            (SELECT name FROM users WHERE id = new.provider_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_after_update
+AFTER UPDATE OF title, description, category, provider_id ON services
+BEGIN
+    DELETE FROM services_fts WHERE rowid = old.id;
+    INSERT INTO services_fts (rowid, title, description, category, tags, business_name)
+    VALUES (new.id, new.title, new.description, new.category, '',
+            (SELECT name FROM users WHERE id = new.provider_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_after_delete AFTER DELETE ON services
+BEGIN
+    DELETE FROM services_fts WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_provider_rename AFTER UPDATE OF name ON users
+BEGIN
+    UPDATE services_fts SET business_name = new.name
+    WHERE rowid IN (SELECT id FROM services WHERE provider_id = new.id);
+END;
@@ -0,0 +1,29 @@
+-- Change log for services so in-process search indexes can sync incrementally
+-- Every write that affects a service's searchable fields appends its id here
+
+CREATE TABLE IF NOT EXISTS service_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    service_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS service_changes_after_insert AFTER INSERT ON services
+BEGIN
+    INSERT INTO service_changes (service_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS service_changes_after_update AFTER UPDATE ON services
+BEGIN
+    INSERT INTO service_changes (service_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS service_changes_after_delete AFTER DELETE ON services
+BEGIN
+    INSERT INTO service_changes (service_id) VALUES (old.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS service_changes_provider_rename AFTER UPDATE OF name ON users
+BEGIN
+    INSERT INTO service_changes (service_id)
+    SELECT id FROM services WHERE provider_id = new.id;
+END;
@@ -0,0 +1,13 @@
+-- Indexes for OTP verification, login tracking and sessions (app_with_mfa.py)
+
+-- verify_otp: newest unused code of a type for a user
+CREATE INDEX IF NOT EXISTS idx_otp_codes_lookup ON otp_codes (user_id, otp_type, used, expires_at);
+
+-- dashboard counters
+CREATE INDEX IF NOT EXISTS idx_otp_codes_used ON otp_codes (used);
+CREATE INDEX IF NOT EXISTS idx_login_attempts_success ON login_attempts (success);
+
+-- per-account login history
+CREATE INDEX IF NOT EXISTS idx_login_attempts_username_time ON login_attempts (username, attempt_time);
+
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions (user_id, active);
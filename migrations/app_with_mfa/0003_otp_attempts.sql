@@ -0,0 +1,6 @@
+-- otp_codes now stores HMAC digests (otp_hmac.py); count wrong guesses per code
+
+ALTER TABLE otp_codes ADD COLUMN attempts INTEGER DEFAULT 0;
+
+-- Codes stored in plain text before the switch are no longer accepted
+UPDATE otp_codes SET used = 1 WHERE used = 0 AND otp_code NOT LIKE 'hmac-sha256$%';
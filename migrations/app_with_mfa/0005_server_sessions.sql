@@ -0,0 +1,7 @@
+-- user_sessions becomes the server-side session store (session_store.py)
+
+-- Serialized session data; session_token now holds a SHA-256 of the cookie token
+ALTER TABLE user_sessions ADD COLUMN data TEXT;
+
+-- Incremental expiry sweep
+CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at);
@@ -0,0 +1,10 @@
+-- Revocation log for session_store.py: every deleted session appends its token digest
+-- Workers read sqlite_sequence per request and drop revoked sessions from their cache
+
+CREATE TABLE IF NOT EXISTS user_session_revocations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_token TEXT NOT NULL,
+    revoked_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_session_revocations_revoked ON user_session_revocations (revoked_at);
@@ -0,0 +1,26 @@
+-- Indexes for the marketplace API with MFA (app_with_mfa_backup.py)
+
+-- create_mfa_token / verify_mfa_token
+CREATE INDEX IF NOT EXISTS idx_mfa_tokens_lookup ON mfa_tokens (user_id, token_type, is_used, expires_at);
+
+-- login history per account
+CREATE INDEX IF NOT EXISTS idx_login_attempts_email_time ON login_attempts (email, attempt_time);
+
+-- /api/notifications: newest first per user
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at);
+
+-- registration duplicate check (username and email are already UNIQUE)
+CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone);
+
+-- /api/services joins and filters
+CREATE INDEX IF NOT EXISTS idx_service_providers_user ON service_providers (user_id);
+CREATE INDEX IF NOT EXISTS idx_service_providers_status_rating ON service_providers (status, rating);
+CREATE INDEX IF NOT EXISTS idx_services_provider ON services (provider_id);
+CREATE INDEX IF NOT EXISTS idx_services_category ON services (category);
+
+-- dashboards
+CREATE INDEX IF NOT EXISTS idx_bookings_customer_status ON bookings (customer_id, status);
+CREATE INDEX IF NOT EXISTS idx_bookings_provider_payment ON bookings (provider_id, payment_status, total_amount);
+
+-- add_review rating recalculation
+CREATE INDEX IF NOT EXISTS idx_reviews_provider ON reviews (provider_id, rating);
@@ -0,0 +1,40 @@
+-- Full-text index over services for /api/services (app_with_mfa_backup.py)
+-- rowid mirrors services.id; tags are the provider's advertised services list
+
+CREATE VIRTUAL TABLE IF NOT EXISTS services_fts USING fts5(
+    title, description, category, tags, business_name,
+    tokenize = 'porter unicode61'
+);
+
+INSERT INTO services_fts (rowid, title, description, category, tags, business_name)
+SELECT s.id, s.title, s.description, s.category, sp.services, sp.business_name
+FROM services s
+LEFT JOIN service_providers sp ON s.provider_id = sp.id;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_after_insert AFTER INSERT ON services
+BEGIN
+    INSERT INTO services_fts (rowid, title, description, category, tags, business_name)
+    SELECT new.id, new.title, new.description, new.category, sp.services, sp.business_name
+    FROM (SELECT 1) LEFT JOIN service_providers sp ON sp.id = new.provider_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_after_update
+AFTER UPDATE OF title, description, category, provider_id ON services
+BEGIN
+    DELETE FROM services_fts WHERE rowid = old.id;
+    INSERT INTO services_fts (rowid, title, description, category, tags, business_name)
+    SELECT new.id, new.title, new.description, new.category, sp.services, sp.business_name
+    FROM (SELECT 1) LEFT JOIN service_providers sp ON sp.id = new.provider_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_after_delete AFTER DELETE ON services
+BEGIN
+    DELETE FROM services_fts WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS services_fts_provider_update
+AFTER UPDATE OF business_name, services ON service_providers
+BEGIN
+    UPDATE services_fts SET business_name = new.business_name, tags = new.services
+    WHERE rowid IN (SELECT id FROM services WHERE provider_id = new.id);
+END;
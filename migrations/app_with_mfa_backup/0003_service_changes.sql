@@ -0,0 +1,38 @@
+-- Change log for services so in-process search indexes can sync incrementally
+-- Every write that affects a service's searchable or filterable fields appends its id here
+
+CREATE TABLE IF NOT EXISTS service_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    service_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS service_changes_after_insert AFTER INSERT ON services
+BEGIN
+    INSERT INTO service_changes (service_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS service_changes_after_update AFTER UPDATE ON services
+BEGIN
+    INSERT INTO service_changes (service_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS service_changes_after_delete AFTER DELETE ON services
+BEGIN
+    INSERT INTO service_changes (service_id) VALUES (old.id);
+END;
+
+-- Provider name, advertised services, rating (add_review) and approval status
+CREATE TRIGGER IF NOT EXISTS service_changes_provider_update AFTER UPDATE ON service_providers
+BEGIN
+    INSERT INTO service_changes (service_id)
+    SELECT id FROM services WHERE provider_id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS service_changes_user_city AFTER UPDATE OF city ON users
+BEGIN
+    INSERT INTO service_changes (service_id)
+    SELECT s.id FROM services s
+    JOIN service_providers sp ON s.provider_id = sp.id
+    WHERE sp.user_id = new.id;
+END;
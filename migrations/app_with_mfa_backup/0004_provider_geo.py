@@ -0,0 +1,31 @@
+# Coordinates for users and providers plus an R-tree of provider coverage areas
+# (location +/- service_radius) so radius search is an index probe, not LIKE '%city%'
+import geo
+
+def _add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def upgrade(conn):
+    for table in ('users', 'service_providers'):
+        _add_column(conn, table, 'latitude', 'REAL')
+        _add_column(conn, table, 'longitude', 'REAL')
+
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS provider_coverage USING rtree(
+            id, min_lat, max_lat, min_lng, max_lng
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS provider_coverage_after_delete AFTER DELETE ON service_providers
+        BEGIN
+            DELETE FROM provider_coverage WHERE id = old.id;
+        END
+    ''')
+
+    provider_ids = conn.execute('''
+        SELECT id FROM service_providers WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''').fetchall()
+    for (provider_id,) in provider_ids:
+        geo.sync_provider_coverage(conn, provider_id)
@@ -0,0 +1,20 @@
+-- Outbox for email/SMS delivery (outbox.py); requests only insert, a background worker sends
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,                  -- email | sms
+    recipient TEXT NOT NULL,
+    subject TEXT,
+    body TEXT NOT NULL,                     -- HTML for email, message text for SMS
+    text_body TEXT,                         -- plain-text alternative for email
+    status TEXT NOT NULL DEFAULT 'pending', -- pending | sending | sent | failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,          -- unix time
+    claimed_at REAL,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at REAL
+);
+
+-- Worker poll: due pending messages, plus stale 'sending' claims
+CREATE INDEX IF NOT EXISTS idx_outbox_status_due ON outbox (status, next_attempt_at);
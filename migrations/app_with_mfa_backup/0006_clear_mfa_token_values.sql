@@ -0,0 +1,3 @@
+-- mfa_tokens.token_hash now holds an HMAC digest (otp_hmac.py); stop keeping codes in plain text
+
+UPDATE mfa_tokens SET token_value = '' WHERE token_value != '';
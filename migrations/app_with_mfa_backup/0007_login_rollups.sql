@@ -0,0 +1,22 @@
+-- Hourly login rollups and retention bookkeeping for maintenance.py (app_with_mfa_backup.py)
+
+CREATE TABLE IF NOT EXISTS login_attempt_rollups (
+    hour TEXT NOT NULL,
+    account TEXT NOT NULL,
+    ip_address TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    PRIMARY KEY (hour, account, ip_address)
+) WITHOUT ROWID;
+
+-- security alerts: recent failures per account
+CREATE INDEX IF NOT EXISTS idx_login_attempt_rollups_account ON login_attempt_rollups (account, hour);
+
+-- Watermarks and running totals (rolled-up id, all-time counters)
+CREATE TABLE IF NOT EXISTS maintenance_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- purge_mfa_tokens
+CREATE INDEX IF NOT EXISTS idx_mfa_tokens_expires ON mfa_tokens (expires_at);
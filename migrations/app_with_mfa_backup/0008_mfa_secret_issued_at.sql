@@ -0,0 +1,4 @@
+-- When the pending TOTP secret was generated; NULL once enrollment is confirmed or MFA is disabled
+-- The enrollment QR code (it encodes the secret) is only served while this is recent
+
+ALTER TABLE users ADD COLUMN mfa_secret_issued_at TIMESTAMP;
@@ -0,0 +1,11 @@
+-- Indexes for conversations and messages (messaging.py)
+
+-- get_user_conversations: inbox per participant ordered by activity
+CREATE INDEX IF NOT EXISTS idx_conversations_customer_activity ON conversations (customer_id, last_message_at);
+CREATE INDEX IF NOT EXISTS idx_conversations_provider_activity ON conversations (provider_id, last_message_at);
+
+-- get_messages_for_conversation and the last-message lookup
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON messages (conversation_id, created_at);
+
+-- unread counters and mark_messages_read
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_unread ON messages (conversation_id, is_read, sender_id);
@@ -0,0 +1,26 @@
+-- Per-conversation inbox row maintained by save_message / mark_messages_read (messaging.py),
+-- replacing the per-row unread COUNT(*) and last-message subqueries in get_user_conversations
+
+CREATE TABLE IF NOT EXISTS conversation_summary (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversations(id),
+    last_message_id INTEGER,
+    last_sender_id INTEGER,
+    last_message TEXT,                          -- Preview: first MESSAGING_CONFIG['PREVIEW_CHARS'] characters
+    customer_unread INTEGER NOT NULL DEFAULT 0, -- Unread messages from the provider
+    provider_unread INTEGER NOT NULL DEFAULT 0  -- Unread messages from the customer
+);
+
+-- Backfill from existing conversations
+INSERT OR IGNORE INTO conversation_summary (conversation_id, last_message_id, customer_unread, provider_unread)
+SELECT c.id,
+       (SELECT MAX(m.id) FROM messages m WHERE m.conversation_id = c.id),
+       (SELECT COUNT(*) FROM messages m
+        WHERE m.conversation_id = c.id AND m.is_read = FALSE AND m.sender_id != c.customer_id),
+       (SELECT COUNT(*) FROM messages m
+        WHERE m.conversation_id = c.id AND m.is_read = FALSE AND m.sender_id != c.provider_id)
+FROM conversations c;
+
+UPDATE conversation_summary SET
+    last_sender_id = (SELECT m.sender_id FROM messages m WHERE m.id = conversation_summary.last_message_id),
+    last_message = (SELECT substr(m.message, 1, 200) FROM messages m WHERE m.id = conversation_summary.last_message_id)
+WHERE last_message_id IS NOT NULL;
@@ -0,0 +1,2 @@
+-- get_messages_since (history sync): messages after a known id within one conversation
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id, id);
@@ -0,0 +1,4 @@
+-- Idempotency key for messages committed through message_ingest: replaying an
+-- append log after a crash must not insert a message twice
+ALTER TABLE messages ADD COLUMN ingest_id TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_ingest_id ON messages (ingest_id) WHERE ingest_id IS NOT NULL;
@@ -0,0 +1,82 @@
+# otp_hmac.py - Keyed HMAC-SHA256 digests for short-lived one-time codes
+import hashlib
+import hmac
+import os
+import secrets
+import tempfile
+
+from werkzeug.security import check_password_hash
+
+# OTP Configuration
+OTP_CONFIG = {
+    'KEY_ENV': 'OTP_HMAC_KEY',              # Hex key shared by every app process
+    'KEY_FILE': os.path.join('data', 'otp_hmac.key'),
+    'DIGEST_PREFIX': 'hmac-sha256$',
+    'MIN_KEY_BYTES': 16
+}
+
+_key = None
+
+def _parse_key(text, source):
+    """Hex key -> bytes; an empty, malformed or short key is a configuration error, never a weak key"""
+    try:
+        key = bytes.fromhex((text or '').strip())
+    except ValueError:
+        raise RuntimeError(f'OTP HMAC key in {source} is not valid hex')
+    if len(key) < OTP_CONFIG['MIN_KEY_BYTES']:
+        raise RuntimeError(f"OTP HMAC key in {source} is shorter than {OTP_CONFIG['MIN_KEY_BYTES']} bytes")
+    return key
+
+def _load_key():
+    """Key from the environment, else a generated key persisted next to the database"""
+    configured = os.environ.get(OTP_CONFIG['KEY_ENV'])
+    if configured is not None:
+        return _parse_key(configured, OTP_CONFIG['KEY_ENV'])
+
+    path = OTP_CONFIG['KEY_FILE']
+    try:
+        with open(path) as f:
+            return _parse_key(f.read(), path)
+    except FileNotFoundError:
+        pass
+
+    # Write the whole key to a private temp file, then publish it with link():
+    # the key file never exists half-written, and when processes race the first
+    # link wins and everyone else reads that key
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    key = secrets.token_bytes(32)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.otp_hmac.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(key.hex())
+            f.flush()
+            os.fsync(f.fileno())
+        os.link(tmp_path, path)
+    except FileExistsError:
+        with open(path) as f:
+            return _parse_key(f.read(), path)
+    finally:
+        os.remove(tmp_path)
+    return key
+
+def get_key():
+    global _key
+    if _key is None:
+        _key = _load_key()
+    return _key
+
+def digest(user_id, otp_type, code):
+    """Stored form of a code; bound to the user and purpose so rows cannot be swapped"""
+    message = f'{user_id}:{otp_type}:{code}'.encode()
+    return OTP_CONFIG['DIGEST_PREFIX'] + hmac.new(get_key(), message, hashlib.sha256).hexdigest()
+
+def matches(stored, user_id, otp_type, code):
+    """Constant-time check of a submitted code against its stored digest"""
+    if not stored or code is None:
+        return False
+    code = str(code).strip()
+    if stored.startswith(OTP_CONFIG['DIGEST_PREFIX']):
+        return hmac.compare_digest(stored, digest(user_id, otp_type, code))
+    # Codes issued before the HMAC switch were PBKDF2 hashes; they expire within minutes
+    return check_password_hash(stored, code)
@@ -0,0 +1,294 @@
+# outbox.py - Persistent outbox and background delivery for email and SMS
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import db_pool
+import db_storage
+
+# Outbox Configuration
+OUTBOX_CONFIG = {
+    'TRANSPORT': os.environ.get('OUTBOX_TRANSPORT', 'console'),  # console | live | stub
+    'BATCH_SIZE': 50,                   # Messages claimed per poll
+    'SEND_CONCURRENCY': 8,              # Parallel sends (Twilio calls, SMTP sessions)
+    'SMTP_POOL_SIZE': 2,                # Persistent SMTP connections
+    'SMTP_IDLE_SECONDS': 60,            # NOOP-check a pooled SMTP connection idle this long
+    'POLL_INTERVAL_SECONDS': 1.0,       # Wake-up cadence when nothing was enqueued locally
+    'CLAIM_TIMEOUT_SECONDS': 120,       # Re-deliver messages a dead worker left in 'sending'
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE_SECONDS': 2.0,        # Doubled per attempt with jitter
+    'BACKOFF_MAX_SECONDS': 300
+}
+
+class ConsoleTransport:
+    """Development transport: prints the message (OTP codes appear in the server log)"""
+
+    def send(self, message):
+        icon = '📧' if message['channel'] == 'email' else '📱'
+        print(f"{icon} {message['channel'].upper()} to {message['recipient']}: {message['text'] or message['body']}")
+
+class StubTransport:
+    """In-memory transport for tests; fail_times makes the next N sends raise"""
+
+    def __init__(self):
+        self.sent = []
+        self.fail_times = 0
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            if self.fail_times:
+                self.fail_times -= 1
+                raise RuntimeError('Stub transport failure')
+            self.sent.append(dict(message))
+
+class SmtpTransport:
+    """Sends through a small pool of logged-in SMTP connections instead of one per message"""
+
+    def __init__(self, server, port, username, password, sender=None, pool_size=None):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size or OUTBOX_CONFIG['SMTP_POOL_SIZE'])
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=30)
+        smtp.starttls()
+        smtp.login(self.username, self.password)
+        return smtp
+
+    def _acquire(self):
+        while True:
+            try:
+                smtp, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            if time.monotonic() - last_used < OUTBOX_CONFIG['SMTP_IDLE_SECONDS']:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except smtplib.SMTPException:
+                pass
+            self._discard(smtp)
+
+    def _discard(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+    def send(self, message):
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.sender
+        msg['To'] = message['recipient']
+        msg['Subject'] = message['subject'] or ''
+        if message['text']:
+            msg.attach(MIMEText(message['text'], 'plain'))
+        msg.attach(MIMEText(message['body'], 'html'))
+
+        with self._slots:
+            smtp = self._acquire()
+            try:
+                smtp.sendmail(self.sender, message['recipient'], msg.as_string())
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._discard(smtp)
+                raise
+            except Exception:
+                # Recipient/content errors leave the session usable
+                self._idle.put((smtp, time.monotonic()))
+                raise
+            self._idle.put((smtp, time.monotonic()))
+
+    def close(self):
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(smtp)
+
+class TwilioTransport:
+    def __init__(self, client, from_number):
+        self.client = client
+        self.from_number = from_number
+
+    def send(self, message):
+        self.client.messages.create(body=message['body'], from_=self.from_number, to=message['recipient'])
+
+@db_storage.retry_on_busy
+def enqueue(database, channel, recipient, body, subject=None, text=None):
+    """Persist a message for background delivery; returns the outbox id"""
+    conn = db_pool.connect(database)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO outbox (channel, recipient, subject, body, text_body, next_attempt_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (channel, recipient, subject, body, text, time.time()))
+    message_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+
+    worker = _workers.get(database)
+    if worker is not None:
+        worker.wake()
+    return message_id
+
+def backoff_seconds(attempts):
+    delay = min(OUTBOX_CONFIG['BACKOFF_BASE_SECONDS'] * (2 ** (attempts - 1)), OUTBOX_CONFIG['BACKOFF_MAX_SECONDS'])
+    return delay + random.uniform(0, delay / 2)
+
+class OutboxWorker:
+    """Claims due outbox rows in batches and delivers them concurrently"""
+
+    def __init__(self, database, transports):
+        self.database = database
+        self.transports = transports      # channel -> transport with send(message)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=OUTBOX_CONFIG['SEND_CONCURRENCY'],
+                                            thread_name_prefix='outbox-send')
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    @db_storage.retry_on_busy
+    def _claim(self):
+        now = time.time()
+        conn = db_pool.connect(self.database)
+        try:
+            # IMMEDIATE so two workers (processes) never claim the same rows
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                UPDATE outbox SET status = 'pending'
+                WHERE status = 'sending' AND claimed_at < ?
+            ''', (now - OUTBOX_CONFIG['CLAIM_TIMEOUT_SECONDS'],))
+            rows = conn.execute('''
+                SELECT id, channel, recipient, subject, body, text_body, attempts
+                FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at LIMIT ?
+            ''', (now, OUTBOX_CONFIG['BATCH_SIZE'])).fetchall()
+            if rows:
+                conn.executemany('''
+                    UPDATE outbox SET status = 'sending', attempts = attempts + 1, claimed_at = ?
+                    WHERE id = ?
+                ''', [(now, row[0]) for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+        columns = ('id', 'channel', 'recipient', 'subject', 'body', 'text', 'attempts')
+        return [dict(zip(columns, row), attempts=row[6] + 1) for row in rows]
+
+    def _deliver(self, message):
+        try:
+            self.transports[message['channel']].send(message)
+            return message, None
+        except Exception as e:
+            return message, e
+
+    @db_storage.retry_on_busy
+    def _record(self, results):
+        now = time.time()
+        sent, retry, failed = [], [], []
+        for message, error in results:
+            if error is None:
+                sent.append((now, message['id']))
+            elif message['attempts'] >= OUTBOX_CONFIG['MAX_ATTEMPTS']:
+                failed.append((str(error), message['id']))
+            else:
+                retry.append((now + backoff_seconds(message['attempts']), str(error), message['id']))
+            if error is not None:
+                print(f"Outbox {message['channel']} delivery to {message['recipient']} failed "
+                      f"(attempt {message['attempts']}): {error}")
+
+        conn = db_pool.connect(self.database)
+        # Bodies carry one-time codes; drop them once they are no longer needed
+        conn.executemany('''
+            UPDATE outbox SET status = 'sent', sent_at = ?, body = '', text_body = NULL WHERE id = ?
+        ''', sent)
+        conn.executemany('''
+            UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ? WHERE id = ?
+        ''', retry)
+        conn.executemany('''
+            UPDATE outbox SET status = 'failed', last_error = ?, body = '', text_body = NULL WHERE id = ?
+        ''', failed)
+        conn.commit()
+        conn.close()
+
+    def run_once(self):
+        """Claim and deliver one batch; returns the number of messages attempted"""
+        messages = self._claim()
+        if messages:
+            self._record(list(self._executor.map(self._deliver, messages)))
+        return len(messages)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once() == OUTBOX_CONFIG['BATCH_SIZE']:
+                    continue
+            except Exception as e:
+                print(f"Outbox worker error for {self.database}: {e}")
+            self._wake.wait(OUTBOX_CONFIG['POLL_INTERVAL_SECONDS'])
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=f'outbox-{self.database}', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
+        for transport in self.transports.values():
+            if hasattr(transport, 'close'):
+                transport.close()
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+def build_transports(smtp_config=None, twilio_client=None, twilio_number=None):
+    """Transports for OUTBOX_CONFIG['TRANSPORT']; live falls back to console per channel"""
+    mode = OUTBOX_CONFIG['TRANSPORT']
+    if mode == 'stub':
+        stub = StubTransport()
+        return {'email': stub, 'sms': stub}
+    transports = {'email': ConsoleTransport(), 'sms': ConsoleTransport()}
+    if mode == 'live':
+        if smtp_config:
+            transports['email'] = SmtpTransport(**smtp_config)
+        if twilio_client is not None:
+            transports['sms'] = TwilioTransport(twilio_client, twilio_number)
+    return transports
+
+def start_worker(database, transports):
+    """Start the delivery worker for a database (idempotent)"""
+    worker = _workers.get(database)
+    if worker is None:
+        with _workers_lock:
+            worker = _workers.get(database)
+            if worker is None:
+                worker = _workers[database] = OutboxWorker(database, transports)
+                worker.start()
+    return worker
+
+def stop_workers():
+    with _workers_lock:
+        workers = list(_workers.values())
+        _workers.clear()
+    for worker in workers:
+        worker.stop()
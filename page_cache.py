@@ -0,0 +1,122 @@
+# page_cache.py - Response cache for anonymous GET pages: pre-compressed bodies, ETag, 304s
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, current_app, request, session
+
+# Page Cache Configuration
+PAGE_CACHE_CONFIG = {
+    'MAX_ENTRIES': 512,
+    'MAX_BODY_BYTES': 2 * 1024 * 1024,  # Larger responses are passed through uncached
+    'TTL_SECONDS': 300,                 # Server-side freshness; edits to the files show up within this
+    'BROWSER_MAX_AGE': 60,              # Clients revalidate (cheap 304) after this
+    'MIN_COMPRESS_BYTES': 512,
+    'COMPRESS_LEVEL': 6,
+    'COMPRESSIBLE_TYPES': ('text/', 'application/javascript', 'application/json',
+                           'image/svg+xml', 'application/xml')
+}
+
+class CachedPage:
+    __slots__ = ('body', 'gzip_body', 'mimetype', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, body, mimetype, last_modified):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = last_modified
+        self.expires_at = time.monotonic() + PAGE_CACHE_CONFIG['TTL_SECONDS']
+        self.gzip_body = None
+        if (len(body) >= PAGE_CACHE_CONFIG['MIN_COMPRESS_BYTES']
+                and mimetype.startswith(PAGE_CACHE_CONFIG['COMPRESSIBLE_TYPES'])):
+            compressed = gzip.compress(body, compresslevel=PAGE_CACHE_CONFIG['COMPRESS_LEVEL'], mtime=0)
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+
+_cache = OrderedDict()                  # (app name, path, query string) -> CachedPage
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0}
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+def _has_session():
+    return current_app.config['SESSION_COOKIE_NAME'] in request.cookies
+
+def _lookup(key):
+    with _lock:
+        page = _cache.get(key)
+        if page is None:
+            return None
+        if page.expires_at <= time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return page
+
+def _store(key, response):
+    """CachedPage for a plain 200 response, or None when it must not be shared"""
+    if (response.status_code != 200 or session.modified or response.headers.get('Set-Cookie')
+            or response.headers.get('Content-Encoding') or 'private' in response.headers.get('Cache-Control', '')):
+        return None
+    # send_from_directory streams the file; read it once here
+    response.direct_passthrough = False
+    body = response.get_data()
+    response.close()
+    if len(body) > PAGE_CACHE_CONFIG['MAX_BODY_BYTES']:
+        return None
+    last_modified = response.last_modified or datetime.now(timezone.utc).replace(microsecond=0)
+    page = CachedPage(body, response.mimetype or 'application/octet-stream', last_modified)
+    with _lock:
+        _cache[key] = page
+        _cache.move_to_end(key)
+        while len(_cache) > PAGE_CACHE_CONFIG['MAX_ENTRIES']:
+            _cache.popitem(last=False)
+    return page
+
+def _respond(page):
+    # Honour q-values: 'gzip;q=0' or a preferred identity means the plain body
+    use_gzip = (page.gzip_body is not None and
+                request.accept_encodings.best_match(['gzip', 'identity'], default='identity') == 'gzip')
+    response = Response(page.gzip_body if use_gzip else page.body, mimetype=page.mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    # The entity differs per encoding, so does the validator
+    response.set_etag(page.etag + ('-gz' if use_gzip else ''))
+    response.last_modified = page.last_modified
+    response.headers['Cache-Control'] = f"public, max-age={PAGE_CACHE_CONFIG['BROWSER_MAX_AGE']}"
+    response.vary.update(('Accept-Encoding', 'Cookie'))
+    if response.make_conditional(request).status_code == 304:
+        _count('not_modified')
+    return response
+
+def cached_page(view):
+    """Serve the view from the page cache for anonymous GET/HEAD requests"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or _has_session():
+            _count('bypassed')
+            return view(*args, **kwargs)
+        key = (current_app.name, request.path, request.query_string)
+        page = _lookup(key)
+        if page is not None:
+            _count('hits')
+            return _respond(page)
+        _count('misses')
+        response = current_app.make_response(view(*args, **kwargs))
+        page = _store(key, response)
+        return _respond(page) if page is not None else response
+    return wrapper
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+def stats():
+    with _lock:
+        return dict(_stats, entries=len(_cache))
@@ -0,0 +1,58 @@
+# pagination.py - Keyset (cursor) pagination helpers
+import base64
+import json
+
+# Pagination Configuration
+PAGINATION_CONFIG = {
+    'DEFAULT_PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 100
+}
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(values):
+    """Opaque cursor for the sort key of the last row on a page (key values + id)"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, size):
+    """Decode a cursor produced by encode_cursor(); None means first page"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor('Cursor does not match this listing')
+    if not all(value is None or isinstance(value, (int, float, str)) for value in values):
+        raise InvalidCursor('Malformed cursor')
+    return values
+
+def page_size(value, default=None):
+    """Clamp a client supplied page size"""
+    default = default or PAGINATION_CONFIG['DEFAULT_PAGE_SIZE']
+    try:
+        size = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, PAGINATION_CONFIG['MAX_PAGE_SIZE']))
+
+def keyset_condition(columns, cursor_values, descending=True):
+    """SQL row-value predicate selecting rows strictly after the cursor
+
+    columns must be the full ORDER BY key (ending in a unique id) and all
+    sorted in the same direction, e.g. ('o.created_at', 'o.id')."""
+    if cursor_values is None:
+        return '', []
+    operator = '<' if descending else '>'
+    return f"({', '.join(columns)}) {operator} ({', '.join('?' for _ in columns)})", list(cursor_values)
+
+def paginate(rows, limit, key):
+    """Split rows fetched with LIMIT limit + 1 into (page, next_cursor)"""
+    if len(rows) > limit:
+        page = rows[:limit]
+        return page, encode_cursor(key(page[-1]))
+    return rows, None
@@ -0,0 +1,130 @@
+# password_hashing.py - Password hashing on a bounded process pool with admission control
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import has_request_context, jsonify
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import rate_limit
+
+# Hashing Configuration
+HASH_CONFIG = {
+    'METHOD': 'pbkdf2:sha256:600000',   # Stored hashes with other parameters are upgraded at login
+    'SALT_LENGTH': 16,
+    'WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    'MAX_PENDING': 32,                  # Hash jobs queued or running across all clients
+    'MAX_PENDING_PER_CLIENT': 2,        # Per IP, so one burst cannot take every slot
+    'TIMEOUT_SECONDS': 5,
+    'RETRY_AFTER_SECONDS': 1
+}
+
+class HashingBusy(Exception):
+    """The hashing pool is saturated (globally or for this client); answer 429"""
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+def _verify(pwhash, password, method, salt_length):
+    """(matches, upgraded_hash); upgraded_hash is set when pwhash used other parameters"""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if pwhash.split('$', 1)[0] != method:
+        return True, _hash(password, method, salt_length)
+    return True, None
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_CONFIG['MAX_PENDING'])
+_client_pending = {}
+_client_lock = threading.Lock()
+
+def start():
+    """Create the worker processes; call at import time, before any background threads start"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # fork: spawn/forkserver would re-import the app module (and its init) in every worker
+            _executor = ProcessPoolExecutor(max_workers=HASH_CONFIG['WORKERS'],
+                                            mp_context=multiprocessing.get_context('fork'))
+            # With fork every worker is created on first submit
+            _executor.submit(int).result()
+    return _executor
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _admit(client):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy('Hashing pool saturated')
+    with _client_lock:
+        pending = _client_pending.get(client, 0)
+        if pending >= HASH_CONFIG['MAX_PENDING_PER_CLIENT']:
+            _slots.release()
+            raise HashingBusy('Too many concurrent requests from this client')
+        _client_pending[client] = pending + 1
+
+def _release(client):
+    with _client_lock:
+        pending = _client_pending.get(client, 1) - 1
+        if pending:
+            _client_pending[client] = pending
+        else:
+            _client_pending.pop(client, None)
+    _slots.release()
+
+def _run(client, func, *args):
+    if client is None and has_request_context():
+        client = client_key()
+    _admit(client)
+    try:
+        future = start().submit(func, *args)
+    except BrokenProcessPool:
+        # A worker died; the next request gets a fresh pool
+        _release(client)
+        shutdown()
+        raise HashingBusy('Hashing pool restarting')
+    except Exception:
+        _release(client)
+        raise
+    # Slots free when the job really finishes, even if this request gave up waiting
+    future.add_done_callback(lambda _: _release(client))
+    try:
+        return future.result(timeout=HASH_CONFIG['TIMEOUT_SECONDS'])
+    except FutureTimeoutError:
+        future.cancel()
+        raise HashingBusy('Hashing timed out')
+    except BrokenProcessPool:
+        shutdown()
+        raise HashingBusy('Hashing pool restarting')
+
+def client_key():
+    """Fairness key for the current request: the client address, X-Real-IP only from a trusted proxy"""
+    return rate_limit.client_ip()
+
+def hash_password(password, client=None):
+    return _run(client, _hash, password, HASH_CONFIG['METHOD'], HASH_CONFIG['SALT_LENGTH'])
+
+def verify_password(pwhash, password, client=None):
+    """(matches, upgraded_hash); store upgraded_hash when it is not None"""
+    if not pwhash:
+        return False, None
+    return _run(client, _verify, pwhash, password, HASH_CONFIG['METHOD'], HASH_CONFIG['SALT_LENGTH'])
+
+def busy_response(error):
+    response = jsonify({'success': False, 'error': 'Server busy, please retry shortly', 'message': str(error)})
+    response.headers['Retry-After'] = str(HASH_CONFIG['RETRY_AFTER_SECONDS'])
+    return response, 429
+
+def stats():
+    with _client_lock:
+        clients = len(_client_pending)
+        pending = sum(_client_pending.values())
+    return {'workers': HASH_CONFIG['WORKERS'], 'pending': pending, 'clients': clients,
+            'max_pending': HASH_CONFIG['MAX_PENDING']}
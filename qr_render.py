@@ -0,0 +1,120 @@
+# qr_render.py - TOTP enrollment QR codes rendered in worker processes and cached per URI
+import io
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import qrcode
+import qrcode.image.svg
+
+# QR Configuration
+QR_CONFIG = {
+    'WORKERS': 2,
+    'CACHE_ENTRIES': 2000,
+    'CACHE_TTL_SECONDS': 900,           # Enrollment window: secret generated -> code scanned
+    'BOX_SIZE': 10,
+    'BORDER': 5,
+    'TIMEOUT_SECONDS': 10,
+    'DEFAULT_FORMAT': 'svg'             # svg needs no PIL; png is kept for older clients
+}
+
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+def _render(data, fmt, box_size, border):
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    if fmt == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+_executor = None
+_executor_lock = threading.Lock()
+_cache = OrderedDict()                  # (data, fmt) -> (expires_at, image bytes)
+_pending = {}                           # (data, fmt) -> Future, so a burst renders once
+_cache_lock = threading.Lock()
+
+def start():
+    """Create the worker processes; like password_hashing.start(), call before background threads start"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=QR_CONFIG['WORKERS'],
+                                            mp_context=multiprocessing.get_context('fork'))
+            _executor.submit(int).result()
+    return _executor
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _cached(key):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return entry[1]
+
+def _store(key, future):
+    with _cache_lock:
+        _pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        _cache[key] = (time.monotonic() + QR_CONFIG['CACHE_TTL_SECONDS'], future.result())
+        while len(_cache) > QR_CONFIG['CACHE_ENTRIES']:
+            _cache.popitem(last=False)
+
+def prefetch(data, fmt=None):
+    """Start rendering without waiting (e.g. when the TOTP secret is issued); returns the Future or None"""
+    fmt = fmt or QR_CONFIG['DEFAULT_FORMAT']
+    key = (data, fmt)
+    with _cache_lock:
+        if _cached(key) is not None:
+            return None
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        try:
+            future = start().submit(_render, data, fmt, QR_CONFIG['BOX_SIZE'], QR_CONFIG['BORDER'])
+        except BrokenProcessPool:
+            shutdown()
+            future = start().submit(_render, data, fmt, QR_CONFIG['BOX_SIZE'], QR_CONFIG['BORDER'])
+        _pending[key] = future
+    future.add_done_callback(lambda done: _store(key, done))
+    return future
+
+def get(data, fmt=None):
+    """(image bytes, mimetype) for data; rendered once per enrollment window"""
+    fmt = fmt or QR_CONFIG['DEFAULT_FORMAT']
+    if fmt not in MIMETYPES:
+        raise ValueError(f'Unsupported QR format: {fmt}')
+    while True:
+        with _cache_lock:
+            image = _cached((data, fmt))
+        if image is not None:
+            return image, MIMETYPES[fmt]
+        future = prefetch(data, fmt)
+        if future is not None:
+            return future.result(timeout=QR_CONFIG['TIMEOUT_SECONDS']), MIMETYPES[fmt]
+
+def forget(data):
+    """Drop every cached rendering of data (the secret was replaced or enrollment finished)"""
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == data]:
+            del _cache[key]
+
+def stats():
+    with _cache_lock:
+        return {'cached': len(_cache), 'rendering': len(_pending), 'workers': QR_CONFIG['WORKERS']}
@@ -0,0 +1,217 @@
+# rate_limit.py - Sliding-window rate limits for login and OTP endpoints
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request, session
+
+import db_pool
+
+# Rate Limit Configuration
+RATE_LIMIT_CONFIG = {
+    'MODE': os.environ.get('RATE_LIMIT_MODE', 'memory'),    # memory | sqlite (shared by processes)
+    'SHARED_DATABASE': os.path.join('data', 'rate_limits.db'),
+    'MAX_KEYS': 100000,                 # Memory mode: prune idle keys past this size
+    # Comma-separated addresses of reverse proxies whose X-Real-IP header is believed;
+    # from anyone else the header is client-controlled and ignored
+    'TRUSTED_PROXIES': {ip.strip() for ip in os.environ.get('TRUSTED_PROXIES', '').split(',') if ip.strip()},
+    'RULES': {
+        # name: (requests allowed, window seconds)
+        'login_ip': (30, 300),
+        'login_account': (10, 900),
+        'verify_ip': (30, 300),
+        'verify_user': (5, 300),
+        'resend_ip': (10, 600),
+        'resend_user': (3, 600)
+    }
+}
+
+def _estimate(window, now, window_start, current, previous):
+    """Sliding window estimate from the current and previous fixed windows"""
+    elapsed = now - window_start
+    if elapsed >= 2 * window:
+        return 0.0, now - now % window, 0, 0
+    if elapsed >= window:
+        window_start += window
+        previous, current = current, 0
+        elapsed -= window
+    weight = 1 - elapsed / window
+    return previous * weight + current, window_start, current, previous
+
+def _retry_after(window, now, window_start, current, previous, limit):
+    """Seconds until the estimate drops below limit (approximate, >= 1)"""
+    if previous and current < limit:
+        # previous * (1 - elapsed / window) + current < limit
+        needed = window * (1 - (limit - current) / previous) - (now - window_start)
+        return max(1, math.ceil(needed))
+    return max(1, math.ceil(window_start + window - now))
+
+class MemoryLimiter:
+    """Per-process counters; no I/O on the request path"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}               # key -> (window_start, current, previous)
+
+    def _prune(self, now):
+        longest = max(window for _, window in RATE_LIMIT_CONFIG['RULES'].values())
+        stale = [key for key, (start, _, _) in self._counters.items() if now - start >= 2 * longest]
+        for key in stale:
+            del self._counters[key]
+        if len(self._counters) >= RATE_LIMIT_CONFIG['MAX_KEYS']:
+            # Still full of live keys: forget the oldest windows first
+            oldest = sorted(self._counters.items(), key=lambda item: item[1][0])
+            for key, _ in oldest[:len(oldest) // 10 or 1]:
+                del self._counters[key]
+
+    def hit(self, key, limit, window):
+        """Count one request; returns (allowed, retry_after_seconds)"""
+        now = time.time()
+        with self._lock:
+            start, current, previous = self._counters.get(key, (now - now % window, 0, 0))
+            estimate, start, current, previous = _estimate(window, now, start, current, previous)
+            if estimate >= limit:
+                self._counters[key] = (start, current, previous)
+                return False, _retry_after(window, now, start, current, previous, limit)
+            if key not in self._counters and len(self._counters) >= RATE_LIMIT_CONFIG['MAX_KEYS']:
+                self._prune(now)
+            self._counters[key] = (start, current + 1, previous)
+            return True, 0
+
+    def peek(self, key, limit, window):
+        """Like hit() but counts nothing; (allowed, retry_after_seconds)"""
+        now = time.time()
+        with self._lock:
+            start, current, previous = self._counters.get(key, (now - now % window, 0, 0))
+        estimate, start, current, previous = _estimate(window, now, start, current, previous)
+        if estimate >= limit:
+            return False, _retry_after(window, now, start, current, previous, limit)
+        return True, 0
+
+class SqliteLimiter:
+    """Counters in a small dedicated SQLite file so every worker process shares them"""
+
+    def __init__(self, database):
+        self.database = database
+        os.makedirs(os.path.dirname(database) or '.', exist_ok=True)
+        conn = db_pool.connect(database)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                window_start REAL NOT NULL,
+                current INTEGER NOT NULL,
+                previous INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        conn.close()
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        conn = db_pool.connect(self.database)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT window_start, current, previous FROM rate_limits WHERE key = ?',
+                               (key,)).fetchone()
+            start, current, previous = row if row else (now - now % window, 0, 0)
+            estimate, start, current, previous = _estimate(window, now, start, current, previous)
+            allowed = estimate < limit
+            if allowed:
+                current += 1
+            conn.execute('''
+                INSERT INTO rate_limits (key, window_start, current, previous) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET window_start = excluded.window_start,
+                    current = excluded.current, previous = excluded.previous
+            ''', (key, start, current, previous))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return allowed, 0 if allowed else _retry_after(window, now, start, current, previous, limit)
+
+    def peek(self, key, limit, window):
+        now = time.time()
+        conn = db_pool.connect(self.database)
+        try:
+            row = conn.execute('SELECT window_start, current, previous FROM rate_limits WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            conn.close()
+        start, current, previous = row if row else (now - now % window, 0, 0)
+        estimate, start, current, previous = _estimate(window, now, start, current, previous)
+        if estimate >= limit:
+            return False, _retry_after(window, now, start, current, previous, limit)
+        return True, 0
+
+    def purge(self):
+        """Drop counters idle for two of the longest windows"""
+        longest = max(window for _, window in RATE_LIMIT_CONFIG['RULES'].values())
+        conn = db_pool.connect(self.database)
+        conn.execute('DELETE FROM rate_limits WHERE window_start < ?', (time.time() - 2 * longest,))
+        conn.commit()
+        conn.close()
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if RATE_LIMIT_CONFIG['MODE'] == 'sqlite':
+                    _limiter = SqliteLimiter(RATE_LIMIT_CONFIG['SHARED_DATABASE'])
+                else:
+                    _limiter = MemoryLimiter()
+    return _limiter
+
+def hit(rule, identity):
+    """Count a request against rule for identity; (allowed, retry_after)"""
+    limit, window = RATE_LIMIT_CONFIG['RULES'][rule]
+    return get_limiter().hit(f'{rule}:{identity}', limit, window)
+
+# Identity extractors for limit(); returning None skips the rule
+
+def client_ip():
+    if request.remote_addr in RATE_LIMIT_CONFIG['TRUSTED_PROXIES']:
+        return request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
+    return request.remote_addr
+
+def json_field(*names):
+    def identity():
+        data = request.get_json(silent=True) or {}
+        for name in names:
+            value = data.get(name)
+            if value:
+                return str(value).strip().lower()
+        return None
+    return identity
+
+def session_value(name):
+    return lambda: session.get(name)
+
+def limit(*rules):
+    """Route decorator: reject with 429 once any (rule, identity_func) is over its limit
+
+    Runs before the view, so rejected requests never reach the database."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            for rule, identity_func in rules:
+                identity = identity_func()
+                if identity is None:
+                    continue
+                allowed, retry_after = hit(rule, identity)
+                if not allowed:
+                    response = jsonify({'success': False,
+                                        'error': 'Too many attempts. Please try again later.',
+                                        'message': 'Too many attempts. Please try again later.'})
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response, 429
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,155 @@
+# search_cache.py - LRU/TTL cache for search results keyed by normalized query
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import db_pool
+
+# Cache Configuration
+CACHE_CONFIG = {
+    'MAX_ENTRIES': 2048,
+    'MAX_BYTES': 32 * 1024 * 1024,     # Approximate JSON size of all cached results
+    'TTL_SECONDS': 300,
+    'VERSION_CHECK_SECONDS': 1.0       # Re-read the data version at most this often
+}
+
+# Free-text parameters; FTS and the in-memory index are case-insensitive
+TEXT_PARAMS = ('search', 'search_term')
+
+def _normalize(value, lowercase=False):
+    if isinstance(value, dict):
+        normalized = {}
+        for name, item in value.items():
+            item = _normalize(item, name in TEXT_PARAMS)
+            if item not in (None, '', {}, []):
+                normalized[name] = item
+        return normalized
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        value = ' '.join(value.split())
+        return value.lower() if lowercase else value
+    return value
+
+def normalize_query(namespace, params):
+    """Stable cache key: empty params dropped, whitespace collapsed, keys sorted"""
+    return namespace + ':' + json.dumps(_normalize(dict(params)), sort_keys=True, separators=(',', ':'))
+
+def service_changes_version(database):
+    """Version source bumped by every services/provider write (service_changes triggers)
+
+    Read from sqlite_sequence so it keeps increasing after old change rows are purged."""
+    def version():
+        conn = db_pool.connect(database)
+        try:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'service_changes'").fetchone()
+        except sqlite3.OperationalError:
+            # Schema not migrated yet
+            row = None
+        finally:
+            conn.close()
+        return row[0] if row else 0
+    return version
+
+class SearchCache:
+    """Thread-safe LRU of JSON-able results, dropped wholesale when the data version moves"""
+
+    def __init__(self, version_func, max_entries=None, max_bytes=None, ttl=None):
+        self.version_func = version_func
+        self.max_entries = max_entries or CACHE_CONFIG['MAX_ENTRIES']
+        self.max_bytes = max_bytes or CACHE_CONFIG['MAX_BYTES']
+        self.ttl = ttl or CACHE_CONFIG['TTL_SECONDS']
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()     # key -> (expires_at, size, value)
+        self._misses = {}                 # key -> generation when the miss happened
+        self._generation = 0
+        self._bytes = 0
+        self._version = None
+        self._checked_at = 0.0
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                          'invalidations': 0, 'oversized': 0}
+
+    def _clear(self):
+        self._entries.clear()
+        self._misses.clear()
+        self._generation += 1
+        self._bytes = 0
+
+    def _miss(self, key):
+        if len(self._misses) >= self.max_entries:
+            self._misses.clear()
+        self._misses[key] = self._generation
+        self._counters['misses'] += 1
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < CACHE_CONFIG['VERSION_CHECK_SECONDS']:
+            return
+        version = self.version_func()
+        self._checked_at = now
+        if version != self._version:
+            if self._entries:
+                self._counters['invalidations'] += 1
+            self._clear()
+            self._version = version
+
+    def bump(self):
+        """Invalidate now, e.g. right after this process committed a services/rating write"""
+        with self._lock:
+            if self._entries:
+                self._counters['invalidations'] += 1
+            self._clear()
+            self._checked_at = 0.0
+
+    def get(self, key):
+        """Cached value or None"""
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._miss(key)
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self._counters['expirations'] += 1
+                self._miss(key)
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        """Store the result computed after get(key) missed"""
+        size = len(json.dumps(value, default=str))
+        with self._lock:
+            self._check_version()
+            if self._misses.pop(key, None) != self._generation:
+                # Invalidated while the result was being computed
+                return
+            if size > self.max_bytes // 4:
+                # One huge result would flush everything else
+                self._counters['oversized'] += 1
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return dict(self._counters,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        max_bytes=self.max_bytes,
+                        version=self._version,
+                        hit_rate=round(self._counters['hits'] / lookups, 4) if lookups else 0.0)
@@ -0,0 +1,417 @@
+# search_engine.py - In-process inverted index for service search
+import bisect
+import heapq
+import math
+import threading
+import time
+from array import array
+
+import db_pool
+from search_index import SEARCH_CONFIG, TOKEN_PATTERN
+from facets import FACET_CONFIG, FacetCounter, bucket_index, format_facets
+from pagination import paginate
+
+# Engine Configuration
+ENGINE_CONFIG = {
+    'SYNC_INTERVAL_SECONDS': 1.0,      # Poll service_changes at most this often
+    'COMPACT_RATIO': 0.25,             # Rebuild postings once this share of docs is dead
+    'MAX_PREFIX_EXPANSIONS': 50,       # Vocabulary terms a single query prefix may expand to
+    'BM25_K1': 1.2,
+    'BM25_B': 0.75
+}
+
+FIELDS = ('title', 'description', 'category', 'tags', 'business_name')
+UNAVAILABLE_VALUES = {'', '0', 'false', 'no', 'unavailable', 'none'}
+
+# Rows feeding the index, one query per schema; {filter} narrows an incremental sync
+SERVICE_INDEX_QUERIES = {
+    'app': '''
+        SELECT s.id, s.provider_id, s.title, s.description, s.category, '' AS tags,
+               u.name AS business_name, s.price, s.rating, s.location AS city,
+               1 AS availability, s.created_at
+        FROM services s
+        LEFT JOIN users u ON s.provider_id = u.id
+        WHERE 1=1 {filter}
+    ''',
+    'app_with_mfa_backup': '''
+        SELECT s.id, s.provider_id, s.title, s.description, s.category, sp.services AS tags,
+               sp.business_name, s.price, sp.rating, u.city, s.availability, s.created_at,
+               s.duration, sp.total_reviews
+        FROM services s
+        JOIN service_providers sp ON s.provider_id = sp.id
+        JOIN users u ON sp.user_id = u.id
+        WHERE sp.status = 'active' {filter}
+    '''
+}
+
+def stem(word):
+    """Light suffix stripping so plumber/plumbing/plumbs share a root"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+    for suffix in ('ment', 'ing', 'ed', 'er', 'ly'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_PATTERN.findall((text or '').lower())]
+
+def iter_bits(bits):
+    """Yield the set bit positions of an int bitset in ascending order"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+class ServiceIndex:
+    """Inverted index over services with bitset filters and incremental sync
+
+    Postings are sorted arrays of internal document numbers. Documents are
+    append-only: an edited service gets a new number and the old one is
+    masked out of the live bitset until the next compaction."""
+
+    def __init__(self, database, source_query):
+        self.database = database
+        self.source_query = source_query
+        self._lock = threading.RLock()
+        self._last_seq = 0
+        self._last_sync = 0.0
+        self._stale = False
+        self._reset()
+
+    def _reset(self):
+        self._service_ids = array('q')      # docno -> service id
+        self._docno = {}                    # service id -> live docno
+        self._payloads = []                 # docno -> row dict (None once dead)
+        self._lengths = array('d')          # docno -> weighted token count
+        self._prices = array('d')
+        self._ratings = array('d')
+        self._postings = {}                 # term -> (array('I') docnos, array('d') weighted tf)
+        self._vocab = []                    # sorted terms for prefix expansion
+        self._live = 0
+        self._live_count = 0
+        self._total_length = 0.0
+        self._category_bits = {}            # Exact values, like s.category = ? and FacetCounter
+        self._city_bits = {}
+        self._available_bits = 0
+        self._price_bits = {}
+        self._rating_bits = {}
+
+    # -- building ---------------------------------------------------------
+
+    def _add(self, row):
+        docno = len(self._service_ids)
+        bit = 1 << docno
+
+        term_weights = {}
+        length = 0.0
+        for field, weight in zip(FIELDS, SEARCH_CONFIG['BM25_WEIGHTS']):
+            for term in tokenize(row.get(field)):
+                term_weights[term] = term_weights.get(term, 0.0) + weight
+                length += weight
+
+        for term, tf in term_weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('I'), array('d'))
+                bisect.insort(self._vocab, term)
+            postings[0].append(docno)
+            postings[1].append(tf)
+
+        price = row.get('price')
+        rating = row.get('rating') or 0.0
+        self._service_ids.append(row['id'])
+        self._docno[row['id']] = docno
+        self._payloads.append(row)
+        self._lengths.append(length)
+        self._prices.append(float(price) if price is not None else math.nan)
+        self._ratings.append(float(rating))
+        self._live |= bit
+        self._live_count += 1
+        self._total_length += length
+
+        category = row.get('category') or ''
+        self._category_bits[category] = self._category_bits.get(category, 0) | bit
+        city = row.get('city') or ''
+        self._city_bits[city] = self._city_bits.get(city, 0) | bit
+        if str(row.get('availability', '')).strip().lower() not in UNAVAILABLE_VALUES:
+            self._available_bits |= bit
+        price_bucket = bucket_index(FACET_CONFIG['PRICE_BUCKETS'], price)
+        if price_bucket is not None:
+            self._price_bits[price_bucket] = self._price_bits.get(price_bucket, 0) | bit
+        rating_bucket = bucket_index(FACET_CONFIG['RATING_BUCKETS'], rating)
+        self._rating_bits[rating_bucket] = self._rating_bits.get(rating_bucket, 0) | bit
+
+    def _remove(self, service_id):
+        docno = self._docno.pop(service_id, None)
+        if docno is None:
+            return
+        self._live &= ~(1 << docno)
+        self._live_count -= 1
+        self._total_length -= self._lengths[docno]
+        self._payloads[docno] = None
+
+    def _compact(self):
+        rows = [row for row in self._payloads if row is not None]
+        self._reset()
+        for row in rows:
+            self._add(row)
+
+    def _fetch(self, conn, service_ids=None):
+        cursor = conn.cursor()
+        if service_ids is None:
+            cursor.execute(self.source_query.format(filter=''))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        rows = []
+        service_ids = list(service_ids)
+        for start in range(0, len(service_ids), 500):
+            chunk = service_ids[start:start + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            cursor.execute(self.source_query.format(filter=f'AND s.id IN ({placeholders})'), chunk)
+            columns = [column[0] for column in cursor.description]
+            rows.extend(dict(zip(columns, row)) for row in cursor.fetchall())
+        return rows
+
+    def load(self):
+        """Full rebuild from the database"""
+        conn = db_pool.connect(self.database)
+        try:
+            # Read the change cursor first so writes racing the load are replayed
+            last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM service_changes').fetchone()[0]
+            rows = self._fetch(conn)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._add(row)
+            self._last_seq = last_seq
+            self._last_sync = time.monotonic()
+            self._stale = False
+        return len(rows)
+
+    def mark_stale(self):
+        """Force a sync on the next search (call after in-process writes)"""
+        self._stale = True
+
+    def sync(self, force=False):
+        """Apply service_changes recorded since the last sync; returns #services refreshed"""
+        now = time.monotonic()
+        if not (force or self._stale) and now - self._last_sync < ENGINE_CONFIG['SYNC_INTERVAL_SECONDS']:
+            return 0
+
+        with self._lock:
+            self._last_sync = now
+            self._stale = False
+            conn = db_pool.connect(self.database)
+            try:
+                changes = conn.execute('''
+                    SELECT seq, service_id FROM service_changes WHERE seq > ? ORDER BY seq
+                ''', (self._last_seq,)).fetchall()
+                if not changes:
+                    return 0
+                changed_ids = sorted({service_id for _, service_id in changes})
+                rows = self._fetch(conn, changed_ids)
+            finally:
+                conn.close()
+
+            for service_id in changed_ids:
+                self._remove(service_id)
+            for row in rows:
+                self._add(row)
+            self._last_seq = changes[-1][0]
+
+            dead = len(self._service_ids) - self._live_count
+            if dead and dead > ENGINE_CONFIG['COMPACT_RATIO'] * len(self._service_ids):
+                self._compact()
+            return len(changed_ids)
+
+    @property
+    def version(self):
+        """Highest service_changes sequence applied to this index"""
+        return self._last_seq
+
+    # -- querying ---------------------------------------------------------
+
+    def _expand(self, term):
+        start = bisect.bisect_left(self._vocab, term)
+        expanded = []
+        for candidate in self._vocab[start:start + ENGINE_CONFIG['MAX_PREFIX_EXPANSIONS']]:
+            if not candidate.startswith(term):
+                break
+            expanded.append(candidate)
+        return expanded
+
+    def _range_bits(self, bucket_bits, bounds, values, low, high, candidates):
+        """Bitset of candidates whose value is within [low, high]
+
+        Buckets fully inside the range are OR-ed; edge buckets are refined per doc."""
+        low = -math.inf if low is None else low
+        high = math.inf if high is None else high
+        result = 0
+        for index, bits in bucket_bits.items():
+            bucket_low = bounds[index]
+            bucket_high = bounds[index + 1] if index + 1 < len(bounds) else math.inf
+            if bucket_low >= low and bucket_high <= high:
+                result |= bits
+            elif bucket_high >= low and bucket_low <= high:
+                for docno in iter_bits(bits & candidates):
+                    if low <= values[docno] <= high:
+                        result |= 1 << docno
+        return result
+
+    def filter_bits(self, category=None, city=None, min_price=None, max_price=None,
+                    min_rating=None, available_only=False):
+        """Intersect the live set with every requested filter"""
+        bits = self._live
+        if category:
+            bits &= self._category_bits.get(category, 0)
+        if city:
+            # Case-insensitive substring, like location LIKE '%city%'
+            needle = city.lower()
+            city_bits = 0
+            for value, value_bits in self._city_bits.items():
+                if needle in value.lower():
+                    city_bits |= value_bits
+            bits &= city_bits
+        if available_only:
+            bits &= self._available_bits
+        if bits and (min_price is not None or max_price is not None):
+            bits &= self._range_bits(self._price_bits, FACET_CONFIG['PRICE_BUCKETS'],
+                                     self._prices, min_price, max_price, bits)
+        if bits and min_rating is not None:
+            bits &= self._range_bits(self._rating_bits, FACET_CONFIG['RATING_BUCKETS'],
+                                     self._ratings, min_rating, None, bits)
+        return bits
+
+    def _text_scores(self, text, candidates):
+        """BM25 over weighted fields; every query term (as a prefix) must match"""
+        terms = tokenize(text)[:SEARCH_CONFIG['MAX_TERMS']]
+        if not terms:
+            return None
+
+        k1, b = ENGINE_CONFIG['BM25_K1'], ENGINE_CONFIG['BM25_B']
+        total_docs = max(self._live_count, 1)
+        avg_length = (self._total_length / total_docs) or 1.0
+        # Byte mask built once per query: a big-int shift per posting would cost O(documents)
+        mask = candidates.to_bytes((candidates.bit_length() + 7) // 8, 'little')
+        mask_size = len(mask)
+
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for expanded in self._expand(term):
+                docs, tfs = self._postings[expanded]
+                idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for docno, tf in zip(docs, tfs):
+                    byte = docno >> 3
+                    if byte >= mask_size or not (mask[byte] >> (docno & 7)) & 1:
+                        continue
+                    if scores is not None and docno not in scores:
+                        continue
+                    norm = tf * (k1 + 1) / (tf + k1 * (1 - b + b * self._lengths[docno] / avg_length))
+                    term_scores[docno] = term_scores.get(docno, 0.0) + idf * norm
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {docno: scores[docno] + s for docno, s in term_scores.items()}
+            if not scores:
+                break
+        return scores
+
+    def _ranked(self, text, filters):
+        """(score, docno) pairs best first, plus the filter bitset they were drawn from"""
+        candidates = self.filter_bits(**filters)
+        text_scores = self._text_scores(text, candidates) if text else None
+
+        rating_weight = SEARCH_CONFIG['RATING_WEIGHT']
+        if text_scores is None:
+            ranked = [(rating_weight * self._ratings[d], d) for d in iter_bits(candidates)]
+        else:
+            ranked = [(s + rating_weight * self._ratings[d], d) for d, s in text_scores.items()]
+
+        # Higher service ids win ties, matching the SQL path's ORDER BY score, s.id DESC
+        # (docnos are reassigned on edits and compaction, so they are not a stable tie-break)
+        service_ids = self._service_ids
+        ranked.sort(key=lambda item: (item[0], service_ids[item[1]]), reverse=True)
+        return ranked, candidates, text_scores is not None
+
+    def search(self, text=None, limit=50, **filters):
+        """Return matching service rows, best first"""
+        self.sync()
+        with self._lock:
+            ranked, _, _ = self._ranked(text, filters)
+            if limit is not None:
+                ranked = ranked[:limit]
+            return [self._payloads[docno] for _, docno in ranked]
+
+    def search_with_facets(self, text=None, limit=50, **filters):
+        """Like search(), plus facet histograms over the full match set"""
+        self.sync()
+        with self._lock:
+            ranked, candidates, has_text = self._ranked(text, filters)
+            if has_text:
+                # Text matches are a subset of the bitmaps; count them in one pass
+                counter = FacetCounter()
+                for _, docno in ranked:
+                    counter.add(self._payloads[docno])
+                facets = counter.result()
+            else:
+                facets = self.facets(candidates)
+            if limit is not None:
+                ranked = ranked[:limit]
+            return [self._payloads[docno] for _, docno in ranked], facets
+
+    def search_page(self, text=None, limit=50, cursor=None, with_facets=False, **filters):
+        """One page of search() keyed by (score, service id); returns (rows, next_cursor, facets)
+
+        Docnos are reassigned on compaction, so cursors carry the service id instead."""
+        self.sync()
+        with self._lock:
+            ranked, candidates, has_text = self._ranked(text, filters)
+            keyed = ((score, self._service_ids[docno], docno) for score, docno in ranked)
+            if cursor is not None:
+                after = tuple(cursor)
+                keyed = (key for key in keyed if key[:2] < after)
+            page, next_cursor = paginate(heapq.nlargest(limit + 1, keyed), limit, lambda key: key[:2])
+            rows = [self._payloads[docno] for _, _, docno in page]
+
+            facets = None
+            if with_facets:
+                if has_text:
+                    counter = FacetCounter()
+                    for _, docno in ranked:
+                        counter.add(self._payloads[docno])
+                    facets = counter.result()
+                else:
+                    facets = self.facets(candidates)
+            return rows, next_cursor, facets
+
+    def facets(self, bits):
+        """Facet counts for a document bitset from the precomputed bitmaps"""
+        counts = {'category': {}, 'city': {}, 'price': {}, 'rating': {}}
+        for name, value_bits in (('category', self._category_bits), ('city', self._city_bits)):
+            for key, key_bits in value_bits.items():
+                if key:
+                    counts[name][key] = (bits & key_bits).bit_count()
+        for index, bucket_bits in self._price_bits.items():
+            counts['price'][index] = (bits & bucket_bits).bit_count()
+        for index, bucket_bits in self._rating_bits.items():
+            counts['rating'][index] = (bits & bucket_bits).bit_count()
+        return format_facets(counts)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': self._live_count,
+                'dead_documents': len(self._service_ids) - self._live_count,
+                'terms': len(self._postings),
+                'version': self._last_seq
+            }
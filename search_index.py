@@ -0,0 +1,28 @@
+# search_index.py - Helpers for the services_fts full-text index (SQLite FTS5)
+import re
+
+# Search Configuration
+SEARCH_CONFIG = {
+    # bm25 column weights: title, description, category, tags, business_name
+    'BM25_WEIGHTS': (10.0, 2.0, 4.0, 3.0, 5.0),
+    'RATING_WEIGHT': 0.5,     # Rank boost per rating star
+    'MAX_TERMS': 8            # Ignore anything past this many search words
+}
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def build_match_query(search_text):
+    """Turn free text into a safe FTS5 MATCH expression (all terms, prefix match)
+
+    Returns None when the text has no searchable words."""
+    terms = TOKEN_PATTERN.findall((search_text or '').lower())[:SEARCH_CONFIG['MAX_TERMS']]
+    if not terms:
+        return None
+    # Quoting every term keeps FTS5 operators (AND, NEAR, column filters) out of user input
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def rank_expression(rating_column):
+    """SQL expression ordering matches best-first (ascending) by bm25 blended with rating"""
+    weights = ', '.join(str(w) for w in SEARCH_CONFIG['BM25_WEIGHTS'])
+    return (f"(bm25(services_fts, {weights}) - "
+            f"{SEARCH_CONFIG['RATING_WEIGHT']} * COALESCE({rating_column}, 0))")
@@ -1,29 +1,44 @@
-from sqlalchemy import and_, or_, func
+from sqlalchemy import and_, or_, func, text, Integer
 from datetime import datetime
 
+import geo
+from search_index import build_match_query
+from facets import FacetCounter
+from search_cache import normalize_query
+
 class SearchService:
-    def __init__(self, db):
+    def __init__(self, db, backend=None, cache=None):
         self.db = db
+        # Optional search_engine.ServiceIndex that answers text and filters in memory
+        self.backend = backend
+        # Optional search_cache.SearchCache holding matched ids per normalized query
+        self.cache = cache
     
     def advanced_search(self, query_params):
+        if self.cache is None:
+            return self._matching_query(query_params)
+        
+        cache_key = normalize_query('search_service', query_params)
+        service_ids = self.cache.get(cache_key)
+        if service_ids is None:
+            query = self._matching_query(query_params)
+            service_ids = [service_id for (service_id,) in query.with_entities(Service.id)]
+            self.cache.put(cache_key, service_ids)
+        return Service.query.filter(Service.id.in_(service_ids))
+    
+    def _matching_query(self, query_params):
+        if self.backend is not None:
+            return self._indexed_search(query_params)
+        
         query = Service.query
         
-        # Text search across multiple fields
-        search_text = query_params.get('search', '').strip()
-        if search_text:
-            search_terms = search_text.split()
-            search_conditions = []
-            
-            for term in search_terms:
-                term_condition = or_(
-                    Service.title.ilike(f'%{term}%'),
-                    Service.description.ilike(f'%{term}%'),
-                    Service.tags.ilike(f'%{term}%')
-                )
-                search_conditions.append(term_condition)
-            
-            if search_conditions:
-                query = query.filter(and_(*search_conditions))
+        # Text search across multiple fields via the services_fts index
+        match_query = build_match_query(query_params.get('search', ''))
+        if match_query:
+            matched_ids = text(
+                'SELECT rowid FROM services_fts WHERE services_fts MATCH :match'
+            ).bindparams(match=match_query).columns(rowid=Integer)
+            query = query.filter(Service.id.in_(matched_ids))
         
         # Apply all filters
         if query_params.get('category') and query_params.get('category') != 'all':
@@ -50,7 +65,59 @@ class SearchService:
         if query_params.get('verified_only') == 'true':
             query = query.join(ServiceProvider).filter(ServiceProvider.is_verified == True)
         
-        return query
+        return self._apply_radius(query, query_params)
+    
+    def nearby_providers(self, query_params):
+        """[(distance_km, provider_id)] whose service_radius covers lat/lng, nearest first
+
+        Honors radius_km (customer's max distance) and nearest (N closest); None without a point."""
+        area = geo.search_area(query_params)
+        if area is None:
+            return None
+        lat, lng, radius_km, nearest = area
+        rows = self.db.session.execute(text(geo.COVERAGE_QUERY), {'lat': lat, 'lng': lng}).fetchall()
+        return geo.rank_covering(rows, lat, lng, radius_km, nearest)
+    
+    def _apply_radius(self, query, query_params):
+        nearby = self.nearby_providers(query_params)
+        if nearby is None:
+            return query
+        return query.filter(Service.provider_id.in_([provider_id for _, provider_id in nearby]))
+    
+    def _indexed_search(self, query_params):
+        def param(name):
+            value = query_params.get(name)
+            return None if value in (None, '', 'all') else value
+        
+        rows = self.backend.search(
+            query_params.get('search', ''),
+            limit=None,
+            category=param('category'),
+            city=param('city'),
+            min_price=float(param('min_price')) if param('min_price') else None,
+            max_price=float(param('max_price')) if param('max_price') else None,
+            min_rating=float(param('min_rating')) if param('min_rating') else None,
+            available_only=query_params.get('availability') == 'available'
+        )
+        query = Service.query.filter(Service.id.in_([row['id'] for row in rows]))
+        
+        # Filters the index does not carry still go to SQL
+        if param('service_type'):
+            query = query.filter(Service.service_type == query_params.get('service_type'))
+        
+        if query_params.get('verified_only') == 'true':
+            query = query.join(ServiceProvider).filter(ServiceProvider.is_verified == True)
+        
+        return self._apply_radius(query, query_params)
+    
+    def search_with_facets(self, query_params, sort_by='relevance'):
+        """Sorted result query plus category/city/price/rating counts over all matches"""
+        query = self.apply_sorting(self.advanced_search(query_params), sort_by)
+        
+        counter = FacetCounter(category_field='category_id', price_field='price_min')
+        for service in query:
+            counter.add(service)
+        return query, counter.result()
     
     def apply_sorting(self, query, sort_by='relevance'):
         if sort_by == 'price_low':
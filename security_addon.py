@@ -9,6 +9,12 @@ import json
 import secrets
 from datetime import datetime, timedelta
 import hashlib
+from sqlalchemy import text
+import audit_log
+import maintenance
+import migrate
+import rate_limit
+import session_store
 
 # Security Models (Add to existing models.py)
 class SecurityLog(db.Model):
@@ -36,29 +42,64 @@ class SessionToken(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
 # Security Helper Functions
+def _write_security_logs(events):
+    # Runs on the audit flusher thread, outside any request
+    for event in events:
+        if isinstance(event.get('created_at'), str):
+            # Replayed from the spill file
+            event['created_at'] = datetime.fromisoformat(event['created_at'])
+    with app.app_context():
+        try:
+            db.session.bulk_insert_mappings(SecurityLog, events)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+security_audit = audit_log.AuditLog('security_log', _write_security_logs)
+
 def log_security_event(user_id, action, success=True):
-    log = SecurityLog(
+    # Request data and the timestamp are captured now; the INSERT happens in a later batch
+    security_audit.log(
         user_id=user_id,
         action=action,
         ip_address=request.remote_addr,
         user_agent=request.headers.get('User-Agent'),
-        success=success
+        success=success,
+        created_at=datetime.utcnow()
     )
-    db.session.add(log)
-    db.session.commit()
 
 def check_login_attempts(email, max_attempts=5, window_minutes=15):
-    since = datetime.utcnow() - timedelta(minutes=window_minutes)
-    attempts = LoginAttempt.query.filter(
-        LoginAttempt.email == email,
-        LoginAttempt.success == False,
-        LoginAttempt.attempt_time > since
-    ).count()
-    return attempts < max_attempts
+    # Failed logins only, counted by record_login_failure() in a sliding window
+    # (rate_limit.py) instead of a COUNT(*) per login; checking counts nothing
+    allowed, _ = rate_limit.get_limiter().peek(f'login_failures:{email.strip().lower()}',
+                                               max_attempts, window_minutes * 60)
+    return allowed
+
+def record_login_failure(email, max_attempts=5, window_minutes=15):
+    rate_limit.get_limiter().hit(f'login_failures:{email.strip().lower()}',
+                                 max_attempts, window_minutes * 60)
+
+def record_login_attempt(email, success):
+    # Call from the login view after each password check: the row feeds the
+    # hourly rollups and a failure counts toward check_login_attempts()
+    db.session.add(LoginAttempt(email=email, ip_address=request.remote_addr, success=success))
+    db.session.commit()
+    if not success:
+        record_login_failure(email)
 
 def generate_secure_token():
     return secrets.token_urlsafe(32)
 
+LOGIN_FAILURES_QUERY = maintenance.RECENT_FAILURES_QUERY.format(
+    table=LoginAttempt.__tablename__, account_column='email')
+
+def start_maintenance():
+    """Rollup/retention tables and the hourly maintenance thread; call after db.create_all()"""
+    database = db.engine.url.database
+    migrate.run_migrations(database, 'security_addon')
+    maintenance.start_task(database, maintenance.jobs(login_table=LoginAttempt.__tablename__))
+
 # Security Routes (Add these to your main app.py)
 @app.route('/security-dashboard')
 @login_required
@@ -140,6 +181,9 @@ def revoke_device(token_id):
     if token:
         token.is_active = False
         db.session.commit()
+        if isinstance(app.session_interface, session_store.ServerSessionInterface):
+            # Device tokens are the session tokens: end that session now, not at expiry
+            app.session_interface.store.delete(token.token)
         log_security_event(current_user.id, 'Device Revoked')
         flash('Device access revoked successfully.')
     
@@ -148,20 +192,20 @@ def revoke_device(token_id):
 @app.route('/security-alerts')
 @login_required
 def security_alerts():
-    # Check for suspicious activities
-    recent_logins = LoginAttempt.query.filter_by(
-        email=current_user.email
-    ).order_by(LoginAttempt.attempt_time.desc()).limit(5).all()
+    # Check for suspicious activities (hourly rollups, not the raw attempt table)
+    failed_count, last_failure = db.session.execute(
+        text(LOGIN_FAILURES_QUERY),
+        maintenance.recent_failures_params(current_user.email, table=LoginAttempt.__tablename__)
+    ).fetchone()
     
     alerts = []
     
     # Check for failed login attempts
-    failed_attempts = [login for login in recent_logins if not login.success]
-    if len(failed_attempts) > 2:
+    if failed_count > 2:
         alerts.append({
             'type': 'warning',
-            'message': f'{len(failed_attempts)} failed login attempts detected',
-            'time': failed_attempts[0].attempt_time
+            'message': f'{failed_count} failed login attempts in the last 24 hours',
+            'time': last_failure
         })
     
     return render_template('security/alerts.html', alerts=alerts)
@@ -0,0 +1,284 @@
+# session_store.py - Server-side Flask sessions: in-memory LRU in front of an SQLite table
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import request
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import db_pool
+import db_storage
+
+# Session Store Configuration
+SESSION_CONFIG = {
+    'LIFETIME_SECONDS': 24 * 3600,
+    'CACHE_ENTRIES': 10000,
+    # Data saved by other processes shows up within this many seconds; revocations
+    # apply at once everywhere through the revocation log
+    'CACHE_TTL_SECONDS': 5,
+    'REVOCATION_LOG_SECONDS': 3600,     # Revocation rows older than this are swept
+    'SWEEP_EVERY_WRITES': 100,          # Each Nth session write also deletes a batch of expired rows
+    'SWEEP_BATCH_ROWS': 500
+}
+
+def token_key(token):
+    """Rows are keyed by a digest so a database leak does not hand out live sessions"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, token=None):
+        def on_update(_):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.token = token
+        self.previous_token = None
+        self.modified = False
+
+    def regenerate(self):
+        """New token for the same data (call on login so a planted token is useless)"""
+        if self.token is not None:
+            self.previous_token = self.token
+        self.token = None
+        self.modified = True
+
+class SessionStore:
+    """Session rows in user_sessions, with an LRU of decoded sessions and a user_id index
+
+    Every delete also appends to the revocation log; load() reads its sqlite_sequence
+    watermark and drops sessions revoked by other processes before using the cache."""
+
+    def __init__(self, database, table='user_sessions', revocations_table='user_session_revocations'):
+        self.database = database
+        self.table = table
+        self.revocations_table = revocations_table
+        self.serializer = TaggedJSONSerializer()
+        self._cache = OrderedDict()       # key -> (cached_at, expires_at, user_id, data)
+        self._by_user = {}                # user_id -> {key} of cached sessions
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._revocation_seq = None       # Last revocation log id applied to the cache
+
+    def _cache_put(self, key, expires_at, user_id, data, revocation_seq=None):
+        with self._lock:
+            if revocation_seq is not None and revocation_seq != self._revocation_seq:
+                # Read before a revocation that was applied since; it may have been this row
+                return
+            self._cache_drop(key)
+            self._cache[key] = (time.monotonic(), expires_at, user_id, data)
+            if user_id is not None:
+                self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._cache) > SESSION_CONFIG['CACHE_ENTRIES']:
+                self._cache_drop(next(iter(self._cache)))
+
+    def _cache_drop(self, key):
+        entry = self._cache.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            keys = self._by_user.get(entry[2])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[2]]
+
+    def _sync_revocations(self):
+        """Drop cached sessions revoked since the last call; one sqlite_sequence read when none were"""
+        conn = db_pool.connect(self.database)
+        try:
+            row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?',
+                               (self.revocations_table,)).fetchone()
+            seq = row[0] if row else 0
+            with self._lock:
+                since = self._revocation_seq
+            if seq == since:
+                return
+            rows = [] if since is None else conn.execute(f'''
+                SELECT id, session_token FROM {self.revocations_table} WHERE id > ? AND id <= ? ORDER BY id
+            ''', (since, seq)).fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            if self._revocation_seq != since:
+                return                    # Another thread applied it
+            if since is None or len(rows) != seq - since:
+                # First call, or rows swept before this process saw them
+                self._cache.clear()
+                self._by_user.clear()
+            else:
+                for _, key in rows:
+                    self._cache_drop(key)
+            self._revocation_seq = seq
+
+    def load(self, token):
+        """Session data for a token, or None when unknown, expired or revoked"""
+        key = token_key(token)
+        now = datetime.now()
+        self._sync_revocations()
+        with self._lock:
+            seq = self._revocation_seq
+            entry = self._cache.get(key)
+            if entry is not None:
+                cached_at, expires_at, _, data = entry
+                if expires_at <= now:
+                    self._cache_drop(key)
+                    return None
+                if time.monotonic() - cached_at < SESSION_CONFIG['CACHE_TTL_SECONDS']:
+                    self._cache.move_to_end(key)
+                    return dict(data)
+
+        # Unique index on session_token: one B-tree probe, never a scan
+        conn = db_pool.connect(self.database)
+        row = conn.execute(f'''
+            SELECT user_id, expires_at, data FROM {self.table}
+            WHERE session_token = ? AND active = 1 AND expires_at > ?
+        ''', (key, now)).fetchone()
+        conn.close()
+        if row is None:
+            with self._lock:
+                self._cache_drop(key)
+            return None
+        user_id, expires_at, data = row
+        data = self.serializer.loads(data) if data else {}
+        self._cache_put(key, datetime.fromisoformat(str(expires_at)), user_id, data, revocation_seq=seq)
+        return dict(data)
+
+    @db_storage.retry_on_busy
+    def save(self, token, data, ip_address=None, user_agent=None):
+        key = token_key(token)
+        user_id = data.get('user_id')
+        expires_at = datetime.now() + timedelta(seconds=SESSION_CONFIG['LIFETIME_SECONDS'])
+        conn = db_pool.connect(self.database)
+        conn.execute(f'''
+            INSERT INTO {self.table} (user_id, session_token, expires_at, ip_address, user_agent, active, data)
+            VALUES (?, ?, ?, ?, ?, 1, ?)
+            ON CONFLICT(session_token) DO UPDATE SET
+                user_id = excluded.user_id, expires_at = excluded.expires_at, data = excluded.data
+        ''', (user_id, key, expires_at, ip_address, user_agent, self.serializer.dumps(dict(data))))
+        conn.commit()
+        conn.close()
+        self._cache_put(key, expires_at, user_id, dict(data))
+        self._maybe_sweep()
+
+    @db_storage.retry_on_busy
+    def delete(self, token):
+        """Log one session out"""
+        key = token_key(token)
+        with self._lock:
+            self._cache_drop(key)
+        conn = db_pool.connect(self.database)
+        cursor = conn.execute(f'DELETE FROM {self.table} WHERE session_token = ?', (key,))
+        if cursor.rowcount:
+            self._log_revocations(conn, [key])
+        conn.commit()
+        conn.close()
+
+    def _log_revocations(self, conn, keys):
+        conn.executemany(f'INSERT INTO {self.revocations_table} (session_token, revoked_at) VALUES (?, ?)',
+                         [(key, datetime.now()) for key in keys])
+
+    def list_user(self, user_id):
+        """Live sessions for a user (idx_user_sessions_user), newest first"""
+        conn = db_pool.connect(self.database)
+        rows = conn.execute(f'''
+            SELECT id, created_at, expires_at, ip_address, user_agent FROM {self.table}
+            WHERE user_id = ? AND active = 1 AND expires_at > ?
+            ORDER BY id DESC
+        ''', (user_id, datetime.now())).fetchall()
+        conn.close()
+        columns = ('id', 'created_at', 'expires_at', 'ip_address', 'user_agent')
+        return [dict(zip(columns, row)) for row in rows]
+
+    @db_storage.retry_on_busy
+    def revoke(self, user_id, session_id=None, keep_token=None):
+        """End one of a user's sessions (by row id) or all of them except keep_token"""
+        conn = db_pool.connect(self.database)
+        query = f'SELECT id, session_token FROM {self.table} WHERE user_id = ? AND active = 1'
+        params = [user_id]
+        if session_id is not None:
+            query += ' AND id = ?'
+            params.append(session_id)
+        keep = token_key(keep_token) if keep_token else None
+        rows = [row for row in conn.execute(query, params).fetchall() if row[1] != keep]
+        conn.executemany(f'DELETE FROM {self.table} WHERE id = ?', [(row[0],) for row in rows])
+        self._log_revocations(conn, [row[1] for row in rows])
+        conn.commit()
+        conn.close()
+        with self._lock:
+            keys = {key for _, key in rows}
+            if session_id is None:
+                keys |= self._by_user.get(user_id, set()) - {keep}
+            for key in keys:
+                self._cache_drop(key)
+        return len(rows)
+
+    def _maybe_sweep(self):
+        with self._lock:
+            self._writes += 1
+            if self._writes % SESSION_CONFIG['SWEEP_EVERY_WRITES']:
+                return
+        self.sweep()
+
+    @db_storage.retry_on_busy
+    def sweep(self):
+        """Delete one batch of expired sessions (idx_user_sessions_expires)"""
+        conn = db_pool.connect(self.database)
+        cursor = conn.execute(f'''
+            DELETE FROM {self.table} WHERE id IN (
+                SELECT id FROM {self.table} WHERE expires_at <= ? LIMIT ?
+            )
+        ''', (datetime.now(), SESSION_CONFIG['SWEEP_BATCH_ROWS']))
+        conn.execute(f'DELETE FROM {self.revocations_table} WHERE revoked_at < ?',
+                     (datetime.now() - timedelta(seconds=SESSION_CONFIG['REVOCATION_LOG_SECONDS']),))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._cache), 'cached_users': len(self._by_user)}
+
+class ServerSessionInterface(SessionInterface):
+    """The cookie carries only a random token; everything else stays on the server"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            data = self.store.load(token)
+            if data is not None:
+                return ServerSession(data, token=token)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_token:
+            self.store.delete(session.previous_token)
+        if not session:
+            if session.modified and (session.token or session.previous_token):
+                if session.token:
+                    self.store.delete(session.token)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        new_token = session.token is None
+        if new_token:
+            session.token = secrets.token_urlsafe(32)
+        self.store.save(session.token, session, request.environ.get('HTTP_X_REAL_IP', request.remote_addr),
+                        request.headers.get('User-Agent', ''))
+        if new_token or session.permanent:
+            response.set_cookie(name, session.token,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
@@ -0,0 +1,165 @@
+# socket_bus.py - Cross-process Socket.IO fan-out over Redis-protocol pub/sub (local_broker.py for tests)
+import os
+import queue
+import threading
+import time
+import zlib
+
+from socketio import PubSubManager
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Message Bus Configuration
+BUS_CONFIG = {
+    # Comma-separated redis:// URLs; channel shards are spread across them. Empty: rooms stay in-process
+    'URLS': os.environ.get('SOCKETIO_BUS_URLS', ''),
+    'CHANNEL': 'socketio',
+    'SHARDS': 16,                       # Room emits go to <channel>#<crc32(room) % SHARDS>
+    'BATCH_MAX_MESSAGES': 100,          # Publish as soon as a channel has this many waiting
+    'BATCH_DELAY_SECONDS': 0.002,       # ...or after this long; local clients are never delayed
+    'RETRY_MAX_SECONDS': 30
+}
+
+def shard_for(room, shards=None):
+    return zlib.crc32(str(room).encode()) % (shards or BUS_CONFIG['SHARDS'])
+
+class ShardedPubSubManager(PubSubManager):
+    """python-socketio client manager publishing in batches on room-sharded channels
+
+    Each room always maps to the same shard channel, so per-room order is kept
+    while the fan-out load spreads over shards (and brokers, when several URLs
+    are given). Broadcasts, callbacks, disconnects and remote room changes use
+    the control channel. Every listening process subscribes to all channels."""
+    name = 'sharded-pubsub'
+
+    def __init__(self, urls, channel=None, shards=None, write_only=False, logger=None, json=None):
+        if redis is None:
+            raise RuntimeError('The redis package is required for SOCKETIO_BUS_URLS')
+        super().__init__(channel=channel or BUS_CONFIG['CHANNEL'], write_only=write_only, logger=logger,
+                         json=json)
+        self.shards = shards or BUS_CONFIG['SHARDS']
+        self.brokers = [redis.Redis.from_url(url) for url in urls]
+        self._outgoing = {}             # channel -> [message]
+        self._outgoing_count = 0
+        self._outgoing_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._flush_wake = threading.Event()
+        self._flusher = None
+        self._incoming = queue.Queue()
+        self._counters = {'published': 0, 'batches': 0, 'received': 0, 'errors': 0, 'dropped': 0}
+
+    def channel_for(self, message):
+        room = message.get('room')
+        if message['method'] != 'emit' or room is None or isinstance(room, (list, tuple)):
+            return self.channel
+        return f'{self.channel}#{shard_for(room, self.shards)}'
+
+    def broker_for(self, channel):
+        if channel == self.channel:
+            return self.brokers[0]
+        return self.brokers[int(channel.rsplit('#', 1)[1]) % len(self.brokers)]
+
+    def _publish(self, data):
+        channel = self.channel_for(data)
+        with self._outgoing_lock:
+            pending = self._outgoing.setdefault(channel, [])
+            pending.append(data)
+            self._outgoing_count += 1
+            full = len(pending) >= BUS_CONFIG['BATCH_MAX_MESSAGES']
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='socket-bus-flush', daemon=True)
+                self._flusher.start()
+        if full:
+            self.flush()
+        else:
+            self._flush_wake.set()
+
+    def flush(self):
+        """Publish everything waiting: one PUBLISH per channel, pipelined per broker"""
+        with self._publish_lock:
+            with self._outgoing_lock:
+                outgoing, self._outgoing = self._outgoing, {}
+                self._outgoing_count = 0
+            if not outgoing:
+                return
+            by_broker = {}              # id(broker) -> (broker, [(channel, messages)])
+            for channel, messages in outgoing.items():
+                broker = self.broker_for(channel)
+                by_broker.setdefault(id(broker), (broker, []))[1].append((channel, messages))
+            for broker, batches in by_broker.values():
+                count = sum(len(messages) for _, messages in batches)
+                for _ in range(2):
+                    # execute() resets the pipeline even when it fails: rebuild it for the retry
+                    pipeline = broker.pipeline(transaction=False)
+                    for channel, messages in batches:
+                        pipeline.publish(channel, self.json.dumps(messages))
+                    try:
+                        pipeline.execute()
+                    except Exception as e:
+                        self._counters['errors'] += 1
+                        self._get_logger().error(f'Cannot publish to the socket bus: {e}')
+                        continue
+                    self._counters['published'] += count
+                    self._counters['batches'] += 1
+                    break
+                else:
+                    self._counters['dropped'] += count
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wake.wait()
+            self._flush_wake.clear()
+            time.sleep(BUS_CONFIG['BATCH_DELAY_SECONDS'])
+            self.flush()
+
+    def _channels_of(self, broker_index):
+        channels = [f'{self.channel}#{shard}' for shard in range(self.shards)
+                    if shard % len(self.brokers) == broker_index]
+        return channels + [self.channel] if broker_index == 0 else channels
+
+    def _receive(self, broker_index):
+        """Subscribe to this broker's channels and hand batches to _listen(); reconnects with backoff"""
+        broker = self.brokers[broker_index]
+        retry = 1
+        while True:
+            try:
+                pubsub = broker.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(*self._channels_of(broker_index))
+                retry = 1
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._incoming.put(message['data'])
+            except Exception as e:
+                self._counters['errors'] += 1
+                self._get_logger().error(f'Cannot receive from the socket bus, retrying in {retry}s: {e}')
+                time.sleep(retry)
+                retry = min(retry * 2, BUS_CONFIG['RETRY_MAX_SECONDS'])
+
+    def _listen(self):
+        for broker_index in range(len(self.brokers)):
+            threading.Thread(target=self._receive, args=(broker_index,),
+                             name=f'socket-bus-{broker_index}', daemon=True).start()
+        while True:
+            data = self._incoming.get()
+            try:
+                messages = self.json.loads(data)
+            except ValueError:
+                continue
+            for message in messages if isinstance(messages, list) else [messages]:
+                self._counters['received'] += 1
+                yield message
+
+    def stats(self):
+        with self._outgoing_lock:
+            return dict(self._counters, waiting=self._outgoing_count, brokers=len(self.brokers),
+                        shards=self.shards)
+
+def client_manager(urls=None, write_only=False):
+    """For SocketIO(client_manager=...): None (single process) unless bus URLs are configured"""
+    urls = [url.strip() for url in (urls if urls is not None else BUS_CONFIG['URLS']).split(',') if url.strip()]
+    if not urls:
+        return None
+    return ShardedPubSubManager(urls, write_only=write_only)
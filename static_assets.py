@@ -0,0 +1,168 @@
+# static_assets.py - Startup asset build: fingerprinted copies, gzip/brotli variants, immutable caching
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import abort, request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None                       # gzip variants only
+
+# Asset Configuration
+ASSET_CONFIG = {
+    'SOURCE_DIR': '.',
+    'BUILD_DIR': os.path.join('data', 'assets'),
+    'URL_PREFIX': '/assets/',
+    # Only these are ever served; Python sources, databases, env files etc. are not
+    'EXTENSIONS': ('.html', '.css', '.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+                   '.woff', '.woff2'),
+    # .js by name only: the rest of the tree's .js files are the Node server (routes, models, auth)
+    'SCRIPTS': ('AI-Engine.js', 'auth.js', 'config.js', 'customer-portal.js', 'provider-portal.js'),
+    'EXCLUDED_DIRS': ('data', 'migrations', 'templates', 'env', 'node_modules', '__pycache__'),
+    'COMPRESSIBLE': ('.html', '.css', '.js', '.svg'),
+    'MIN_COMPRESS_BYTES': 1024,
+    'GZIP_LEVEL': 9,
+    'BROTLI_QUALITY': 11,
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 3600,   # Fingerprinted URLs change whenever the content does
+    'PAGE_MAX_AGE': 0                       # Pages under their own names revalidate (ETag -> 304)
+}
+
+# href="style.css" / src='img/logo.png' (relative, no query or fragment)
+REFERENCE_PATTERN = re.compile(r'''(\b(?:href|src)=)(["'])([^"'#?:{}$]+)\2''')
+
+class Asset:
+    __slots__ = ('path', 'url', 'mimetype', 'etag', 'variants')
+
+    def __init__(self, path, url, mimetype, etag, variants):
+        self.path = path                # Built file (identity encoding)
+        self.url = url                  # Fingerprinted URL
+        self.mimetype = mimetype
+        self.etag = etag
+        self.variants = variants        # {'br': path, 'gzip': path}
+
+def _write_once(path, data):
+    """Content-addressed files: skip when present, else write atomically (workers build concurrently)"""
+    if os.path.exists(path):
+        return
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class AssetPipeline:
+    def __init__(self, source_dir=None, build_dir=None):
+        self.source_dir = os.path.abspath(source_dir or ASSET_CONFIG['SOURCE_DIR'])
+        self.build_dir = os.path.abspath(build_dir or ASSET_CONFIG['BUILD_DIR'])
+        self._by_name = {}              # logical path -> Asset
+        self._by_url_name = {}          # fingerprinted name -> Asset
+
+    def _visible(self, name):
+        """No dotfiles, no parent references, nothing under an excluded directory"""
+        parts = name.split('/')
+        return not any(part.startswith('.') or not part for part in parts) \
+            and parts[0] not in ASSET_CONFIG['EXCLUDED_DIRS']
+
+    def _allowed(self, name):
+        return self._visible(name) and (name in ASSET_CONFIG['SCRIPTS'] or
+                                        os.path.splitext(name)[1].lower() in ASSET_CONFIG['EXTENSIONS'])
+
+    def _sources(self):
+        for root, dirs, files in os.walk(self.source_dir):
+            relative_root = os.path.relpath(root, self.source_dir).replace(os.sep, '/')
+            prefix = '' if relative_root == '.' else relative_root + '/'
+            dirs[:] = [d for d in dirs if self._visible(prefix + d)]
+            for filename in files:
+                name = prefix + filename
+                if self._allowed(name):
+                    yield name
+
+    def _rewrite_references(self, name, html):
+        base = posixpath.dirname(name)
+
+        def replace(match):
+            reference = match.group(3)
+            if reference.startswith('/'):
+                target = reference.lstrip('/')
+            else:
+                target = posixpath.normpath(posixpath.join(base, reference))
+            asset = self._by_name.get(target)
+            if asset is None or asset.mimetype == 'text/html':
+                return match.group(0)
+            return f'{match.group(1)}{match.group(2)}{asset.url}{match.group(2)}'
+        return REFERENCE_PATTERN.sub(replace, html)
+
+    def _add(self, name, data):
+        stem, ext = posixpath.splitext(name)
+        digest = hashlib.sha256(data).hexdigest()
+        url_name = f'{stem}.{digest[:12]}{ext}'
+        path = os.path.join(self.build_dir, *url_name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_once(path, data)
+
+        variants = {}
+        if ext.lower() in ASSET_CONFIG['COMPRESSIBLE'] and len(data) >= ASSET_CONFIG['MIN_COMPRESS_BYTES']:
+            if brotli is not None:
+                _write_once(path + '.br', brotli.compress(data, quality=ASSET_CONFIG['BROTLI_QUALITY']))
+                variants['br'] = path + '.br'
+            _write_once(path + '.gz', gzip.compress(data, compresslevel=ASSET_CONFIG['GZIP_LEVEL'], mtime=0))
+            variants['gzip'] = path + '.gz'
+
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        asset = Asset(path, ASSET_CONFIG['URL_PREFIX'] + url_name, mimetype, digest[:32], variants)
+        self._by_name[name] = asset
+        self._by_url_name[url_name] = asset
+
+    def build(self):
+        """Fingerprint and precompress every servable file; pages last so they link to fingerprinted URLs"""
+        names = sorted(self._sources())
+        pages = [name for name in names if name.lower().endswith('.html')]
+        for name in names:
+            if name not in pages:
+                with open(os.path.join(self.source_dir, name), 'rb') as f:
+                    self._add(name, f.read())
+        for name in pages:
+            with open(os.path.join(self.source_dir, name), encoding='utf-8', errors='surrogateescape') as f:
+                html = self._rewrite_references(name, f.read())
+            self._add(name, html.encode('utf-8', errors='surrogateescape'))
+        print(f"Built {len(self._by_name)} static assets ({'gzip + brotli' if brotli else 'gzip'})")
+        return len(self._by_name)
+
+    def _send(self, asset, max_age, immutable=False):
+        encodings = [encoding for encoding in ('br', 'gzip') if encoding in asset.variants]
+        encoding = request.accept_encodings.best_match(encodings + ['identity'], default='identity')
+        path = asset.variants.get(encoding, asset.path)
+        # send_file hands the open file to the server's wsgi.file_wrapper (sendfile)
+        response = send_file(path, mimetype=asset.mimetype, conditional=True, max_age=max_age,
+                             etag=asset.etag + ('' if encoding == 'identity' else f'-{encoding}'))
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        if immutable:
+            response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        return response
+
+    def serve_fingerprinted(self, url_name):
+        asset = self._by_url_name.get(url_name)
+        if asset is None:
+            abort(404)
+        return self._send(asset, ASSET_CONFIG['IMMUTABLE_MAX_AGE'], immutable=True)
+
+    def serve(self, filename):
+        """A file under its own name: built copy when known, else (e.g. new uploads) the allow-listed original"""
+        asset = self._by_name.get(filename)
+        if asset is not None:
+            return self._send(asset, ASSET_CONFIG['PAGE_MAX_AGE'])
+        if not self._allowed(filename):
+            abort(404)
+        return send_from_directory(self.source_dir, filename, max_age=ASSET_CONFIG['PAGE_MAX_AGE'])
+
+    def url(self, name):
+        """Fingerprinted URL for a logical path (falls back to the plain path)"""
+        asset = self._by_name.get(name)
+        return asset.url if asset is not None else '/' + name
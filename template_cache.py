@@ -0,0 +1,31 @@
+# template_cache.py - Compile templates once: on-disk bytecode cache plus pre-rendered static pages
+import os
+
+from flask import Response
+from jinja2 import FileSystemBytecodeCache
+
+# Template Cache Configuration
+TEMPLATE_CONFIG = {
+    'BYTECODE_DIR': os.path.join('data', 'jinja_bytecode'),  # Survives restarts; keyed by template source
+    'AUTO_RELOAD': False                # True re-checks template mtimes on every render (development)
+}
+
+_static_pages = {}
+
+def init_app(app, templates=(), static_pages=()):
+    """Enable the bytecode cache, compile templates now and pre-render the static ones
+
+    templates: names rendered with per-request context (compiled, kept in memory).
+    static_pages: names with no template variables; rendered once, served by static_page()."""
+    os.makedirs(TEMPLATE_CONFIG['BYTECODE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CONFIG['BYTECODE_DIR'])
+    app.jinja_env.auto_reload = TEMPLATE_CONFIG['AUTO_RELOAD']
+    for name in templates:
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        for name in static_pages:
+            _static_pages[name] = app.jinja_env.get_template(name).render().encode('utf-8')
+
+def static_page(name):
+    """Response for a page pre-rendered by init_app()"""
+    return Response(_static_pages[name], mimetype='text/html')
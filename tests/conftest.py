@@ -0,0 +1,13 @@
+# conftest.py - Run tests against the modules in the repository root
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Modules keep their databases and logs relative to the working directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
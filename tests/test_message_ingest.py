@@ -0,0 +1,137 @@
+# test_message_ingest.py - Append log, group commit, crash replay and bad records
+import json
+import multiprocessing
+import os
+import sqlite3
+
+import pytest
+
+from message_ingest import MessageIngest, INGEST_CONFIG
+
+def sqlite_writer(database, fail_on=None):
+    """Idempotent on ingest_id, like messaging.save_messages"""
+    def writer(records):
+        if any(record['message'] == fail_on for record in records):
+            raise ValueError('bad record')
+        conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('CREATE TABLE IF NOT EXISTS messages (ingest_id TEXT UNIQUE, message TEXT)')
+        ids = [conn.execute('INSERT OR IGNORE INTO messages VALUES (?, ?)',
+                            (record['ingest_id'], record['message'])).rowcount for record in records]
+        conn.execute('COMMIT')
+        conn.close()
+        return ids
+    return writer
+
+def stored(database):
+    conn = sqlite3.connect(database)
+    rows = [row[0] for row in conn.execute('SELECT message FROM messages ORDER BY rowid')]
+    conn.close()
+    return rows
+
+@pytest.fixture
+def ingest(workdir):
+    instances = []
+    def make(writer, **kwargs):
+        instance = MessageIngest('test', writer, **kwargs)
+        instances.append(instance)
+        return instance
+    yield make
+    for instance in instances:
+        instance.close()
+
+def test_log_is_opened_by_the_submitting_process(ingest, workdir):
+    instance = ingest(sqlite_writer(str(workdir / 'a.db')))
+    assert instance.log_path is None
+    instance.submit(message='hello')
+    assert instance.log_path.endswith(f'test.{os.getpid()}.log')
+    assert instance.flush()
+    assert stored(str(workdir / 'a.db')) == ['hello']
+
+def _submit_in_child(instance):
+    instance.submit(message=f'from {os.getpid()}')
+    os._exit(0 if instance.flush() else 1)
+
+def test_forked_workers_get_their_own_log(ingest, workdir):
+    # Created at import in a preloading server, then used by each forked worker
+    instance = ingest(sqlite_writer(str(workdir / 'a.db')))
+    context = multiprocessing.get_context('fork')
+    children = [context.Process(target=_submit_in_child, args=(instance,)) for _ in range(3)]
+    for child in children:
+        child.start()
+    instance.submit(message='parent')
+    for child in children:
+        child.join(10)
+        assert child.exitcode == 0
+    assert instance.flush()
+    assert sorted(stored(str(workdir / 'a.db'))) == sorted(
+        ['parent'] + [f'from {child.pid}' for child in children])
+
+def test_bad_record_does_not_block_the_queue(ingest, workdir, monkeypatch):
+    monkeypatch.setitem(INGEST_CONFIG, 'BATCH_SIZE', 8)
+    instance = ingest(sqlite_writer(str(workdir / 'a.db'), fail_on='bad'))
+    for message in ['a', 'b', 'bad', 'c', 'd']:
+        instance.submit(message=message)
+    for _ in range(INGEST_CONFIG['MAX_RECORD_ATTEMPTS']):
+        instance.flush()
+        instance.submit(message='more')
+    instance.flush()
+    messages = stored(str(workdir / 'a.db'))
+    assert messages[:4] == ['a', 'b', 'c', 'd'] and 'bad' not in messages
+    assert instance.stats()['rejected'] == 1 and instance.stats()['queued'] == 0
+    rejected = [json.loads(line) for line in open(instance.rejected_path)]
+    assert [record['message'] for record in rejected] == ['bad']
+
+def test_database_outage_keeps_records_queued(ingest, workdir):
+    def down(records):
+        raise sqlite3.OperationalError('database is locked')
+    instance = ingest(down)
+    for message in ['a', 'b', 'c', 'd']:
+        instance.submit(message=message)
+    for _ in range(10):
+        assert not instance.flush()
+    assert instance.stats()['queued'] == 4 and instance.stats()['rejected'] == 0
+    instance.writer = sqlite_writer(str(workdir / 'a.db'))
+    assert instance.flush()
+    assert stored(str(workdir / 'a.db')) == ['a', 'b', 'c', 'd']
+
+def write_log(path, records, torn=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        if torn:
+            f.write('{"ingest_id": "torn", "mess')
+
+def test_recover_replays_logs_of_dead_processes(ingest, workdir):
+    records = [{'ingest_id': f'id{n}', 'message': f'm{n}'} for n in range(5)]
+    dead_log = os.path.join(INGEST_CONFIG['LOG_DIR'], 'test.999999.log')
+    write_log(dead_log, records, torn=True)
+    instance = ingest(sqlite_writer(str(workdir / 'a.db')))
+    assert instance.recover() == 5
+    assert not os.path.exists(dead_log)
+    assert stored(str(workdir / 'a.db')) == ['m0', 'm1', 'm2', 'm3', 'm4']
+
+def test_recover_skips_logs_of_live_processes(ingest, workdir):
+    owner = ingest(sqlite_writer(str(workdir / 'a.db')))
+    owner.submit(message='queued')
+    other = MessageIngest('test', sqlite_writer(str(workdir / 'a.db')))
+    assert other.recover() == 0
+    assert os.path.exists(owner.log_path)
+
+def test_replay_is_idempotent_on_ingest_id(workdir):
+    import messaging
+    messaging.init_messaging_db()
+    conn = sqlite3.connect('myservicehub.db')
+    conn.execute('INSERT INTO conversations (customer_id, provider_id) VALUES (1, 2)')
+    conn.commit()
+    records = [{'ingest_id': f'id{n}', 'conversation_id': 1, 'sender_id': 1, 'sender_type': 'customer',
+                'sender_name': 'C', 'message': f'm{n}', 'created_at': '2026-01-01 00:00:00'} for n in range(3)]
+    assert all(messaging.save_messages(records))
+    # A crash after the commit but before the log was truncated: the replay changes nothing
+    write_log(os.path.join(INGEST_CONFIG['LOG_DIR'], 'messages.999999.log'), records)
+    assert MessageIngest('messages', messaging.save_messages).recover() == 3
+    assert messaging.save_messages(records) == [None, None, None]
+    assert conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0] == 3
+    assert conn.execute('SELECT customer_unread, provider_unread FROM conversation_summary').fetchone() == (0, 3)
+    conn.close()
@@ -0,0 +1,57 @@
+# test_security_addon.py - Login lockout of security_addon.py, pasted into a minimal app
+import os
+
+import pytest
+from flask import Flask, jsonify, request
+from flask_sqlalchemy import SQLAlchemy
+
+import rate_limit
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'security_addon.py')
+
+@pytest.fixture
+def client(workdir, monkeypatch):
+    monkeypatch.setattr(rate_limit, '_limiter', rate_limit.MemoryLimiter())
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{workdir}/security.db'
+    db = SQLAlchemy(app)
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    # The add-on is meant to be pasted into an app that defines app and db
+    addon = {'__name__': 'security_addon', 'app': app, 'db': db}
+    with open(SOURCE) as f:
+        exec(compile(f.read(), SOURCE, 'exec'), addon)
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        email = request.form['email']
+        if not addon['check_login_attempts'](email):
+            return jsonify({'error': 'Too many failed attempts'}), 429
+        success = request.form['password'] == 'right'
+        addon['record_login_attempt'](email, success)
+        return jsonify({'success': success}), 200 if success else 401
+
+    with app.app_context():
+        db.create_all()
+    return app.test_client(), addon, app, db
+
+def test_sixth_bad_password_is_refused(client):
+    client, _, _, _ = client
+    for _ in range(5):
+        assert client.post('/login', data={'email': 'a@x', 'password': 'wrong'}).status_code == 401
+    assert client.post('/login', data={'email': 'a@x', 'password': 'wrong'}).status_code == 429
+    assert client.post('/login', data={'email': 'A@x ', 'password': 'right'}).status_code == 429
+    assert client.post('/login', data={'email': 'b@x', 'password': 'wrong'}).status_code == 401
+
+def test_checks_and_successes_do_not_count(client):
+    client, addon, app, db = client
+    for _ in range(10):
+        assert client.post('/login', data={'email': 'a@x', 'password': 'right'}).status_code == 200
+        assert addon['check_login_attempts']('a@x')
+    for _ in range(4):
+        client.post('/login', data={'email': 'a@x', 'password': 'wrong'})
+    assert client.post('/login', data={'email': 'a@x', 'password': 'right'}).status_code == 200
+    with app.app_context():
+        assert addon['LoginAttempt'].query.filter_by(success=False).count() == 4